@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# Copyright 2015 Sam Thursfield
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Compare batched and per-triple insertion in the Baserock importer.
+
+Each mode is run in a separate process, so that the peak RSS figures
+don't interfere with each other. The timings include parsing the .morph
+files, which costs the same in both modes.
+
+'''
+
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'import'))
+
+import baserock_definitions
+
+
+MODES = {
+    'per-triple': False,
+    'batched': True,
+}
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Compare batched and per-triple graph construction")
+    parser.add_argument('input_location', type=str,
+                        help="Path to the root of a definitions repository")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Number of runs of each mode (default: "
+                             "%(default)s)")
+    parser.add_argument('--run-one', choices=MODES.keys(),
+                        help=argparse.SUPPRESS)
+    return parser
+
+
+def run_one(input_location, mode):
+    warnings.simplefilter('ignore')
+
+    importer = baserock_definitions.BaserockDefinitionsImporter(
+        'http://example.com/', batched=MODES[mode])
+
+    start = time.perf_counter()
+    graph = importer.load_all_morphologies(input_location)
+    wall_time = time.perf_counter() - start
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        'mode': mode,
+        'wall_time': wall_time,
+        'peak_rss_kb': usage.ru_maxrss,
+        'triples': len(graph),
+    }
+
+
+def main():
+    args = argument_parser().parse_args()
+
+    if args.run_one:
+        json.dump(run_one(args.input_location, args.run_one), sys.stdout)
+        return
+
+    results = []
+    for mode in MODES:
+        for i in range(args.repeat):
+            output = subprocess.check_output(
+                [sys.executable, __file__, '--run-one', mode,
+                 args.input_location])
+            results.append(json.loads(output.decode('utf8')))
+
+    triple_counts = set(result['triples'] for result in results)
+    if len(triple_counts) != 1:
+        raise RuntimeError("Modes produced different numbers of triples: %s" %
+                           sorted(triple_counts))
+
+    print("%-12s %12s %14s" % ('mode', 'best time/s', 'peak RSS/MiB'))
+    for mode in MODES:
+        mode_results = [r for r in results if r['mode'] == mode]
+        print("%-12s %12.3f %14.1f" % (
+            mode,
+            min(r['wall_time'] for r in mode_results),
+            max(r['peak_rss_kb'] for r in mode_results) / 1024.0))
+    print("%i triples" % triple_counts.pop())
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# Copyright 2015 Sam Thursfield
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Generate synthetic input data for the importers.
+
+The output is deterministic for a given set of sizes and seed, so results
+from different runs can be compared. Nothing is fetched from the network.
+
+To write a definitions tree and a manifest to disk:
+
+    python3 benchmarks/generate.py definitions /tmp/defs --strata 50 --chunks 40
+    python3 benchmarks/generate.py manifest /tmp/manifest.json --components 2000
+
+'''
+
+
+import argparse
+import hashlib
+import json
+import os
+import random
+
+
+DEFAULTS = '''\
+split-rules:
+  chunk:
+  - artifact: -bins
+    include: ['(usr/)?s?bin/.*']
+  - artifact: -libs
+    include: ['(usr/)?lib(32|64)?/lib[^/]*\\.so(\\.\\d+)*']
+  - artifact: -devel
+    include: ['(usr/)?include/.*', '(usr/)?lib(32|64)?/lib.*\\.a']
+  - artifact: -doc
+    include: ['(usr/)?share/doc/.*']
+  - artifact: -locale
+    include: ['(usr/)?share/locale/.*']
+  - artifact: -debug
+    include: ['(usr/)?lib/\\.debug/.*']
+  - artifact: -misc
+    include: ['.*']
+  stratum:
+  - artifact: -devel
+    include: ['.*-devel', '.*-debug', '.*-doc']
+  - artifact: -runtime
+    include: ['.*-bins', '.*-libs', '.*-locale', '.*-misc', '.*']
+'''
+
+ARCHITECTURES = ['x86_64', 'armv7lhf', 'armv8l64', 'ppc64', 'x86_32']
+
+
+def fake_sha1(*parts):
+    return hashlib.sha1('/'.join(parts).encode('utf8')).hexdigest()
+
+
+def write_file(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def generate_definitions(path, systems=2, architectures=2, strata=10,
+                         chunks=20, seed=0):
+    '''Write a synthetic Baserock definitions tree at 'path'.
+
+    Each of the 'systems' is defined once per architecture and contains every
+    stratum. Each stratum build-depends on up to two earlier strata. Half
+    of the chunks in each stratum have their own .morph file, the other half
+    just name a build system.
+
+    Returns the number of .morph files written.
+
+    '''
+    rng = random.Random(seed)
+    count = 0
+
+    write_file(os.path.join(path, 'VERSION'), 'version: 7\n')
+    write_file(os.path.join(path, 'DEFAULTS'), DEFAULTS)
+
+    for i in range(strata):
+        name = 'stratum%i' % i
+        lines = ['name: %s' % name, 'kind: stratum']
+        if i > 0:
+            lines.append('build-depends:')
+            for dep in sorted(rng.sample(range(i), min(i, 2))):
+                lines.append('- morph: strata/stratum%i.morph' % dep)
+        lines.extend(['products:',
+                      '- artifact: %s-runtime' % name,
+                      '- artifact: %s-devel' % name,
+                      'chunks:'])
+        for j in range(chunks):
+            chunk = '%s-chunk%i' % (name, j)
+            lines.extend(['- name: %s' % chunk,
+                          '  repo: upstream:%s' % chunk,
+                          '  ref: %s' % fake_sha1(name, chunk),
+                          "  unpetrify-ref: '%i.%i'" % (i, j)])
+            if j % 2 == 0:
+                morph = 'strata/%s/%s.morph' % (name, chunk)
+                lines.append('  morph: %s' % morph)
+                write_file(os.path.join(path, morph),
+                           'name: %s\nkind: chunk\nbuild-system: autotools\n'
+                           'configure-commands:\n- ./configure --prefix=/usr\n'
+                           % chunk)
+                count += 1
+            else:
+                lines.append('  build-system: autotools')
+            if j > 0:
+                deps = rng.sample(range(j), min(j, 3))
+                lines.append('  build-depends: [%s]' % ', '.join(
+                    '%s-chunk%i' % (name, dep) for dep in sorted(deps)))
+        write_file(os.path.join(path, 'strata', name + '.morph'),
+                   '\n'.join(lines) + '\n')
+        count += 1
+
+    for i in range(systems):
+        for arch in ARCHITECTURES[:architectures]:
+            name = 'system%i-%s' % (i, arch)
+            lines = ['name: %s' % name, 'kind: system', 'arch: %s' % arch,
+                     'strata:']
+            for j in range(strata):
+                lines.extend(['- name: stratum%i' % j,
+                              '  morph: strata/stratum%i.morph' % j])
+            write_file(os.path.join(path, 'systems', name + '.morph'),
+                       '\n'.join(lines) + '\n')
+            count += 1
+
+    return count
+
+
+def generate_manifest(components=500, aliases=40, seed=0):
+    '''Return a synthetic GNOME Continuous manifest, as a Python dict.
+
+    Most components use a keyed URL with one of the 'aliases' from
+    'vcsconfig'; a few use plain 'git:' or 'tarball:' URLs, like the real
+    manifests do.
+
+    '''
+    rng = random.Random(seed)
+
+    vcsconfig = {}
+    for i in range(aliases):
+        # Some real aliases start with a digit, e.g. '0pointer'.
+        key = '%ialias' % i if i % 10 == 0 else 'alias%i' % i
+        vcsconfig[key] = 'git:git://git.example%i.org/' % i
+
+    keys = sorted(vcsconfig.keys())
+    component_list = []
+    for i in range(components):
+        name = 'component%i' % i
+        kind = rng.random()
+        if kind < 0.05:
+            src = 'tarball:http://download.example.org/%s-1.%i.tar.xz' % (
+                name, i)
+        elif kind < 0.1:
+            src = 'git:git://github.com/example/%s' % name
+        else:
+            src = '%s:%s' % (rng.choice(keys), name)
+        component = {'src': src, 'branch': 'master'}
+        if kind > 0.8:
+            component['config-opts'] = ['--disable-%s' % name]
+        component_list.append(component)
+
+    return {
+        '00ostbuild-manifest-version': 0,
+        'osname': 'synthetic',
+        'architectures': ['x86_64'],
+        'vcsconfig': vcsconfig,
+        'components': component_list,
+    }
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic input data for the importers")
+    parser.add_argument('--seed', type=int, default=0)
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    definitions = subparsers.add_parser(
+        'definitions', help="Generate a Baserock definitions tree")
+    definitions.add_argument('output_location', type=str)
+    definitions.add_argument('--systems', type=int, default=2)
+    definitions.add_argument('--architectures', type=int, default=2)
+    definitions.add_argument('--strata', type=int, default=10)
+    definitions.add_argument('--chunks', type=int, default=20)
+
+    manifest = subparsers.add_parser(
+        'manifest', help="Generate a GNOME Continuous manifest")
+    manifest.add_argument('output_location', type=str)
+    manifest.add_argument('--components', type=int, default=500)
+    manifest.add_argument('--aliases', type=int, default=40)
+    return parser
+
+
+def main():
+    args = argument_parser().parse_args()
+
+    if args.command == 'definitions':
+        generate_definitions(args.output_location, systems=args.systems,
+                             architectures=args.architectures,
+                             strata=args.strata, chunks=args.chunks,
+                             seed=args.seed)
+    elif args.command == 'manifest':
+        manifest = generate_manifest(components=args.components,
+                                     aliases=args.aliases, seed=args.seed)
+        with open(args.output_location, 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# Copyright 2015 Sam Thursfield
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Load test for the SPARQL endpoint.
+
+Several client threads send a mix of dashboard-style queries for a fixed
+time, then throughput and latency percentiles are reported. Either give
+graph files, and a server is started in this process on a free port, or
+point it at a running server with --url.
+
+    python3 benchmarks/load_test.py --graph definitions.rdfxml --clients 16
+    python3 benchmarks/load_test.py --url http://localhost:5000/sparql
+
+'''
+
+
+import argparse
+import collections
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import warnings
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'import'))
+
+import sparql_endpoint
+
+
+QUERIES = [
+    '''SELECT ?type (COUNT(?s) AS ?count)
+       WHERE { ?s a ?type } GROUP BY ?type''',
+    '''SELECT (COUNT(*) AS ?triples) WHERE { ?s ?p ?o }''',
+    '''PREFIX software: <http://www.baserock.org/software-integration-ontology#>
+       SELECT ?repo WHERE { ?repo a software:Repository } LIMIT 100''',
+    '''PREFIX software: <http://www.baserock.org/software-integration-ontology#>
+       SELECT ?source ?repo
+       WHERE { ?source software:hasRepository ?repo } LIMIT 100''',
+    '''PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+       SELECT ?s ?label WHERE { ?s rdfs:label ?label } LIMIT 50''',
+    '''ASK { ?s ?p ?o }''',
+]
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Measure throughput and latency of the SPARQL endpoint")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--graph', type=str, nargs='+',
+                        help="Start a local server for these graph files")
+    target.add_argument('--url', type=str,
+                        help="URL of a running SPARQL endpoint")
+    parser.add_argument('--clients', type=int, default=8,
+                        help="Number of concurrent clients "
+                             "(default: %(default)s)")
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help="How long to run for, in seconds "
+                             "(default: %(default)s)")
+    parser.add_argument('--threads', type=int, default=8,
+                        help="Request threads for the local server "
+                             "(default: %(default)s)")
+    parser.add_argument('--cache-size', type=int, default=1000,
+                        help="Result cache size for the local server; 0 "
+                             "disables caching (default: %(default)s)")
+    parser.add_argument('--output', '-o', type=str,
+                        help="Write results to this file as JSON")
+    return parser
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+
+def run_client(url, queries, offset, stop_time, latencies, errors):
+    i = offset
+    while time.monotonic() < stop_time:
+        query = queries[i % len(queries)]
+        i += 1
+        request_url = url + '?' + urllib.parse.urlencode({'query': query})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request_url) as response:
+                response.read()
+        except urllib.error.HTTPError as e:
+            errors[e.code] += 1
+            continue
+        except OSError as e:
+            errors[type(e).__name__] += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+def start_local_server(args):
+    source = sparql_endpoint.ReloadingGraph(args.graph)
+    endpoint = sparql_endpoint.SPARQLEndpoint(
+        source, cache_size=max(args.cache_size, 0))
+    server = sparql_endpoint.make_server(
+        sparql_endpoint.dispatch([('/sparql', endpoint)]),
+        host='127.0.0.1', port=0, threads=args.threads)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, 'http://127.0.0.1:%i/sparql' % server.server_port
+
+
+def main():
+    args = argument_parser().parse_args()
+    warnings.simplefilter('ignore')
+
+    server = None
+    if args.graph:
+        server, url = start_local_server(args)
+    else:
+        url = args.url
+
+    latencies = []
+    errors = collections.Counter()
+    stop_time = time.monotonic() + args.duration
+    clients = [threading.Thread(target=run_client,
+                                args=(url, QUERIES, i, stop_time,
+                                      latencies, errors))
+               for i in range(args.clients)]
+    start = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - start
+
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+
+    latencies.sort()
+    results = {
+        'clients': args.clients,
+        'duration': elapsed,
+        'requests': len(latencies),
+        'errors': dict((str(key), value) for key, value in errors.items()),
+        'throughput': len(latencies) / elapsed,
+        'latency_p50_ms': percentile(latencies, 0.50) * 1000,
+        'latency_p99_ms': percentile(latencies, 0.99) * 1000,
+        'latency_max_ms': (latencies[-1] if latencies else 0.0) * 1000,
+    }
+
+    print("%i requests in %.1fs from %i clients: %.1f requests/s" % (
+        results['requests'], elapsed, args.clients, results['throughput']))
+    print("latency: p50 %.2fms, p99 %.2fms, max %.2fms" % (
+        results['latency_p50_ms'], results['latency_p99_ms'],
+        results['latency_max_ms']))
+    if errors:
+        print("errors: %s" % ', '.join(
+            '%s: %i' % item for item in sorted(results['errors'].items())))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# Copyright 2015 Sam Thursfield
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Benchmark suite for the importers.
+
+Each benchmark generates synthetic input data of a given size (see
+generate.py), then times each phase of the import: walking the definitions
+tree, parsing, building the graph and serializing it. Peak RSS is recorded
+after each phase. Every benchmark runs in its own process, so that memory
+figures are independent.
+
+With --sink stream or --sink null, the importers' triples are streamed to
+N-Triples or just counted, instead of being collected in a graph, which
+shows how much of the time goes on rdflib.
+
+Results are written as JSON. Passing the results of an earlier run with
+--compare reports any phase that got slower by more than --threshold, and
+exits with an error if there are any, so this can be used in CI. Changes
+smaller than MIN_CHANGE are ignored, because they are mostly noise. Results
+are only compared if they were run with the same settings.
+
+    python3 benchmarks/run.py --sizes small,medium --output results.json
+    python3 benchmarks/run.py --compare results.json
+
+'''
+
+
+import rdflib
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'import'))
+
+import baserock_definitions
+import gnome_continuous
+import helpers
+
+import generate
+
+
+SIZES = {
+    'small': {
+        'definitions': dict(systems=1, architectures=2, strata=5, chunks=10),
+        'manifest': dict(components=200, aliases=20),
+    },
+    'medium': {
+        'definitions': dict(systems=2, architectures=2, strata=20, chunks=40),
+        'manifest': dict(components=2000, aliases=40),
+    },
+    'large': {
+        'definitions': dict(systems=4, architectures=3, strata=40, chunks=80),
+        'manifest': dict(components=20000, aliases=80),
+    },
+}
+
+# The one real input that we have.
+EXAMPLE_MANIFEST = os.path.join(BENCHMARKS_DIR, '..', 'examples',
+                                'gnome-continuous', 'manifest.20151221.json')
+
+BASE_URI = 'http://example.com/'
+
+SINKS = ['graph', 'stream', 'null']
+
+# A phase has only regressed if a metric grew by at least this much, as well
+# as by more than --threshold.
+MIN_CHANGE = {
+    'wall_time': 0.05,
+    'peak_rss_kb': 1024,
+}
+
+# Settings that change what is measured. Results are only comparable if
+# these are the same.
+COMPARED_SETTINGS = ['jobs', 'store', 'output_format', 'sink']
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the importers on synthetic data")
+    parser.add_argument('--sizes', type=str, default='small,medium',
+                        help="Comma-separated list of sizes to run, from: "
+                             "%s (default: %%(default)s)" %
+                             ', '.join(sorted(SIZES)))
+    parser.add_argument('--repeat', type=int, default=1,
+                        help="Run each benchmark this many times and keep "
+                             "the fastest time for each phase")
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help="Worker processes for parsing .morph files")
+    parser.add_argument('--store', choices=helpers.STORES, default='default')
+    parser.add_argument('--output-format', choices=helpers.OUTPUT_FORMATS,
+                        default='rdfxml')
+    parser.add_argument('--sink', choices=SINKS, default='graph',
+                        help="Where the importers' triples go: into an "
+                             "rdflib graph which is then serialized, "
+                             "streamed straight to N-Triples, or just "
+                             "counted (default: %(default)s)")
+    parser.add_argument('--output', '-o', type=str,
+                        help="Write results to this file as JSON")
+    parser.add_argument('--compare', type=str,
+                        help="Compare against results from an earlier run")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="Slowdown ratio that counts as a regression "
+                             "(default: %(default)s)")
+    parser.add_argument('--run-one', nargs=2, metavar=('IMPORTER', 'SIZE'),
+                        help=argparse.SUPPRESS)
+    return parser
+
+
+class PhaseTimer():
+    '''Record wall time and peak RSS for a sequence of phases.'''
+    def __init__(self):
+        self.phases = []
+
+    def run(self, name, function, *args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.phases.append({
+            'phase': name,
+            'wall_time': time.perf_counter() - start,
+            'peak_rss_kb': resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss,
+        })
+        return result
+
+
+def serialize(graph, output_format):
+    with open(os.devnull, 'wb') as f:
+        helpers.write_graph(graph, f, output_format=output_format,
+                            graph_name=BASE_URI)
+
+
+def make_sink(args, devnull):
+    if args.sink == 'stream':
+        return helpers.StreamSink(devnull)
+    return helpers.CountingSink()
+
+
+def run_definitions(size, args, tmpdir):
+    path = os.path.join(tmpdir, 'definitions')
+    generate.generate_definitions(path, **SIZES[size]['definitions'])
+
+    timer = PhaseTimer()
+    importer = baserock_definitions.BaserockDefinitionsImporter(
+        BASE_URI, store=args.store)
+
+    morph_paths = timer.run('walk', baserock_definitions.find_morph_files,
+                            path)
+    timer.run('parse', importer.load_morph_files, morph_paths,
+              jobs=args.jobs)
+
+    importer.load_version(path)
+    defaults = importer.load_defaults(path)
+    systems = [morph_path for morph_path in morph_paths
+               if importer.parsed_files[morph_path]['kind'] == 'system']
+
+    if args.sink != 'graph':
+        with open(os.devnull, 'wb') as devnull:
+            sink = timer.run('build', helpers.write_batches,
+                             importer.system_batches(path, systems, defaults),
+                             make_sink(args, devnull))
+        return timer, {'files': len(morph_paths), 'triples': sink.count}
+
+    timer.run('build', importer.add_systems, path, systems, defaults)
+    timer.run('serialize', serialize, importer.graph, args.output_format)
+
+    return timer, {'files': len(morph_paths), 'triples': len(importer.graph)}
+
+
+def run_manifest(size, args, tmpdir):
+    if size == 'example':
+        path = EXAMPLE_MANIFEST
+    else:
+        path = os.path.join(tmpdir, 'manifest.json')
+        with open(path, 'w') as f:
+            json.dump(generate.generate_manifest(**SIZES[size]['manifest']),
+                      f)
+
+    timer = PhaseTimer()
+
+    def parse():
+        with open(path) as f:
+            return json.load(f)
+    manifest = timer.run('parse', parse)
+
+    importer = gnome_continuous.GnomeContinuousImporter(store=args.store)
+
+    if args.sink != 'graph':
+        with open(os.devnull, 'wb') as devnull:
+            sink = timer.run('build', helpers.write_batches,
+                             importer.triple_batches(manifest, BASE_URI),
+                             make_sink(args, devnull))
+        return timer, {'files': 1, 'triples': sink.count}
+
+    graph = timer.run('build', importer.parse_manifest, manifest, BASE_URI)
+    timer.run('serialize', serialize, graph, args.output_format)
+
+    return timer, {'files': 1, 'triples': len(graph)}
+
+
+IMPORTERS = {
+    'definitions': run_definitions,
+    'manifest': run_manifest,
+}
+
+
+def run_one(importer, size, args):
+    warnings.simplefilter('ignore')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        timer, counts = IMPORTERS[importer](size, args, tmpdir)
+    result = {'importer': importer, 'size': size, 'phases': timer.phases}
+    result.update(counts)
+    return result
+
+
+def run_in_subprocess(importer, size, args):
+    command = [sys.executable, __file__, '--run-one', importer, size,
+               '--jobs', str(args.jobs), '--store', args.store,
+               '--output-format', args.output_format, '--sink', args.sink]
+    output = subprocess.check_output(command)
+    return json.loads(output.decode('utf8'))
+
+
+def merge_repeats(results):
+    '''Keep the fastest time for each phase over several runs.'''
+    merged = results[0]
+    for result in results[1:]:
+        for best, phase in zip(merged['phases'], result['phases']):
+            best['wall_time'] = min(best['wall_time'], phase['wall_time'])
+            best['peak_rss_kb'] = max(best['peak_rss_kb'],
+                                      phase['peak_rss_kb'])
+    return merged
+
+
+def compare(old_results, new_results, threshold):
+    '''Return a list of messages describing any regressions.'''
+    def key(result):
+        return result['importer'], result['size']
+
+    old_by_key = {key(result): result for result in old_results}
+    regressions = []
+    for result in new_results:
+        old = old_by_key.get(key(result))
+        if old is None:
+            continue
+        old_phases = {phase['phase']: phase for phase in old['phases']}
+        for phase in result['phases']:
+            old_phase = old_phases.get(phase['phase'])
+            if old_phase is None:
+                continue
+            for metric, min_change in MIN_CHANGE.items():
+                if old_phase[metric] > 0 and \
+                        phase[metric] > old_phase[metric] * threshold and \
+                        phase[metric] - old_phase[metric] >= min_change:
+                    regressions.append(
+                        "%s/%s %s: %s went from %.3f to %.3f" % (
+                            result['importer'], result['size'],
+                            phase['phase'], metric, old_phase[metric],
+                            phase[metric]))
+    return regressions
+
+
+def check_comparable(old_report, settings):
+    '''Raise RuntimeError if 'old_report' was run with different settings.'''
+    old_settings = old_report.get('settings', {})
+    differences = [
+        '%s (%s, now %s)' % (name, old_settings.get(name), settings[name])
+        for name in COMPARED_SETTINGS
+        if old_settings.get(name) != settings[name]]
+    if differences:
+        raise RuntimeError("Can't compare with results that were run with "
+                           "different settings: %s" % ', '.join(differences))
+
+
+def print_results(results):
+    print("%-12s %-8s %-10s %9s %12s %10s" % (
+        'importer', 'size', 'phase', 'time/s', 'peak RSS/MiB', 'triples'))
+    for result in results:
+        for phase in result['phases']:
+            print("%-12s %-8s %-10s %9.3f %12.1f %10i" % (
+                result['importer'], result['size'], phase['phase'],
+                phase['wall_time'], phase['peak_rss_kb'] / 1024.0,
+                result['triples']))
+
+
+def main():
+    args = argument_parser().parse_args()
+
+    if args.run_one:
+        importer, size = args.run_one
+        json.dump(run_one(importer, size, args), sys.stdout)
+        return
+
+    sizes = args.sizes.split(',')
+    for size in sizes:
+        if size not in SIZES:
+            raise RuntimeError("Unknown size: %s" % size)
+
+    settings = {
+        'jobs': args.jobs,
+        'store': args.store,
+        'output_format': args.output_format,
+        'sink': args.sink,
+        'repeat': args.repeat,
+    }
+
+    old_report = None
+    if args.compare:
+        with open(args.compare) as f:
+            old_report = json.load(f)
+        check_comparable(old_report, settings)
+
+    benchmarks = [('manifest', 'example')]
+    for size in sizes:
+        benchmarks.append(('definitions', size))
+        benchmarks.append(('manifest', size))
+
+    results = []
+    for importer, size in benchmarks:
+        runs = [run_in_subprocess(importer, size, args)
+                for i in range(args.repeat)]
+        results.append(merge_repeats(runs))
+
+    print_results(results)
+
+    report = {
+        'python': platform.python_version(),
+        'rdflib': rdflib.__version__,
+        'platform': platform.platform(),
+        'settings': settings,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if old_report is not None:
+        regressions = compare(old_report['results'], results, args.threshold)
+        if regressions:
+            raise RuntimeError("Performance regressions found:\n  " +
+                               "\n  ".join(regressions))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
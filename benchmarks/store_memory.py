@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# Copyright 2015 Sam Thursfield
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Compare the memory used by rdflib stores to hold importer-shaped graphs.
+
+The triples are generated to look like the output of the Baserock importer:
+long URIs for stratum and chunk artifacts, with the usual -bins, -devel etc.
+suffixes. Each store is measured in a separate process.
+
+'''
+
+
+import rdflib
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'import'))
+
+import helpers
+
+
+BASE = 'http://example.com/'
+SOFTWARE = rdflib.Namespace(
+    'http://www.baserock.org/software-integration-ontology#')
+SPLITS = ['bins', 'debug', 'devel', 'doc', 'libs', 'locale', 'misc']
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Measure memory use of rdflib stores")
+    parser.add_argument('--triples', type=int, default=1000000,
+                        help="Number of triples to generate (default: "
+                             "%(default)s)")
+    parser.add_argument('--run-one', choices=helpers.STORES,
+                        help=argparse.SUPPRESS)
+    return parser
+
+
+def generate_triples(count):
+    '''Yield 'count' triples shaped like the Baserock importer's output.'''
+    produced = 0
+    i = 0
+    while True:
+        arch = ['x86_64', 'armv7lhf', 'ppc64'][i % 3]
+        stratum = 'stratum%i' % (i // 3)
+        stratum_source = rdflib.URIRef(
+            BASE + 'build-instructions/strata/%s-%s' % (stratum, arch))
+        stratum_artifact = rdflib.URIRef(
+            BASE + 'groups/strata/%s-runtime-%s' % (stratum, arch))
+        for chunk_number in range(100):
+            chunk = 'chunk%i' % chunk_number
+            chunk_source = rdflib.URIRef(stratum_source + '/' + chunk)
+            commit = rdflib.URIRef(BASE + 'git/upstream:%s/%040x' %
+                                   (chunk, chunk_number))
+            yield chunk_source, rdflib.RDF.type, SOFTWARE.BuildInstructions
+            yield commit, rdflib.RDF.type, SOFTWARE.Source
+            produced += 2
+            for split in SPLITS:
+                artifact = rdflib.URIRef(
+                    stratum_artifact + '/%s-%s' % (chunk, split))
+                yield artifact, rdflib.RDF.type, SOFTWARE.Artifact
+                yield artifact, SOFTWARE.forArchitecture, rdflib.Literal(arch)
+                yield artifact, SOFTWARE.source, commit
+                yield chunk_source, SOFTWARE.produces, artifact
+                yield stratum_artifact, SOFTWARE.containsArtifact, artifact
+                produced += 5
+                if produced >= count:
+                    return
+        i += 1
+
+
+def run_one(store, count):
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    graph = rdflib.Graph(store=store)
+    graph.addN((s, p, o, graph) for s, p, o in generate_triples(count))
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matches = sum(1 for t in graph.triples((None, rdflib.RDF.type, None)))
+    query_time = time.perf_counter() - start
+
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        'store': store,
+        'triples': len(graph),
+        'build_time': build_time,
+        'query_time': query_time,
+        'memory_kb': peak_kb - baseline_kb,
+    }
+
+
+def main():
+    args = argument_parser().parse_args()
+
+    if args.run_one:
+        json.dump(run_one(args.run_one, args.triples), sys.stdout)
+        return
+
+    print("%-10s %10s %12s %12s %20s" % ('store', 'triples', 'build/s',
+                                         'query/s', 'MiB per 1M triples'))
+    for store in helpers.STORES:
+        output = subprocess.check_output(
+            [sys.executable, __file__, '--run-one', store,
+             '--triples', str(args.triples)])
+        result = json.loads(output.decode('utf8'))
+        per_million = (result['memory_kb'] / 1024.0 /
+                       (result['triples'] / 1000000.0))
+        print("%-10s %10i %12.2f %12.2f %20.1f" % (
+            store, result['triples'], result['build_time'],
+            result['query_time'], per_million))
+
+
+if __name__ == '__main__':
+    main()
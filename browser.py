@@ -1,13 +1,102 @@
-import rdflib_web.lod
-from flask import Flask
-
 import rdflib
 
-graph = rdflib.Graph()
-#graph.load('foo.json', format='json-ld')
-graph.load('foo.rdfxml', format='xml')
-graph.load('definitions.rdfxml', format='xml')
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'import'))
+
+import helpers
+import resource_browser
+import snapshot
+import sparql_endpoint
+
+# A snapshot can be compiled from the importers' output with:
+#
+#   python3 import/snapshot.py compile graph.sqlite foo.rdfxml definitions.rdfxml
+#
+# Opening it doesn't require parsing anything, so startup is much faster.
+SNAPSHOT = 'graph.sqlite'
+
+GRAPH_FILES = ['foo.rdfxml', 'definitions.rdfxml']
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Browse the imported data in a web browser")
+    parser.add_argument('--production', action='store_true',
+                        help="Serve with a pool of threads instead of the "
+                             "Flask debug server, and provide a cached "
+                             "SPARQL endpoint at /sparql")
+    parser.add_argument('--backend', choices=['rdflib-web', 'indexed'],
+                        default='rdflib-web',
+                        help="Use the rdflib-web browser, or the one from "
+                             "import/resource_browser.py, which copes with "
+                             "many resources that share a name and is always "
+                             "served with a pool of threads (default: "
+                             "%(default)s)")
+    resource_browser.add_browser_arguments(parser)
+    sparql_endpoint.add_server_arguments(parser)
+    # Flask's default.
+    parser.set_defaults(port=5000)
+    return parser
+
+
+args = argument_parser().parse_args()
+
+if os.path.exists(SNAPSHOT):
+    paths = [SNAPSHOT]
+else:
+    paths = GRAPH_FILES
+
+if args.backend == 'indexed':
+    logging.basicConfig(level=logging.INFO)
+
+    # Both the browser and the SPARQL endpoint reload the graph when the
+    # files change.
+    source = sparql_endpoint.ReloadingGraph(paths)
+    app = resource_browser.ResourceBrowser(
+        source, page_size=args.page_size, cache_size=args.cache_size)
+    routes = []
+    if args.production:
+        endpoint = sparql_endpoint.SPARQLEndpoint(
+            source, cache_size=args.cache_size, time_limit=args.time_limit)
+        routes.append(('/sparql', endpoint))
+
+    server = sparql_endpoint.make_server(
+        sparql_endpoint.dispatch(routes, default=app),
+        args.host, args.port, args.threads)
+    server.serve_forever()
+elif args.production:
+    import rdflib_web.lod
+
+    logging.basicConfig(level=logging.INFO)
+
+    # The SPARQL endpoint reloads the graph when the files change. The
+    # browsing pages keep using the graph that was loaded at startup.
+    source = sparql_endpoint.ReloadingGraph(paths)
+    endpoint = sparql_endpoint.SPARQLEndpoint(
+        source, cache_size=args.cache_size, time_limit=args.time_limit)
+    app = rdflib_web.lod.get(source.graph)
+
+    server = sparql_endpoint.make_server(
+        sparql_endpoint.dispatch([('/sparql', endpoint)], default=app),
+        args.host, args.port, args.threads)
+    server.serve_forever()
+else:
+    import rdflib_web.lod
+
+    if os.path.exists(SNAPSHOT):
+        graph = snapshot.open_snapshot(SNAPSHOT)
+    else:
+        # The 'Compact' store (from helpers) uses much less memory than the
+        # default in-memory store.
+        graph = rdflib.Graph(store='Compact')
+        #graph.load('foo.json', format='json-ld')
+        for path in GRAPH_FILES:
+            graph.load(path, format='xml')
 
-app = rdflib_web.lod.get(graph)
+    app = rdflib_web.lod.get(graph)
 
-app.run(host="0.0.0.0", debug=True)
+    app.run(host=args.host, port=args.port, debug=True)
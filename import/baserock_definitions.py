@@ -23,6 +23,13 @@ The current version of the Baserock Definitions format is defined at:
 
     http://wiki.baserock.org/definitions/current
 
+The definitions can be read from a working tree, or from any commit of a
+local Git repo without checking it out, by giving the location as
+<repo>@<ref>:
+
+    python3 import/baserock_definitions.py definitions@baserock-15.34 \\
+        http://example.com/
+
 '''
 
 
@@ -31,13 +38,22 @@ import rdflib.collection
 import yaml
 
 import argparse
+import collections
+import concurrent.futures
 import logging
+import multiprocessing
 import os
 import sys
+import time
 import urllib.parse
 import warnings
 
+import git_objects
 import helpers
+import materialize
+import morph_cache
+import splitting
+import validate
 
 
 DEFAULT_URL = \
@@ -48,6 +64,10 @@ RDF = rdflib.RDF
 SOFTWARE = rdflib.namespace.Namespace(
     'http://www.baserock.org/software-integration-ontology#')
 
+# The libyaml-based loader is many times faster than the pure-Python one, but
+# it's only available if PyYAML was built against libyaml.
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
 
 class AppendCommaSeparatedListAction(argparse.Action):
     '''Collect multiple string arguments and allow comma-delimited lists.
@@ -67,18 +87,39 @@ def argument_parser():
     parser = argparse.ArgumentParser(
         description="Parse a Baserock definitions repository")
     parser.add_argument('input_location', type=str,
-                        help="Path to the root of the definitions repository")
+                        help="Path to the root of the definitions repository, "
+                             "or <repo>@<ref> to read a commit of a local Git "
+                             "repo directly")
     parser.add_argument('output_location', type=str,
                         help="Location of the resulting resources (base URI)")
     parser.add_argument('--architectures', '-a',
                         action=AppendCommaSeparatedListAction,
                         help="Only import definitions for the given "
                              "architectures.")
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help="Number of worker processes to use for parsing "
+                             ".morph files and building systems (default: "
+                             "%(default)s)")
+    parser.add_argument('--cache-dir', type=str,
+                        default=morph_cache.default_cache_dir(),
+                        help="Where to keep the cache of parsed .morph files "
+                             "(default: %(default)s)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Parse every .morph file, ignoring and not "
+                             "updating the cache.")
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help="Log progress, with triple counts and timings "
+                             "for each system, to stderr.")
+    helpers.add_store_argument(parser)
+    helpers.add_output_arguments(parser)
+    validate.add_validate_arguments(parser)
+    materialize.add_materialize_arguments(parser)
+    helpers.add_stats_arguments(parser)
     return parser
 
 
-def parse_morph_file(path):
-    '''Parse an individual .morph file.
+def parse_morph_text(text):
+    '''Parse the contents of an individual .morph file.
 
     This function does a tiny amount of validation: checking the 'name' and
     'type' fields.
@@ -87,14 +128,115 @@ def parse_morph_file(path):
     from YAML.
 
     '''
-    with open(path) as f:
-        text = f.read()
-    contents = yaml.safe_load(text)
+    contents = yaml.load(text, Loader=YAML_LOADER)
     assert 'name' in contents
     assert contents['kind'] in ['cluster', 'system', 'stratum', 'chunk']
     return contents
 
 
+def parse_morph_file(path):
+    '''Parse an individual .morph file; see parse_morph_text().'''
+    with open(path) as f:
+        text = f.read()
+    return parse_morph_text(text)
+
+
+# These run in a worker process. Exceptions are returned as their repr()
+# because not every exception that PyYAML raises can be pickled.
+
+def _parse_morph_file_or_error(path):
+    try:
+        return path, parse_morph_file(path), None
+    except Exception as e:
+        return path, None, repr(e)
+
+
+def _parse_morph_text_or_error(item):
+    path, text = item
+    try:
+        return path, parse_morph_text(text), None
+    except Exception as e:
+        return path, None, repr(e)
+
+
+def _parse_all(parse_function, items, jobs):
+    if jobs is None or jobs <= 1 or len(items) <= 1:
+        results = map(parse_function, items)
+        executor = None
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+        chunksize = max(1, len(items) // (jobs * 4))
+        results = executor.map(parse_function, items, chunksize=chunksize)
+
+    try:
+        for path, contents, error in results:
+            if error is not None:
+                raise RuntimeError("Error while loading %s: %s" %
+                                   (os.path.basename(path), error))
+            yield path, contents
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def parse_morph_files(paths, jobs=1):
+    '''Parse many .morph files, possibly using a pool of worker processes.
+
+    Yields (path, contents) pairs in the same order as 'paths', regardless of
+    the number of jobs. If any file fails to parse, RuntimeError is raised for
+    the first such file.
+
+    '''
+    return _parse_all(_parse_morph_file_or_error, paths, jobs)
+
+
+def parse_morph_texts(items, jobs=1):
+    '''Like parse_morph_files(), for a list of (path, text) pairs.'''
+    return _parse_all(_parse_morph_text_or_error, items, jobs)
+
+
+# State for add_systems() worker processes, set up by _init_system_worker().
+_system_worker = None
+
+
+def _init_system_worker(base_uri, parsed_files, toplevel_path, defaults,
+                        stats_enabled):
+    global _system_worker
+    importer = BaserockDefinitionsImporter(base_uri, batched=True)
+    importer.parsed_files = parsed_files
+    _system_worker = (importer, toplevel_path, defaults, stats_enabled)
+
+
+def _build_system_in_worker(system_filename):
+    # Runs in a worker process. Rather than returning a graph, this returns
+    # the set() and add() calls that building the system made, in the form
+    # given by helpers.TripleBuffer.export(). Replaying these in the parent
+    # in the same order as a serial import gives an identical graph. The
+    # worker's timings and counters for the system are returned too, so the
+    # parent can merge them into its own.
+    importer, toplevel_path, defaults, stats_enabled = _system_worker
+    importer.triple_buffer = helpers.TripleBuffer(importer.graph)
+    importer.resource_cache = {}
+    if stats_enabled:
+        importer.stats = helpers.ImportStats()
+    importer.add_system(toplevel_path, importer.parsed_files[system_filename],
+                        defaults)
+    stats = importer.stats.export() if stats_enabled else None
+    return importer.triple_buffer.export(), stats
+
+
+def find_morph_files(path):
+    '''Return the paths of all .morph files in a definitions repo.'''
+    morph_paths = []
+    for dirname, dirnames, filenames in os.walk(path):
+        if '.git' in dirnames:
+            dirnames.remove('.git')
+        for filename in sorted(filenames):
+            if filename.endswith('.morph'):
+                morph_paths.append(os.path.join(dirname, filename))
+    return morph_paths
+
+
 def uriref(resource):
     return rdflib.URIRef(resource.identifier)
 
@@ -131,7 +273,9 @@ class BaserockSoftwareNamespace(helpers.SoftwareNamespace):
         #
         # The name is appended to the last path element because the
         # rdflib-web browser gets very slow if there are lots of resources with
-        # the same basename.
+        # the same basename. (The indexed backend of browser.py, from
+        # resource_browser.py, doesn't have that problem, but existing URIs
+        # are kept as they are.)
         return self.build_instructions('strata/' + stratum_name + '-' + arch)
 
     def stratum_artifact(self, stratum_artifact_name, arch):
@@ -186,15 +330,34 @@ def to_property(name):
 
 
 class BaserockDefinitionsImporter():
-    def __init__(self, base_uri):
+    def __init__(self, base_uri, batched=True, store='default', stats=None):
         self.validate_base_uri(base_uri)
 
+        # Instrumentation hooks; see helpers.ImportStats.
+        self.stats = stats or helpers.NULL_STATS
+
         self.ns = BaserockSoftwareNamespace(base_uri)
 
-        self.graph = rdflib.Graph()
+        self.graph = rdflib.Graph(store=store)
         self.graph.bind('software', SOFTWARE)
 
+        # In batched mode, new triples are held in 'triple_buffer' until the
+        # end of each phase of the import. The resulting graph is the same
+        # either way.
+        if batched:
+            self.triple_buffer = helpers.TripleBuffer(self.graph)
+        else:
+            self.triple_buffer = None
+
         self.parsed_files = {}
+        self.resource_cache = {}
+        self.splitter = None
+
+        # For reading from Git repos: one reader for each repo, and the
+        # parsed contents of each blob, so that loading several refs of the
+        # same repo only parses the files that differ.
+        self.git_readers = {}
+        self.parsed_blobs = {}
 
     def validate_base_uri(self, base_uri):
         parts = urllib.parse.urlsplit(base_uri)
@@ -206,14 +369,23 @@ class BaserockDefinitionsImporter():
 
         Returns an rdflib.resource.Resource instance which can be used to query
         and update the information about the resource that is stored in
-        'graph'.
+        'graph'. In batched mode, a helpers.BufferedResource is returned
+        instead, which can only be used to update it.
 
         '''
-        entity = self.graph.resource(uriref)
+        if self.triple_buffer is None:
+            entity = self.graph.resource(uriref)
+        else:
+            entity = self.triple_buffer.resource(uriref)
         for rdf_type in types:
             entity.set(RDF.type, rdf_type)
         return entity
 
+    def flush(self):
+        '''Add any buffered triples to 'graph'.'''
+        if self.triple_buffer is not None:
+            self.triple_buffer.flush()
+
     def artifacts_for_stratum(self, source_name, arch,
                               include_list=[]):
         # FIXME: need to include all strata if 'include_list' isn't passed,
@@ -233,16 +405,11 @@ class BaserockDefinitionsImporter():
 
     def artifacts_for_chunk(self, stratum_artifact_uriref,
                             chunk_source_name, include_list=None):
-        # FIXME: need to read DEFAULTS instead of hardcoding this,
-        # and you need to allow for custom artifacts in the chunk .morph.
+        # Callers that know the chunk pass its artifacts from the splitting
+        # rules; see get_splitter().
         if include_list is None:
-            include_list = ['%s-bins' % chunk_source_name,
-                            '%s-debug' % chunk_source_name,
-                            '%s-devel' % chunk_source_name,
-                            '%s-doc' % chunk_source_name,
-                            '%s-libs' % chunk_source_name,
-                            '%s-locale' % chunk_source_name,
-                            '%s-misc' % chunk_source_name]
+            include_list = [chunk_source_name + suffix for suffix, patterns
+                            in splitting.DEFAULT_CHUNK_RULES]
 
         result = []
         for artifact in include_list:
@@ -251,58 +418,296 @@ class BaserockDefinitionsImporter():
             result.append(artifact_uriref)
         return result
 
-    def load_all_morphologies(self, path='.', limit_architectures=None):
+    def get_splitter(self, defaults):
+        '''Return a splitting.Splitter for the rules in 'defaults'.
+
+        The Splitter caches how each chunk is split, so the same one is
+        kept for as long as the same DEFAULTS is in use.
+
+        '''
+        if self.splitter is None or self.splitter.defaults is not defaults:
+            self.splitter = splitting.Splitter(defaults)
+        return self.splitter
+
+    def load_all_morphologies(self, path='.', limit_architectures=None,
+                              jobs=1, cache=None):
         '''Load Baserock Definitions serialisation format V7 as an RDFLib 'graph'.
 
         This code does very little validation, so the 'graph' that it returns
         may not fully make sense according to the Baserock data model.
 
+        'path' can also be a location of the form <repo>@<ref>, see
+        load_definitions_from_git().
+
+        The .morph files are parsed using up to 'jobs' worker processes. If
+        'cache' is a morph_cache.MorphologyCache instance, only files that
+        aren't already in the cache are parsed, and the cache is updated.
+
         '''
-        logging.info('Parsing .morph files...')
+        defaults, systems = self.load_definitions(path, jobs=jobs, cache=cache)
+        self.add_systems(path, systems, defaults, limit_architectures,
+                         jobs=jobs)
+        return self.graph
 
-        with open(os.path.join(path, 'VERSION')) as f:
-            data = yaml.load(f)
-            version = data['version']
+    def triple_batches(self, path='.', limit_architectures=None, jobs=1,
+                       cache=None):
+        '''Import a definitions repo as a stream of helpers.TripleBatch.
+
+        This is like load_all_morphologies(), but nothing is added to 'graph':
+        the triples for each system are yielded as soon as it has been built,
+        to be passed to one of the sinks in 'helpers'. Only batched mode is
+        supported.
+
+        '''
+        if self.triple_buffer is None:
+            raise RuntimeError("Streaming import needs batched mode")
+        defaults, systems = self.load_definitions(path, jobs=jobs, cache=cache)
+        return self.system_batches(path, systems, defaults,
+                                   limit_architectures, jobs=jobs)
+
+    def load_definitions(self, path, jobs=1, cache=None):
+        '''Parse everything in a definitions repo, ready to add systems.
+
+        Returns the contents of DEFAULTS and the paths of every system.
+
+        '''
+        location = git_objects.parse_location(path)
+        if location is not None:
+            repo, ref = location
+            return self.load_definitions_from_git(repo, ref, jobs=jobs,
+                                                  cache=cache)
 
+        logging.info('Parsing .morph files...')
+
+        version = self.load_version(path)
         logging.info("Definitions version: %i", version)
 
         defaults = self.load_defaults(path)
 
+        with self.stats.phase('walk'):
+            morph_paths = find_morph_files(path)
+        with self.stats.phase('parse'):
+            self.load_morph_files(morph_paths, jobs=jobs, cache=cache)
+
+        systems = [morph_path for morph_path in morph_paths
+                   if self.parsed_files[morph_path]['kind'] == 'system']
+        return defaults, systems
+
+    def git_reader(self, repo):
+        if repo not in self.git_readers:
+            self.git_readers[repo] = git_objects.GitObjectReader(repo)
+        return self.git_readers[repo]
+
+    def load_definitions_from_git(self, repo, ref, jobs=1, cache=None):
+        '''Like load_definitions(), reading 'ref' from the Git repo 'repo'.
+
+        Files are read from the object database, so nothing needs to be
+        checked out. They are entered in 'parsed_files' under the path
+        <repo>@<ref>/<filename>, and <repo>@<ref> takes the place of the
+        toplevel path for add_systems().
+
+        Each blob is only parsed once, however many refs or paths it appears
+        in. If 'cache' is a morph_cache.GitBlobCache instance, blobs parsed
+        by earlier imports are taken from there.
+
+        '''
+        toplevel_path = '%s@%s' % (repo, ref)
+        logging.info('Reading .morph files from %s...', toplevel_path)
+
+        reader = self.git_reader(repo)
+        with self.stats.phase('walk'):
+            commit = reader.resolve(ref)
+            entries = [entry for entry in reader.list_tree(commit)
+                       if entry.type == 'blob']
+
+        version_text = reader.read_file(entries, 'VERSION')
+        if version_text is None:
+            raise RuntimeError("No VERSION file in %s" % toplevel_path)
+        version = self.parse_version(version_text)
+        logging.info("Definitions version: %i", version)
+
+        defaults = self.parse_defaults(reader.read_file(entries, 'DEFAULTS'))
+
+        morph_entries = [entry for entry in entries
+                         if entry.path.endswith('.morph')]
+        with self.stats.phase('parse'):
+            self.load_morph_blobs(reader, toplevel_path, morph_entries,
+                                  jobs=jobs, cache=cache)
+
         systems = []
+        for entry in morph_entries:
+            path = os.path.join(toplevel_path, entry.path)
+            self.parsed_files[path] = self.parsed_blobs[entry.object_id]
+            if self.parsed_files[path]['kind'] == 'system':
+                systems.append(path)
+        return defaults, systems
+
+    def load_morph_blobs(self, reader, toplevel_path, entries, jobs=1,
+                         cache=None):
+        '''Parse any of 'entries' whose blob isn't in 'parsed_blobs' yet.'''
+        unparsed = collections.OrderedDict()
+        for entry in entries:
+            if entry.object_id in self.parsed_blobs or \
+                    entry.object_id in unparsed:
+                continue
+            contents = cache.get(entry.object_id) if cache else None
+            if contents is None:
+                unparsed[entry.object_id] = entry.path
+            else:
+                self.parsed_blobs[entry.object_id] = contents
+
+        self.stats.count('files_found', len(entries))
+        self.stats.count('files_parsed', len(unparsed))
+
+        # Errors are reported using the path, so keep track of which blob
+        # each one came from.
+        object_ids = {}
+        items = []
+        for object_id, data in reader.read_blobs(unparsed):
+            path = os.path.join(toplevel_path, unparsed[object_id])
+            object_ids[path] = object_id
+            items.append((path, data.decode('utf8')))
+
+        for path, contents in parse_morph_texts(items, jobs=jobs):
+            self.parsed_blobs[object_ids[path]] = contents
+            if cache is not None:
+                cache.put(object_ids[path], contents)
+
+        if cache is not None:
+            cache.save()
+
+    def load_morph_files(self, morph_paths, jobs=1, cache=None):
+        '''Parse any of 'morph_paths' that aren't in 'parsed_files' yet.'''
+        morph_paths = [morph_path for morph_path in morph_paths
+                       if morph_path not in self.parsed_files]
+
+        if cache is None:
+            unparsed_paths = morph_paths
+        else:
+            unparsed_paths = []
+            for path in morph_paths:
+                contents = cache.get(path)
+                if contents is None:
+                    unparsed_paths.append(path)
+                else:
+                    self.parsed_files[path] = contents
+
+        self.stats.count('files_found', len(morph_paths))
+        self.stats.count('files_parsed', len(unparsed_paths))
+
+        for path, contents in parse_morph_files(unparsed_paths, jobs=jobs):
+            self.parsed_files[path] = contents
+            if cache is not None:
+                cache.put(path, contents)
+
+        if cache is not None:
+            cache.save()
+
+    def add_systems(self, toplevel_path, system_paths, defaults,
+                    limit_architectures=None, jobs=1):
+        '''Add the given systems, and everything they contain, to 'graph'.
+
+        If 'jobs' is more than 1, each system is built in a separate worker
+        process and the results are merged into 'graph' in order. The result
+        is the same as building them one by one.
 
-        toplevel_path = path
-        for dirname, dirnames, filenames in os.walk(path):
-            if '.git' in dirnames:
-                dirnames.remove('.git')
-            for filename in sorted(filenames):
-                if filename.endswith('.morph'):
-                    path = os.path.join(dirname, filename)
-                    if path not in self.parsed_files:
-                        try:
-                            contents = parse_morph_file(path)
-                            self.parsed_files[path] = contents
-                            if contents['kind'] == 'system':
-                                systems.append(path)
-                        except Exception as e:
-                            raise RuntimeError("Error while loading %s: %r" %
-                                               (filename, e))
-
-        for system_filename in systems:
+        '''
+        sink = helpers.GraphSink(self.graph)
+        for batch in self.system_batches(toplevel_path, system_paths,
+                                         defaults, limit_architectures, jobs):
+            with self.stats.phase('flush'):
+                sink.write(batch)
+        logging.info("Graph has %i triples", len(self.graph))
+
+    def take_batch(self):
+        '''Return the buffered triples as a helpers.TripleBatch.
+
+        In unbatched mode, triples go straight into 'graph' as they are
+        created, so the batch is always empty.
+
+        '''
+        if self.triple_buffer is None:
+            return helpers.TripleBatch([], ())
+        return self.triple_buffer.take()
+
+    def system_batches(self, toplevel_path, system_paths, defaults,
+                       limit_architectures=None, jobs=1):
+        '''Build the given systems, yielding a helpers.TripleBatch for each.'''
+        system_paths = [
+            system_filename for system_filename in system_paths
+            if limit_architectures is None or
+            self.parsed_files[system_filename]['arch'] in limit_architectures]
+
+        pending = self.take_batch()
+        if pending.triples:
+            yield pending
+
+        if jobs is not None and jobs > 1 and len(system_paths) > 1:
+            yield from self.system_batches_parallel(
+                toplevel_path, system_paths, defaults, jobs)
+            return
+
+        for system_filename in system_paths:
             contents = self.parsed_files[system_filename]
-            arch = contents['arch']
-            if limit_architectures is None or arch in limit_architectures:
+            start_time = time.perf_counter()
+
+            with self.stats.phase('add_system'):
                 self.add_system(toplevel_path, contents, defaults)
+                batch = self.take_batch()
+            self.stats.count('systems')
+
+            logging.info("Built system %s: %i triples in %.3fs",
+                         contents['name'], len(batch.triples),
+                         time.perf_counter() - start_time)
+            yield batch
+
+    def system_batches_parallel(self, toplevel_path, system_paths, defaults,
+                                jobs):
+        triple_buffer = helpers.TripleBuffer()
+
+        # The workers need the parsed .morph files. With the 'fork' start
+        # method they share the parent's copy rather than pickling it.
+        initargs = (str(self.ns), self.parsed_files, toplevel_path, defaults,
+                    self.stats.enabled)
+        with multiprocessing.Pool(min(jobs, len(system_paths)),
+                                  initializer=_init_system_worker,
+                                  initargs=initargs) as pool:
+            results = pool.imap(_build_system_in_worker, system_paths)
+            for system_filename in system_paths:
+                # Timed like the serial path, so that 'add_system' covers
+                # waiting for the worker and merging its triples.
+                with self.stats.phase('add_system'):
+                    exported, stats = next(results)
+                    triple_buffer.merge(exported)
+                    batch = triple_buffer.take()
+                if stats is not None:
+                    self.stats.merge(stats)
+                self.stats.count('systems')
+                logging.info("Built system %s: %i triples",
+                             self.parsed_files[system_filename]['name'],
+                             len(batch.triples))
+                yield batch
+
+    def load_version(self, path):
+        with open(os.path.join(path, 'VERSION')) as f:
+            return self.parse_version(f.read())
 
-        return self.graph
+    def parse_version(self, text):
+        data = yaml.load(text, Loader=YAML_LOADER)
+        return data['version']
 
     def load_defaults(self, path):
         defaults_file = os.path.join(path, 'DEFAULTS')
         if os.path.exists(defaults_file):
             with open(defaults_file) as f:
-                defaults = yaml.load(f)
+                return self.parse_defaults(f.read())
         else:
-            defaults = {}
-        return defaults
+            return self.parse_defaults(None)
+
+    def parse_defaults(self, text):
+        if text is None:
+            return {}
+        return yaml.load(text, Loader=YAML_LOADER)
 
         #if 'description' in contents:
         #    entity.set(DUBLIN_CORE.description,
@@ -313,6 +718,23 @@ class BaserockDefinitionsImporter():
         # '#' and dump that into a property. Or ruamel.yaml might help?
 
     def add_system(self, toplevel_path, contents, defaults):
+        artifact = self.add_system_artifact(contents)
+        arch = contents['arch']
+
+        for entry in contents.get('strata', []):
+            stratum_file = os.path.join(toplevel_path, entry['morph'])
+            self.build_stratum(toplevel_path, self.parsed_files[stratum_file],
+                               arch, defaults)
+            self.add_system_stratum(toplevel_path, artifact, entry, arch,
+                                    defaults)
+
+    def add_system_artifact(self, contents):
+        '''Create a system's BuildInstructions and the artifact it produces.
+
+        Returns the artifact. The strata are added by build_stratum() and
+        add_system_stratum().
+
+        '''
         source_uriref = self.ns.system(contents['name'])
         source = self.new_resource(
             source_uriref, types=[SOFTWARE.BuildInstructions])
@@ -322,28 +744,41 @@ class BaserockDefinitionsImporter():
             artifact_uriref,
             types=[SOFTWARE.Group, SOFTWARE.ExecutableArtifact])
 
-        arch = contents['arch']
-
         source.set(SOFTWARE.producesArtifact, artifact)
-        artifact.set(SOFTWARE.forArchitecture, rdflib.Literal(arch))
+        artifact.set(SOFTWARE.forArchitecture,
+                     rdflib.Literal(contents['arch']))
+        return artifact
 
-        for entry in contents.get('strata', []):
-            stratum_file = os.path.join(toplevel_path, entry['morph'])
-            contents = self.parsed_files[stratum_file]
+    def build_stratum(self, toplevel_path, contents, arch, defaults):
+        '''Add a stratum, with its chunks and artifacts, for one architecture.
 
+        The result doesn't depend on which system the stratum is in.
+
+        '''
+        with self.stats.phase('add_stratum'):
             stratum_source = self.add_stratum(
-                toplevel_path, contents, artifact, arch, defaults)
+                toplevel_path, contents, None, arch, defaults)
 
-            # All the artifacts need to be created even if they aren't included
-            # in the final system, because something might build-depend on
-            # them.
-            stratum_artifacts = self.add_stratum_artifacts(
+        # All the artifacts need to be created even if they aren't included
+        # in the final system, because something might build-depend on
+        # them.
+        with self.stats.phase('add_stratum_artifacts'):
+            self.add_stratum_artifacts(
                 toplevel_path, contents, stratum_source, arch, defaults)
+        self.stats.count('strata')
 
-            stratum_artifacts = self.artifacts_for_stratum(
-                entry['name'], arch, include_list=entry.get('artifacts'))
-            for stratum_artifact in stratum_artifacts:
-                artifact.add(SOFTWARE.containsArtifact, stratum_artifact)
+    def add_system_stratum(self, toplevel_path, system_artifact, entry, arch,
+                           defaults):
+        '''Add the artifacts of the stratum in 'entry' to a system.'''
+        include_list = entry.get('artifacts')
+        if include_list is None:
+            stratum_file = os.path.join(toplevel_path, entry['morph'])
+            include_list = self.get_splitter(defaults).stratum_rules(
+                self.parsed_files[stratum_file]).artifacts
+        stratum_artifacts = self.artifacts_for_stratum(
+            entry['name'], arch, include_list=include_list)
+        for stratum_artifact in stratum_artifacts:
+            system_artifact.add(SOFTWARE.containsArtifact, stratum_artifact)
 
     def add_stratum(self, toplevel_path, contents, system_artifact,
                     arch, defaults):
@@ -351,97 +786,88 @@ class BaserockDefinitionsImporter():
         source = self.new_resource(
             source_uriref, types=[SOFTWARE.BuildInstructions])
 
+        for build_dep_uriref in self.stratum_build_dependencies(
+                toplevel_path, contents, arch, defaults):
+            source.add(SOFTWARE.buildRequires, build_dep_uriref)
+
+        return source
+
+    def stratum_build_dependencies(self, toplevel_path, contents, arch,
+                                   defaults):
+        '''Return the artifacts of the strata in a stratum's build-depends.'''
+        splitter = self.get_splitter(defaults)
+        result = []
         for entry in contents.get('build-depends', []):
             build_dep_file = os.path.join(toplevel_path, entry['morph'])
             build_dep_contents = self.parsed_files[build_dep_file]
-            build_dep_name = build_dep_contents['name']
-            build_dep_artifacts = self.artifacts_for_stratum(
-                uriref(system_artifact), build_dep_name)
-            for build_dep_uriref in build_dep_artifacts:
-                source.add(SOFTWARE.buildRequires, build_dep_uriref)
-
-        return source
+            result.extend(self.artifacts_for_stratum(
+                build_dep_contents['name'], arch,
+                include_list=splitter.stratum_rules(
+                    build_dep_contents).artifacts))
+        return result
 
     def add_stratum_artifacts(self, toplevel_path, contents, source,
                               arch, defaults):
-        artifacts = []
-        for entry in contents.get('products', []):
-            artifact_uri = self.ns.stratum_artifact(entry['artifact'], arch)
+        splitter = self.get_splitter(defaults)
+
+        artifacts = collections.OrderedDict()
+        for artifact_name in splitter.stratum_rules(contents).artifacts:
+            artifact_uri = self.ns.stratum_artifact(artifact_name, arch)
             artifact = self.new_resource(
                 artifact_uri, types=[SOFTWARE.Group, SOFTWARE.Artifact])
-            if 'include' in entry:
-                # To handle 'include', we need to actually run the splitting
-                # rules against all the chunks that exist.
-                warnings.warn(
-                    "Ignoring 'include' list for %s" % artifact_uri)
             artifact.set(SOFTWARE.forArchitecture, rdflib.Literal(arch))
-            artifacts.append(artifact)
+            artifacts[artifact_name] = artifact
             source.add(SOFTWARE.produces, artifact)
 
-        for entry in contents.get('chunks', []):
-            # FIXME: these are Baserock-specific parameters... what to
-            # do? Set them in Baserock prefix for Baserock build tools
-            # to handle!
-            #chunk_ref.set(BASEROCK.buildMode,
-            #              rdflib.Literal(entry.get('build-mode', 'normal')))
-            #chunk_ref.set(BASEROCK.prefix,
-            #          rdflib.Literal(entry.get('prefix', '/usr')))
-
-            for artifact in artifacts:
-                if 'morph' in entry:
-                    chunk_file = os.path.join(toplevel_path, entry['morph'])
-                    chunk_contents = self.parsed_files[chunk_file]
-                    chunk_name = chunk_contents['name']
-                    if chunk_name != entry['name']:
-                        warnings.warn(
-                            "Chunk name %s in stratum %s doesn't match "
-                            "name from %s" % (entry['name'], source.identifier,
-                                              entry['morph']))
-
-                    chunk_contents = self.parsed_files[chunk_file]
-                    chunk_source = self.add_chunk(source, chunk_contents, arch)
-                else:
-                    chunk_name = entry['name']
-                    chunk_contents = None
-                    chunk_source = self.generate_chunk_morph(
-                        source, chunk_name, entry['build-system'], defaults)
-
-                for entry_dep in entry.get('build-depends', []):
+        # FIXME: these are Baserock-specific parameters... what to
+        # do? Set them in Baserock prefix for Baserock build tools
+        # to handle!
+        #chunk_ref.set(BASEROCK.buildMode,
+        #              rdflib.Literal(entry.get('build-mode', 'normal')))
+        #chunk_ref.set(BASEROCK.prefix,
+        #          rdflib.Literal(entry.get('prefix', '/usr')))
+
+        chunks = self.resolve_stratum_chunks(toplevel_path, contents, source,
+                                             arch, defaults)
+
+        # Each of a chunk's artifacts goes in one stratum artifact.
+        splits = {}
+        for entry, chunk_name, chunk_contents, chunk_source, commit in chunks:
+            splits[chunk_name] = splitter.split_chunk(
+                contents, entry, chunk_name, chunk_contents)
+
+        stratum_build_deps = self.stratum_build_dependencies(
+            toplevel_path, contents, arch, defaults)
+
+        for entry, chunk_name, chunk_contents, chunk_source, commit in chunks:
+            # A chunk is built against the strata that its stratum
+            # build-depends on, and every artifact of the chunks that it
+            # build-depends on.
+            for build_dep_uriref in stratum_build_deps:
+                chunk_source.add(SOFTWARE.buildRequires, build_dep_uriref)
+            for entry_dep in entry.get('build-depends', []):
+                if entry_dep not in splits:
+                    warnings.warn("Chunk %s in stratum %s build-depends on "
+                                  "unknown chunk %s" %
+                                  (chunk_name, source.identifier, entry_dep))
+                    continue
+                for artifact_name, build_dep_names in \
+                        splits[entry_dep].items():
                     build_dep_artifacts = self.artifacts_for_chunk(
-                        uriref(artifact), entry_dep)
-                    for build_dep_artifact in build_dep_artifacts:
-                        build_dep_uriref = self.ns.chunk_artifact(
-                            uriref(artifact), build_dep_artifact)
-                        chunk_source.set(
-                            SOFTWARE.BuildRequires, build_dep_uriref)
-
-                # FIXME: need to honour the splitting rules here
+                        uriref(artifacts[artifact_name]), entry_dep,
+                        include_list=build_dep_names)
+                    for build_dep_uriref in build_dep_artifacts:
+                        chunk_source.add(
+                            SOFTWARE.buildRequires, build_dep_uriref)
+
+            for artifact_name, chunk_artifact_names in \
+                    splits[chunk_name].items():
+                artifact = artifacts[artifact_name]
                 chunk_artifacts = self.add_chunk_artifacts(
                     chunk_source, artifact, chunk_name,
-                    chunk_contents, arch)
+                    chunk_contents, arch, include_list=chunk_artifact_names)
 
                 for chunk_artifact in chunk_artifacts:
-                    repo_uriref = self.ns.git_repository(entry['repo'])
-                    repo = self.new_resource(
-                        repo_uriref, types=[SOFTWARE.GitRepository])
-
-                    commit_uriref = self.ns.git_object(
-                        repo_uriref, entry['ref'])
-                    commit = self.new_resource(
-                        commit_uriref,
-                        types=[SOFTWARE.GitObject, SOFTWARE.Source])
-                    repo.set(SOFTWARE.containsArtifact, commit)
-
-                    # FIXME: unpetrify-ref: is it important to keep track of
-                    # the named ref in this data-model? I think you should
-                    # keep that as a note, it's up to the tooling...
-                    if 'unpetrify-ref' in entry:
-                        # This needs to be converted to a string as it may be
-                        # parsed as a floating point number by PyYAML.
-                        comment = 'unpetrify-ref:%s' % entry['unpetrify-ref']
-                        commit.set(SOFTWARE.hasComment,
-                                   rdflib.Literal(comment))
-
                     chunk_artifact.set(SOFTWARE.source, commit)
 
                     source.add(
@@ -449,6 +875,71 @@ class BaserockDefinitionsImporter():
                     artifact.add(
                         SOFTWARE.containsArtifact, chunk_artifact)
 
+    def resolve_stratum_chunks(self, toplevel_path, contents, source, arch,
+                               defaults):
+        '''Create the resources for each chunk in a stratum.
+
+        This deals with everything about a chunk that doesn't depend on
+        which of the stratum's artifacts it ends up in: the chunk's
+        BuildInstructions, and the Git repo and commit it is built from.
+
+        Returns a list of (entry, chunk name, chunk contents, chunk source,
+        commit) tuples, one for each entry in the 'chunks' list.
+
+        '''
+        result = []
+        for entry in contents.get('chunks', []):
+            if 'morph' in entry:
+                chunk_file = os.path.join(toplevel_path, entry['morph'])
+                chunk_contents = self.parsed_files[chunk_file]
+                chunk_name = chunk_contents['name']
+                if chunk_name != entry['name']:
+                    warnings.warn(
+                        "Chunk name %s in stratum %s doesn't match "
+                        "name from %s" % (entry['name'], source.identifier,
+                                          entry['morph']))
+
+                chunk_source = self.add_chunk(source, chunk_contents, arch)
+            else:
+                chunk_name = entry['name']
+                chunk_contents = None
+                chunk_source = self.generate_chunk_morph(
+                    source, chunk_name, entry['build-system'], defaults)
+
+            repo_uriref = self.ns.git_repository(entry['repo'])
+            repo = self.cached_resource(
+                repo_uriref, types=[SOFTWARE.GitRepository])
+
+            commit_uriref = self.ns.git_object(repo_uriref, entry['ref'])
+            commit = self.cached_resource(
+                commit_uriref, types=[SOFTWARE.GitObject, SOFTWARE.Source])
+            repo.set(SOFTWARE.containsArtifact, commit)
+
+            # FIXME: unpetrify-ref: is it important to keep track of
+            # the named ref in this data-model? I think you should
+            # keep that as a note, it's up to the tooling...
+            if 'unpetrify-ref' in entry:
+                # This needs to be converted to a string as it may be
+                # parsed as a floating point number by PyYAML.
+                comment = 'unpetrify-ref:%s' % entry['unpetrify-ref']
+                commit.set(SOFTWARE.hasComment,
+                           rdflib.Literal(comment))
+
+            result.append(
+                (entry, chunk_name, chunk_contents, chunk_source, commit))
+        return result
+
+    def cached_resource(self, uriref, types=[]):
+        '''Like new_resource(), but only creates each resource once.
+
+        This is for resources such as Git repos and commits which are shared
+        between many strata and systems.
+
+        '''
+        if uriref not in self.resource_cache:
+            self.resource_cache[uriref] = self.new_resource(uriref, types)
+        return self.resource_cache[uriref]
+
     def add_chunk(self, stratum_source, contents, arch):
         source_uriref = self.ns.chunk(uriref(stratum_source), contents['name'])
         source = self.new_resource(source_uriref,
@@ -456,21 +947,20 @@ class BaserockDefinitionsImporter():
         return source
 
     def add_chunk_artifacts(self, source, stratum_artifact, chunk_name,
-                            contents, arch):
-        # FIXME: need to honour the splitting rules here
+                            contents, arch, include_list=None):
         if contents is not None and chunk_name != contents['name']:
             warnings.warn("Chunk name %s doesn't match name %s in stratum %s" %
                           (chunk_name, contents['name'],
                            stratum_artifact))
         artifact_urirefs = self.artifacts_for_chunk(uriref(stratum_artifact),
-                                                    chunk_name)
+                                                    chunk_name, include_list)
         artifacts = []
         for artifact_uriref in artifact_urirefs:
             artifact = self.new_resource(artifact_uriref,
                                          types=[SOFTWARE.Artifact])
             artifact.set(SOFTWARE.forArchitecture, rdflib.Literal(arch))
             artifacts.append(artifact)
-            source.set(SOFTWARE.produces, artifact)
+            source.add(SOFTWARE.produces, artifact)
 
         return artifacts
         #def set_command_sequence(resource, name):
@@ -502,16 +992,96 @@ class BaserockDefinitionsImporter():
 def main():
     args = argument_parser().parse_args()
 
-    # FIXME: validate against schemas if present!
-    graph = BaserockDefinitionsImporter(args.output_location).load_all_morphologies(
-        path=args.input_location, limit_architectures=args.architectures)
-
-    #sys.stdout.write(helpers.serialize_to_json_ld(graph).decode('utf8'))
-    sys.stdout.write(helpers.serialize_to_rdfxml(graph).decode('utf8'))
-
-
-try:
-    main()
-except RuntimeError as e:
-    sys.stderr.write('%s\n' % e)
-    sys.exit(1)
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    location = git_objects.parse_location(args.input_location)
+    if args.no_cache:
+        cache = None
+    elif location is not None:
+        cache = morph_cache.GitBlobCache(args.cache_dir, location[0])
+    else:
+        cache = morph_cache.MorphologyCache(args.cache_dir,
+                                            args.input_location)
+
+    stats = helpers.stats_for_args(args)
+
+    validator = None
+    if args.validate:
+        validator = validate.Validator(validate.Ontology.load(args.validate))
+
+    schema = None
+    if args.materialize:
+        schema = materialize.Schema.load(args.materialize)
+
+    def run():
+        # FIXME: validate the input against schemas if present!
+        importer = BaserockDefinitionsImporter(args.output_location,
+                                               store=args.store, stats=stats)
+
+        if args.stream:
+            sink = helpers.CountingSink(
+                helpers.StreamSink(sys.stdout.buffer,
+                                   output_format=args.output_format,
+                                   graph_name=args.output_location,
+                                   compress=args.gzip),
+                by_type=stats.enabled)
+            counting_sink = sink
+            if schema is not None:
+                sink = materialize.InferringSink(sink, schema)
+            if validator is not None:
+                sink = validate.ValidatingSink(sink, validator)
+            batches = importer.triple_batches(
+                path=args.input_location,
+                limit_architectures=args.architectures, jobs=args.jobs,
+                cache=cache)
+            with stats.phase('stream'):
+                helpers.write_batches(batches, sink)
+            stats.count('triples_written', sink.count)
+            return counting_sink
+
+        if validator is not None or schema is not None:
+            # Check and/or infer from each system's triples as they are
+            # added to the graph.
+            graph = importer.graph
+            if schema is not None:
+                inferred = rdflib.Graph()
+                sink = materialize.MaterializedGraphSink(
+                    materialize.Materialization(schema, graph, inferred))
+            else:
+                sink = helpers.GraphSink(graph)
+            if validator is not None:
+                sink = validate.ValidatingSink(sink, validator)
+
+            batches = importer.triple_batches(
+                path=args.input_location,
+                limit_architectures=args.architectures, jobs=args.jobs,
+                cache=cache)
+            helpers.write_batches(batches, sink)
+            if schema is not None:
+                graph.addN((s, p, o, graph) for s, p, o in inferred)
+        else:
+            graph = importer.load_all_morphologies(
+                path=args.input_location,
+                limit_architectures=args.architectures, jobs=args.jobs,
+                cache=cache)
+
+        with stats.phase('serialize'):
+            helpers.write_graph(graph, sys.stdout.buffer,
+                                output_format=args.output_format,
+                                graph_name=args.output_location,
+                                compress=args.gzip)
+        return graph
+
+    output = helpers.run_with_profile(args, run)
+    helpers.write_stats(args, stats, output)
+
+
+# The guard is needed so that worker processes which re-import this module
+# don't run the import themselves.
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+# Copyright 2015 Sam Thursfield
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Build schedule analysis over the build-dependency graph.
+
+The imported data says what has to exist before each build can start:
+
+  - BuildInstructions buildRequires an artifact: the artifact must be
+    built first
+  - BuildInstructions produces (or producesArtifact) an artifact: the
+    artifact is ready once the build is done
+  - an artifact containsArtifact another: the group can only be put
+    together once the artifacts in it are ready
+
+Together these form a directed acyclic graph. This module sorts it
+topologically and works out, for planning build farm capacity:
+
+  - the critical path: the chain of builds that takes longest, which is
+    the shortest possible time for a full build however many machines are
+    available
+  - the width of each level: how many builds could run at once, if each
+    build started as soon as the builds it depends on had finished
+  - the rebuild impact of a chunk: everything that has to be rebuilt if
+    that chunk changes
+
+Every BuildInstructions resource is a build. By default a build costs 1,
+so lengths are counted in builds, except for builds whose artifacts contain
+other artifacts (strata and systems) which only put existing artifacts
+together, and cost 0. A YAML or JSON file of costs can be given with
+--costs, mapping chunk names (the last part of the BuildInstructions URI)
+or full URIs to a cost such as the build time in minutes.
+
+Each algorithm visits every node and edge a fixed number of times, so a
+whole multi-architecture graph takes seconds; loading it takes longer.
+
+    python3 import/build_schedule.py report definitions.nt
+    python3 import/build_schedule.py impact definitions.nt glibc
+
+'''
+
+
+import rdflib
+import yaml
+
+import argparse
+import collections
+import json
+import sys
+
+import closure_index
+import snapshot
+
+
+SOFTWARE = closure_index.SOFTWARE
+
+# (predicate, True if the subject comes before the object)
+DEPENDENCY_PREDICATES = [
+    (SOFTWARE.buildRequires, False),
+    (SOFTWARE.produces, True),
+    (SOFTWARE.producesArtifact, True),
+    (SOFTWARE.containsArtifact, False),
+]
+
+DEFAULT_COST = 1.0
+
+
+def node_name(uri):
+    '''Return the last part of a URI's path, such as the chunk name.'''
+    return str(uri).rstrip('/').rsplit('/', 1)[-1]
+
+
+def load_costs(path):
+    '''Read a mapping of chunk name or URI -> cost from a YAML/JSON file.'''
+    try:
+        with open(path) as f:
+            costs = yaml.safe_load(f)
+    except (OSError, yaml.YAMLError) as e:
+        raise RuntimeError("Unable to read costs from %s: %s" % (path, e))
+    if not isinstance(costs, dict):
+        raise RuntimeError("%s should map chunk names to costs" % path)
+    for name, cost in costs.items():
+        if not isinstance(cost, (int, float)) or cost < 0:
+            raise RuntimeError("Invalid cost %r for %s in %s" %
+                               (cost, name, path))
+    return costs
+
+
+class BuildGraph():
+    '''The build-dependency DAG, with integer node IDs.
+
+    'successors' gives, for each node, the nodes that can't start until it
+    is done. 'costs' is the cost of each node: builds have a cost, and
+    artifacts cost nothing.
+
+    '''
+
+    def __init__(self, nodes, successors, costs, builds):
+        self.nodes = nodes
+        self.node_ids = {node: i for i, node in enumerate(nodes)}
+        self.successors = successors
+        self.costs = costs
+        self.builds = builds
+        self._order = None
+
+    @classmethod
+    def from_graph(cls, graph, costs=None, default_cost=DEFAULT_COST):
+        costs = costs or {}
+        node_ids = {}
+        successors = []
+
+        def node_id(node):
+            if node not in node_ids:
+                node_ids[node] = len(successors)
+                successors.append([])
+            return node_ids[node]
+
+        for predicate, forward in DEPENDENCY_PREDICATES:
+            for s, o in graph.subject_objects(predicate):
+                if forward:
+                    successors[node_id(s)].append(node_id(o))
+                else:
+                    successors[node_id(o)].append(node_id(s))
+
+        builds = [False] * len(successors)
+        for s in graph.subjects(rdflib.RDF.type, SOFTWARE.BuildInstructions):
+            builds[node_id(s)] = True
+
+        # Builds whose artifacts contain other artifacts are assembly steps.
+        assembled = set(node_ids[s] for s in
+                        graph.subjects(SOFTWARE.containsArtifact, None))
+
+        nodes = [None] * len(node_ids)
+        for node, i in node_ids.items():
+            nodes[i] = str(node)
+
+        node_costs = [0.0] * len(nodes)
+        for i, node in enumerate(nodes):
+            if not builds[i]:
+                continue
+            cost = costs.get(node)
+            if cost is None:
+                cost = costs.get(node_name(node))
+            if cost is None:
+                if any(child in assembled for child in successors[i]):
+                    cost = 0.0
+                else:
+                    cost = default_cost
+            node_costs[i] = float(cost)
+
+        return cls(nodes, successors, node_costs, builds)
+
+    def topological_order(self):
+        '''Return the node IDs so that each comes after all its dependencies.
+
+        This is Kahn's algorithm. Raises RuntimeError if there is a cycle.
+
+        '''
+        if self._order is not None:
+            return self._order
+
+        in_degree = [0] * len(self.nodes)
+        for children in self.successors:
+            for child in children:
+                in_degree[child] += 1
+        order = [i for i, degree in enumerate(in_degree) if degree == 0]
+        # 'order' is also the queue: nodes are appended as they become ready.
+        for node in order:
+            for child in self.successors[node]:
+                in_degree[child] -= 1
+                if in_degree[child] == 0:
+                    order.append(child)
+
+        if len(order) < len(self.nodes):
+            cycles = [component for component in
+                      closure_index.strongly_connected_components(
+                          self.successors)
+                      if len(component) > 1 or
+                      component[0] in self.successors[component[0]]]
+            example = ', '.join(self.nodes[i] for i in cycles[0][:5]) \
+                if cycles else ''
+            raise RuntimeError("The build graph has %i dependency cycles, "
+                               "for example between: %s" %
+                               (len(cycles), example))
+        self._order = order
+        return order
+
+    def schedule(self, subset=None):
+        '''Work out when each build could finish, with unlimited machines.
+
+        Only the nodes in 'subset', a set of node IDs, are considered if it
+        is given. Returns a Schedule.
+
+        '''
+        finish = [0.0] * len(self.nodes)
+        start = [0.0] * len(self.nodes)
+        # The dependency that finishes last, so the critical path can be
+        # followed backwards.
+        last_dependency = [None] * len(self.nodes)
+        # Number of builds with a cost on the longest chain up to each node.
+        depth = [0] * len(self.nodes)
+        level = [0] * len(self.nodes)
+
+        for node in self.topological_order():
+            if subset is not None and node not in subset:
+                continue
+            finish[node] = start[node] + self.costs[node]
+            level[node] = depth[node] + (1 if self.costs[node] > 0 else 0)
+            for child in self.successors[node]:
+                if last_dependency[child] is None or \
+                        finish[node] > start[child]:
+                    start[child] = finish[node]
+                    last_dependency[child] = node
+                if level[node] > depth[child]:
+                    depth[child] = level[node]
+
+        nodes = self.topological_order() if subset is None else \
+            [node for node in self.topological_order() if node in subset]
+        return Schedule(self, nodes, start, finish, last_dependency, level)
+
+    def find(self, name):
+        '''Return the IDs of the builds called 'name', or with that URI.'''
+        node_id = self.node_ids.get(name)
+        if node_id is not None:
+            return [node_id]
+        return [i for i, node in enumerate(self.nodes)
+                if self.builds[i] and node_name(node) == name]
+
+    def impact(self, starts):
+        '''Return the set of node IDs that depend on any of 'starts'.
+
+        This includes 'starts' themselves.
+
+        '''
+        affected = set(starts)
+        queue = list(starts)
+        for node in queue:
+            for child in self.successors[node]:
+                if child not in affected:
+                    affected.add(child)
+                    queue.append(child)
+        return affected
+
+
+class Schedule():
+    '''Start and finish times for the builds in a BuildGraph.'''
+
+    def __init__(self, build_graph, nodes, start, finish, last_dependency,
+                 level):
+        self.build_graph = build_graph
+        self.nodes = nodes
+        self.start = start
+        self.finish = finish
+        self.last_dependency = last_dependency
+        self.level = level
+
+    def builds(self):
+        '''Return the IDs of the builds that have a cost, in order.'''
+        build_graph = self.build_graph
+        return [node for node in self.nodes
+                if build_graph.builds[node] and build_graph.costs[node] > 0]
+
+    def total_cost(self):
+        return sum(self.build_graph.costs[node] for node in self.nodes)
+
+    def critical_path_length(self):
+        return max((self.finish[node] for node in self.nodes), default=0.0)
+
+    def critical_path(self):
+        '''Return the builds on the longest chain, first to last.'''
+        if not self.nodes:
+            return []
+        node = max(self.nodes, key=lambda node: self.finish[node])
+        path = []
+        while node is not None:
+            if self.build_graph.builds[node] and \
+                    self.build_graph.costs[node] > 0:
+                path.append(node)
+            node = self.last_dependency[node]
+        path.reverse()
+        return path
+
+    def widths(self):
+        '''Return the number of builds at each level, starting at level 1.
+
+        A build's level is one more than the highest level of the builds
+        that it depends on, so all the builds at one level could run at the
+        same time.
+
+        '''
+        counts = collections.Counter(self.level[node]
+                                     for node in self.builds())
+        return [counts[level] for level in range(1, max(counts, default=0)
+                                                 + 1)]
+
+    def summary(self):
+        total = self.total_cost()
+        length = self.critical_path_length()
+        widths = self.widths()
+        return collections.OrderedDict([
+            ('builds', len(self.builds())),
+            ('total_cost', total),
+            ('critical_path_length', length),
+            ('average_parallelism', total / length if length else 0.0),
+            ('levels', len(widths)),
+            ('max_width', max(widths, default=0)),
+            ('widths', widths),
+            ('critical_path', [
+                collections.OrderedDict([
+                    ('build', self.build_graph.nodes[node]),
+                    ('cost', self.build_graph.costs[node]),
+                    ('finish', self.finish[node])])
+                for node in self.critical_path()]),
+        ])
+
+
+def write_summary(summary, stream, output_format='text', builds=None):
+    if output_format == 'json':
+        if builds is not None:
+            summary['rebuilds'] = builds
+        json.dump(summary, stream, indent=2)
+        stream.write('\n')
+        return
+
+    stream.write("Builds: %i\n" % summary['builds'])
+    stream.write("Total cost: %g\n" % summary['total_cost'])
+    stream.write("Critical path length: %g\n" %
+                 summary['critical_path_length'])
+    stream.write("Average parallelism: %.2f\n" %
+                 summary['average_parallelism'])
+    stream.write("Levels: %i, at most %i builds at once\n" %
+                 (summary['levels'], summary['max_width']))
+    stream.write("\nWidth of each level:\n")
+    for level, width in enumerate(summary['widths'], 1):
+        stream.write("  %4i %6i\n" % (level, width))
+    stream.write("\nCritical path:\n")
+    for step in summary['critical_path']:
+        stream.write("  %8g %8g  %s\n" %
+                     (step['cost'], step['finish'], step['build']))
+    if builds is not None:
+        stream.write("\nBuilds to redo:\n")
+        for build in builds:
+            stream.write("  %s\n" % build)
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Analyse the build schedule of an imported graph")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    def add_common_arguments(subparser):
+        subparser.add_argument('graph_location', type=str,
+                               help="Snapshot or RDF file written by the "
+                                    "Baserock importer")
+        subparser.add_argument('--costs', type=str,
+                               help="YAML or JSON file giving the cost of "
+                                    "each chunk, by name or URI")
+        subparser.add_argument('--default-cost', type=float,
+                               default=DEFAULT_COST,
+                               help="Cost of builds that aren't in the "
+                                    "costs file (default: %(default)s)")
+        subparser.add_argument('--format', choices=['text', 'json'],
+                               default='text',
+                               help="Output format (default: %(default)s)")
+
+    report = subparsers.add_parser(
+        'report', help="Show the critical path and parallelism of a full "
+                       "build")
+    add_common_arguments(report)
+
+    impact = subparsers.add_parser(
+        'impact', help="Show what has to be rebuilt if some chunks change")
+    add_common_arguments(impact)
+    impact.add_argument('chunks', type=str, nargs='+',
+                        help="Names or URIs of the changed chunks")
+    return parser
+
+
+def main():
+    args = argument_parser().parse_args()
+
+    costs = load_costs(args.costs) if args.costs else None
+    graph = snapshot.load_graph([args.graph_location])
+    build_graph = BuildGraph.from_graph(graph, costs, args.default_cost)
+
+    if args.command == 'report':
+        schedule = build_graph.schedule()
+        write_summary(schedule.summary(), sys.stdout, args.format)
+    elif args.command == 'impact':
+        starts = []
+        for name in args.chunks:
+            found = build_graph.find(name)
+            if not found:
+                raise RuntimeError("No build called %s found" % name)
+            starts.extend(found)
+        schedule = build_graph.schedule(build_graph.impact(starts))
+        builds = [build_graph.nodes[node] for node in schedule.builds()]
+        write_summary(schedule.summary(), sys.stdout, args.format, builds)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
@@ -0,0 +1,571 @@
+#!/usr/bin/env python3
+# Copyright 2015 Sam Thursfield
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Precomputed transitive closure over dependency and containment links.
+
+Questions like "which systems end up containing this chunk artifact" or
+"what does this stratum transitively build-depend on" are very slow to
+answer with SPARQL property paths over the imported graphs. This module
+computes, once, the set of nodes reachable from every node (and the set of
+nodes that can reach it) along a chosen set of predicates.
+
+The nodes in a strongly connected component all reach the same nodes, so
+there is one row for each component. A row is a sorted array of node IDs,
+or a bitmap over all the nodes if that is smaller, and identical rows are
+stored once. Dependency graphs are sparse: for a 26732-node import, the
+index is 3.5MB, most of it node names. The worst case, where every node
+reaches every other, is still about N^2 / 8 bytes for each direction.
+
+While the index is built, each component's reachable set is kept as a
+Python int bitset until the components that depend on it are done, so
+memory use depends on how wide the graph is rather than how big it is.
+
+The index is read with mmap. Opening it only reads a small JSON header,
+nodes are found by a binary search of their names, and a query reads just
+the rows and names it needs. The rdf:type of each node is indexed as a
+sorted array of node IDs too.
+
+To build an index and query it:
+
+    python3 import/closure_index.py build definitions.rdfxml
+    python3 import/closure_index.py query definitions.rdfxml \\
+        --reverse --type software:ExecutableArtifact <chunk artifact URI>
+
+By default the index is saved alongside the graph, with '.closure' appended
+to its filename. The index records the size and modification time of the
+graph files it was built from, and the 'query' command refuses to use it
+if they have changed.
+
+'''
+
+
+import rdflib
+
+import argparse
+import array
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import sys
+import time
+
+import snapshot
+
+
+SOFTWARE = rdflib.Namespace(
+    'http://www.baserock.org/software-integration-ontology#')
+
+DEFAULT_PREDICATES = [
+    SOFTWARE.buildRequires,
+    SOFTWARE.containsArtifact,
+    SOFTWARE.produces,
+]
+
+INDEX_FORMAT_VERSION = 3
+
+INDEX_MAGIC = b'SICLOSURE\0'
+
+# Kinds of row in the index.
+ROW_IDS = 0
+ROW_BITMAP = 1
+
+
+def ids_from_bits(bits):
+    '''Return the index of every bit that is set in 'bits', lowest first.'''
+    # Searching the binary string is much faster than shifting a long int
+    # once for every bit.
+    text = bin(bits)[:1:-1]
+    ids = []
+    i = text.find('1')
+    while i >= 0:
+        ids.append(i)
+        i = text.find('1', i + 1)
+    return ids
+
+
+def strongly_connected_components(successors):
+    '''Return the SCCs of a graph, in reverse topological order.
+
+    'successors' is a list giving the successor node IDs of each node. This
+    is Tarjan's algorithm, written iteratively so that long dependency chains
+    don't overflow the Python stack. It runs in time linear in the number of
+    nodes and edges.
+
+    '''
+    index_of = [None] * len(successors)
+    lowlink = [0] * len(successors)
+    on_stack = [False] * len(successors)
+    stack = []
+    components = []
+    next_index = 0
+
+    for root in range(len(successors)):
+        if index_of[root] is not None:
+            continue
+        work = [(root, 0)]
+        while work:
+            node, child_position = work.pop()
+            if child_position == 0:
+                index_of[node] = lowlink[node] = next_index
+                next_index += 1
+                stack.append(node)
+                on_stack[node] = True
+            recurse = False
+            children = successors[node]
+            for i in range(child_position, len(children)):
+                child = children[i]
+                if index_of[child] is None:
+                    work.append((node, i + 1))
+                    work.append((child, 0))
+                    recurse = True
+                    break
+                elif on_stack[child]:
+                    lowlink[node] = min(lowlink[node], index_of[child])
+            if recurse:
+                continue
+            if lowlink[node] == index_of[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(component)
+            if work:
+                parent = work[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[node])
+    return components
+
+
+def component_reachability(components, component_of, successors, order):
+    '''Yield (component, bitset of the nodes it reaches) for each component.
+
+    'order' gives the component numbers so that every component comes after
+    the components that its members' successors are in. A component only
+    reaches its own members if it is a cycle.
+
+    Each component's bitset is kept only until every component that needs
+    it has been done, so memory use depends on the width of the graph
+    rather than its size.
+
+    '''
+    children = [None] * len(components)
+    waiting = [0] * len(components)
+    for c, members in enumerate(components):
+        linked = set(component_of[child]
+                     for node in members for child in successors[node])
+        waiting_for = linked - {c}
+        for child in waiting_for:
+            waiting[child] += 1
+        children[c] = (waiting_for, c in linked)
+
+    def members_bits(c):
+        bits = 0
+        for node in components[c]:
+            bits |= 1 << node
+        return bits
+
+    reached = {}
+    for c in order:
+        child_components, cyclic = children[c]
+        bits = members_bits(c) if cyclic else 0
+        for child in child_components:
+            bits |= reached[child] | members_bits(child)
+            waiting[child] -= 1
+            if waiting[child] == 0:
+                del reached[child]
+        if waiting[c] > 0:
+            reached[c] = bits
+        yield c, bits
+
+
+class _IndexWriter():
+    '''Write the sections of an index file, then its header.
+
+    The file starts with INDEX_MAGIC and the offset of the header, which is
+    JSON and comes last, so that the sections can be written as they are
+    produced.
+
+    '''
+    def __init__(self, f):
+        self.f = f
+        self.sections = {}
+        f.write(INDEX_MAGIC + bytes(8))
+
+    def _align(self):
+        padding = -self.f.tell() % 8
+        self.f.write(bytes(padding))
+
+    def write(self, data):
+        '''Write some bytes and return their offset.'''
+        self._align()
+        offset = self.f.tell()
+        self.f.write(data)
+        return offset
+
+    def add_section(self, name, values):
+        '''Write 'values', an array.array, as a named section.'''
+        self.sections[name] = (values.typecode, self.write(values.tobytes()),
+                               len(values))
+
+    def finish(self, header):
+        header = dict(header, sections=self.sections)
+        offset = self.write(json.dumps(header).encode('utf8'))
+        self.f.seek(len(INDEX_MAGIC))
+        self.f.write(offset.to_bytes(8, 'little'))
+
+
+def _write_rows(writer, name, rows, node_count, component_count):
+    '''Write the reachability rows for each component into 'writer'.
+
+    Each row is stored in whichever of two forms is smaller: a sorted array
+    of node IDs, or a bitmap over all the nodes. Identical rows, which are
+    common, are stored once.
+
+    '''
+    offsets = array.array('Q', bytes(8 * component_count))
+    lengths = array.array('I', bytes(4 * component_count))
+    kinds = array.array('B', bytes(component_count))
+    bitmap_size = (node_count + 7) // 8
+    stored = {}
+    for c, bits in rows:
+        ids = ids_from_bits(bits)
+        if len(ids) * 4 > bitmap_size:
+            kind, data = ROW_BITMAP, bits.to_bytes(bitmap_size, 'little')
+        else:
+            kind, data = ROW_IDS, array.array('I', ids).tobytes()
+        key = (kind, hashlib.sha1(data).digest())
+        location = stored.get(key)
+        if location is None:
+            location = stored[key] = (writer.write(data), len(data))
+        offsets[c], lengths[c] = location
+        kinds[c] = kind
+    writer.add_section(name + '_offsets', offsets)
+    writer.add_section(name + '_lengths', lengths)
+    writer.add_section(name + '_kinds', kinds)
+
+
+class ClosureIndex():
+    '''Forward and reverse reachability for every node in a graph.
+
+    The index is a file that is read with mmap, so opening it is cheap, and
+    a query only reads the rows and names that it needs. The nodes that are
+    in one strongly connected component reach the same nodes, so there is a
+    row for each component rather than each node.
+
+    '''
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # An empty file can't be mapped.
+                self._mmap = b''
+        data = memoryview(self._mmap)
+        if bytes(data[:len(INDEX_MAGIC)]) != INDEX_MAGIC:
+            raise RuntimeError("%s is not a closure index, or was written "
+                               "by an older version of this tool" % path)
+        start = int.from_bytes(
+            data[len(INDEX_MAGIC):len(INDEX_MAGIC) + 8], 'little')
+        header = json.loads(bytes(data[start:]).decode('utf8'))
+        if header.get('version') != INDEX_FORMAT_VERSION:
+            raise RuntimeError("Closure index %s has an unsupported format "
+                               "version" % path)
+
+        self.predicates = header['predicates']
+        self.sources = [tuple(source) for source in header['sources']]
+        self.node_count = header['node_count']
+        self._data = data
+        self._sections = {}
+        for name, (typecode, offset, count) in header['sections'].items():
+            size = array.array(typecode).itemsize
+            self._sections[name] = \
+                data[offset:offset + count * size].cast(typecode)
+        self._types = header['types']
+
+    @classmethod
+    def load(cls, path):
+        return cls(path)
+
+    @classmethod
+    def build(cls, graph, path, predicates=None, sources=None):
+        '''Build the index for 'graph' and write it to 'path'.'''
+        predicates = predicates or DEFAULT_PREDICATES
+
+        node_ids = {}
+        successors = []
+        predecessors = []
+
+        def node_id(node):
+            if node not in node_ids:
+                node_ids[node] = len(successors)
+                successors.append([])
+                predecessors.append([])
+            return node_ids[node]
+
+        for predicate in predicates:
+            for s, o in graph.subject_objects(predicate):
+                s_id = node_id(s)
+                o_id = node_id(o)
+                successors[s_id].append(o_id)
+                predecessors[o_id].append(s_id)
+
+        type_members = {}
+        for s, rdf_type in graph.subject_objects(rdflib.RDF.type):
+            s_id = node_ids.get(s)
+            if s_id is not None:
+                type_members.setdefault(str(rdf_type), set()).add(s_id)
+
+        names = [None] * len(node_ids)
+        for node, i in node_ids.items():
+            names[i] = str(node).encode('utf8')
+        del node_ids
+
+        # The SCCs of the graph are also those of the reversed graph, and
+        # come out in reverse topological order.
+        components = strongly_connected_components(successors)
+        component_of = array.array('I', bytes(4 * len(names)))
+        for c, members in enumerate(components):
+            for node in members:
+                component_of[node] = c
+
+        node_count = len(names)
+        component_count = len(components)
+
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            writer = _IndexWriter(f)
+            _write_rows(writer, 'forward', component_reachability(
+                components, component_of, successors,
+                range(component_count)), node_count, component_count)
+            _write_rows(writer, 'reverse', component_reachability(
+                components, component_of, predecessors,
+                range(component_count - 1, -1, -1)),
+                node_count, component_count)
+            writer.add_section('component', component_of)
+
+            name_offsets = array.array('Q', [0])
+            for name in names:
+                name_offsets.append(name_offsets[-1] + len(name))
+            writer.add_section('name_offsets', name_offsets)
+            writer.add_section('names', array.array('B', b''.join(names)))
+            writer.add_section('sorted_nodes', array.array(
+                'I', sorted(range(node_count), key=names.__getitem__)))
+
+            types = {}
+            for rdf_type, ids in sorted(type_members.items()):
+                types[rdf_type] = 'type:' + rdf_type
+                writer.add_section(types[rdf_type],
+                                   array.array('I', sorted(ids)))
+
+            writer.finish({
+                'version': INDEX_FORMAT_VERSION,
+                'predicates': [str(predicate) for predicate in predicates],
+                'sources': sources or [],
+                'node_count': node_count,
+                'types': types,
+            })
+        os.replace(temp_path, path)
+        return cls(path)
+
+    def _name(self, node_id):
+        offsets = self._sections['name_offsets']
+        return bytes(self._sections['names'][
+            offsets[node_id]:offsets[node_id + 1]]).decode('utf8')
+
+    def _node_id(self, node):
+        '''Find a node by name, with a binary search of the sorted names.'''
+        name = str(node).encode('utf8')
+        offsets = self._sections['name_offsets']
+        names = self._sections['names']
+        sorted_nodes = self._sections['sorted_nodes']
+        low, high = 0, len(sorted_nodes)
+        while low < high:
+            middle = (low + high) // 2
+            node_id = sorted_nodes[middle]
+            candidate = bytes(names[offsets[node_id]:offsets[node_id + 1]])
+            if candidate == name:
+                return node_id
+            elif candidate < name:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def _row(self, direction, node_id):
+        '''Return the IDs of the nodes in a row, as a sorted sequence.'''
+        c = self._sections['component'][node_id]
+        offset = self._sections[direction + '_offsets'][c]
+        length = self._sections[direction + '_lengths'][c]
+        data = self._data[offset:offset + length]
+        if self._sections[direction + '_kinds'][c] == ROW_BITMAP:
+            return ids_from_bits(int.from_bytes(data, 'little'))
+        return data.cast('I')
+
+    def _nodes(self, node, direction, rdf_type=None):
+        node_id = self._node_id(node)
+        if node_id is None:
+            return []
+        ids = self._row(direction, node_id)
+        if rdf_type is not None:
+            section = self._types.get(str(rdf_type))
+            if section is None:
+                return []
+            members = self._sections[section]
+            ids = [i for i in ids if _contains(members, i)]
+        return [self._name(i) for i in ids]
+
+    def descendants(self, node, rdf_type=None):
+        '''Return every node that 'node' reaches, optionally of one type.'''
+        return self._nodes(node, 'forward', rdf_type)
+
+    def ancestors(self, node, rdf_type=None):
+        '''Return every node that reaches 'node', optionally of one type.'''
+        return self._nodes(node, 'reverse', rdf_type)
+
+    def reaches(self, source, target):
+        '''Return True if there is a path from 'source' to 'target'.'''
+        source_id = self._node_id(source)
+        target_id = self._node_id(target)
+        if source_id is None or target_id is None:
+            return False
+        return _contains(self._row('forward', source_id), target_id)
+
+    def check_sources(self, graph_path):
+        '''Raise RuntimeError unless the index is up to date for 'graph_path'.
+
+        The index must have been built from 'graph_path', and none of the
+        files it was built from can have changed since.
+
+        '''
+        graph_path = os.path.abspath(graph_path)
+        if graph_path not in [path for path, size, mtime in self.sources]:
+            raise RuntimeError("The closure index was not built from %s." %
+                               graph_path)
+        for path, size, mtime in self.sources:
+            if os.path.exists(path) and \
+                    file_fingerprint(path) == (path, size, mtime):
+                continue
+            raise RuntimeError("%s has changed since the closure index was "
+                               "built. Rebuild it with the 'build' command." %
+                               path)
+
+
+def _contains(ids, node_id):
+    '''Return True if the sorted sequence 'ids' contains 'node_id'.'''
+    i = bisect.bisect_left(ids, node_id)
+    return i < len(ids) and ids[i] == node_id
+
+
+def file_fingerprint(path):
+    '''Return (absolute path, size, mtime) for a graph file.'''
+    info = os.stat(path)
+    return os.path.abspath(path), info.st_size, info.st_mtime_ns
+
+
+def default_index_path(graph_path):
+    return graph_path + '.closure'
+
+
+def expand_name(name):
+    '''Allow 'software:Foo' as shorthand, and strip <> around URIs.'''
+    if name.startswith('<') and name.endswith('>'):
+        return name[1:-1]
+    if name.startswith('software:'):
+        return str(SOFTWARE[name[len('software:'):]])
+    return name
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Build and query transitive closure indexes")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    build = subparsers.add_parser(
+        'build', help="Build the index for a graph")
+    build.add_argument('graph_locations', type=str, nargs='+',
+                       help="Snapshot or RDF files written by the importers")
+    build.add_argument('--index', type=str,
+                       help="Where to save the index (default: next to the "
+                            "first graph file)")
+    build.add_argument('--predicate', '-p', type=str, action='append',
+                       help="Follow this predicate; may be given more than "
+                            "once (default: buildRequires, "
+                            "containsArtifact and produces)")
+
+    query = subparsers.add_parser('query', help="Query an index")
+    query.add_argument('graph_location', type=str,
+                       help="Graph that the index was built for")
+    query.add_argument('node', type=str, help="URI of the node to start from")
+    query.add_argument('--index', type=str,
+                       help="Index to use (default: next to the graph)")
+    query.add_argument('--reverse', '-r', action='store_true',
+                       help="Find the nodes that reach NODE, rather than the "
+                            "nodes that NODE reaches")
+    query.add_argument('--type', '-t', type=str,
+                       help="Only return nodes with this rdf:type")
+    return parser
+
+
+def main():
+    args = argument_parser().parse_args()
+
+    if args.command == 'build':
+        predicates = None
+        if args.predicate:
+            predicates = [rdflib.URIRef(expand_name(predicate))
+                          for predicate in args.predicate]
+        sources = [file_fingerprint(path) for path in args.graph_locations]
+        graph = snapshot.load_graph(args.graph_locations)
+        ClosureIndex.build(graph, args.index or
+                           default_index_path(args.graph_locations[0]),
+                           predicates, sources)
+    elif args.command == 'query':
+        index_path = args.index or default_index_path(args.graph_location)
+        if not os.path.exists(index_path):
+            raise RuntimeError("No closure index at %s. Create one with the "
+                               "'build' command." % index_path)
+        start = time.perf_counter()
+        index = ClosureIndex.load(index_path)
+        index.check_sources(args.graph_location)
+
+        rdf_type = expand_name(args.type) if args.type else None
+        node = expand_name(args.node)
+        if args.reverse:
+            results = index.ancestors(node, rdf_type)
+        else:
+            results = index.descendants(node, rdf_type)
+        elapsed = time.perf_counter() - start
+
+        for result in results:
+            sys.stdout.write(result + '\n')
+        sys.stderr.write("%i results in %.2fms, including opening the "
+                         "index\n" %
+                         (len(results), elapsed * 1000))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
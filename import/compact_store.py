@@ -0,0 +1,243 @@
+# Copyright 2015 Sam Thursfield
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''A memory-efficient, dictionary-encoded rdflib Store.
+
+The graphs we produce are dominated by a relatively small number of long,
+highly repetitive URIs. rdflib's default in-memory store keeps a reference
+to the full term objects in each of its index dicts, and also tracks the
+contexts of every triple. This store interns each term once, giving it an
+integer ID, and keeps the SPO, POS and OSP indexes as two levels of dicts
+with array.array leaves holding the IDs. Searching or removing from an array
+takes time proportional to its length, so a leaf that grows past
+LEAF_SET_SIZE IDs becomes a set. Few leaves get that big: most are the
+objects of one subject and predicate. The big ones are things like the
+subjects of rdf:type and a common class in the POS index.
+
+The helpers module registers this store with rdflib as the 'Compact' plugin,
+so it can be used with:
+
+    graph = rdflib.Graph(store='Compact')
+
+'''
+
+
+import rdflib
+import rdflib.store
+
+import array
+
+
+# Unsigned 32 bit integers, which is plenty of distinct terms.
+ID_TYPECODE = 'I'
+
+# Leaves with more IDs than this are sets rather than arrays.
+LEAF_SET_SIZE = 32
+
+
+def _snapshot(leaf):
+    '''Return the IDs in 'leaf' in a form that is safe to iterate over.
+
+    Adding to a set while iterating over it is an error, so callers that
+    change the graph as they read from it get a copy of set leaves.
+
+    '''
+    return tuple(leaf) if type(leaf) is set else leaf
+
+
+class CompactStore(rdflib.store.Store):
+    '''In-memory rdflib Store that keeps triples as arrays of term IDs.
+
+    The store isn't context aware: all triples are in the default graph.
+
+    '''
+    context_aware = False
+    formula_aware = False
+    transaction_aware = False
+    graph_aware = False
+
+    def __init__(self, configuration=None, identifier=None):
+        super(CompactStore, self).__init__(configuration, identifier)
+        self.identifier = identifier
+
+        # ID -> term, and term -> ID.
+        self._terms = []
+        self._ids = {}
+
+        # The three indexes. Each maps the first ID to a dict that maps the
+        # second ID to an array or set of the third IDs.
+        self._spo = {}
+        self._pos = {}
+        self._osp = {}
+
+        self._length = 0
+
+        self._namespace = {}
+        self._prefix = {}
+
+    def _intern(self, term):
+        term_id = self._ids.get(term)
+        if term_id is None:
+            term_id = len(self._terms)
+            self._terms.append(term)
+            self._ids[term] = term_id
+        return term_id
+
+    @staticmethod
+    def _index_add(index, a, b, c):
+        second = index.get(a)
+        if second is None:
+            second = index[a] = {}
+        third = second.get(b)
+        if third is None:
+            second[b] = array.array(ID_TYPECODE, (c,))
+        elif type(third) is set:
+            third.add(c)
+        else:
+            third.append(c)
+            if len(third) > LEAF_SET_SIZE:
+                second[b] = set(third)
+
+    @staticmethod
+    def _index_remove(index, a, b, c):
+        second = index[a]
+        third = second[b]
+        third.remove(c)
+        if len(third) == 0:
+            del second[b]
+            if len(second) == 0:
+                del index[a]
+
+    def _add_ids(self, s, p, o):
+        objects = self._spo.get(s, {}).get(p)
+        if objects is not None and o in objects:
+            return
+        self._index_add(self._spo, s, p, o)
+        self._index_add(self._pos, p, o, s)
+        self._index_add(self._osp, o, s, p)
+        self._length += 1
+
+    def add(self, triple, context=None, quoted=False):
+        s, p, o = triple
+        self._add_ids(self._intern(s), self._intern(p), self._intern(o))
+
+    def addN(self, quads):
+        intern = self._intern
+        for s, p, o, c in quads:
+            self._add_ids(intern(s), intern(p), intern(o))
+
+    def _pattern_ids(self, triple_pattern):
+        '''Return the IDs for a pattern, or None if it can't match anything.'''
+        ids = []
+        for term in triple_pattern:
+            if term is None:
+                ids.append(None)
+            else:
+                term_id = self._ids.get(term)
+                if term_id is None:
+                    return None
+                ids.append(term_id)
+        return ids
+
+    def _match_ids(self, s, p, o):
+        '''Yield (s, p, o) ID tuples matching a pattern of IDs or None.'''
+        if s is not None:
+            by_predicate = self._spo.get(s)
+            if by_predicate is None:
+                return
+            if p is not None:
+                objects = by_predicate.get(p, ())
+                if o is not None:
+                    if o in objects:
+                        yield s, p, o
+                else:
+                    for o_ in _snapshot(objects):
+                        yield s, p, o_
+            elif o is not None:
+                for p_ in _snapshot(self._osp.get(o, {}).get(s, ())):
+                    yield s, p_, o
+            else:
+                for p_, objects in by_predicate.items():
+                    for o_ in _snapshot(objects):
+                        yield s, p_, o_
+        elif p is not None:
+            by_object = self._pos.get(p)
+            if by_object is None:
+                return
+            if o is not None:
+                for s_ in _snapshot(by_object.get(o, ())):
+                    yield s_, p, o
+            else:
+                for o_, subjects in by_object.items():
+                    for s_ in _snapshot(subjects):
+                        yield s_, p, o_
+        elif o is not None:
+            for s_, predicates in self._osp.get(o, {}).items():
+                for p_ in _snapshot(predicates):
+                    yield s_, p_, o
+        else:
+            for s_, by_predicate in self._spo.items():
+                for p_, objects in by_predicate.items():
+                    for o_ in _snapshot(objects):
+                        yield s_, p_, o_
+
+    def remove(self, triple_pattern, context=None):
+        ids = self._pattern_ids(triple_pattern)
+        if ids is None:
+            return
+        for s, p, o in list(self._match_ids(*ids)):
+            self._index_remove(self._spo, s, p, o)
+            self._index_remove(self._pos, p, o, s)
+            self._index_remove(self._osp, o, s, p)
+            self._length -= 1
+
+    def triples(self, triple_pattern, context=None):
+        ids = self._pattern_ids(triple_pattern)
+        if ids is None:
+            return
+        terms = self._terms
+        for s, p, o in self._match_ids(*ids):
+            yield (terms[s], terms[p], terms[o]), iter(())
+
+    def __len__(self, context=None):
+        return self._length
+
+    def contexts(self, triple=None):
+        return iter(())
+
+    def bind(self, prefix, namespace, override=True):
+        if not override and (prefix in self._namespace or
+                             namespace in self._prefix):
+            return
+        old_namespace = self._namespace.get(prefix)
+        if old_namespace is not None:
+            del self._prefix[old_namespace]
+        old_prefix = self._prefix.get(namespace)
+        if old_prefix is not None:
+            del self._namespace[old_prefix]
+        self._namespace[prefix] = namespace
+        self._prefix[namespace] = prefix
+
+    def namespace(self, prefix):
+        return self._namespace.get(prefix)
+
+    def prefix(self, namespace):
+        return self._prefix.get(namespace)
+
+    def namespaces(self):
+        for prefix, namespace in self._namespace.items():
+            yield prefix, namespace
+
@@ -0,0 +1,164 @@
+# Copyright 2015 Sam Thursfield
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Read files straight out of a local Git repository's object database.
+
+This lets the importers work on any commit of a repo without checking it
+out. Listing a tree is one `git ls-tree` call, and all the blobs are read
+through a single long-running `git cat-file --batch` process, so the cost
+doesn't depend on how many files there are.
+
+'''
+
+
+import collections
+import os
+import subprocess
+import threading
+
+
+TreeEntry = collections.namedtuple('TreeEntry',
+                                   ['mode', 'type', 'object_id', 'path'])
+
+
+def parse_location(location):
+    '''Split a location of the form <repo>@<ref> into (repo, ref).
+
+    Returns None if 'location' is an existing directory, or has no '@', so
+    that it should be treated as a working tree.
+
+    '''
+    if os.path.isdir(location) or '@' not in location:
+        return None
+    repo, ref = location.rsplit('@', 1)
+    if not repo or not ref:
+        raise RuntimeError("Invalid location %s: expected <repo>@<ref>" %
+                           location)
+    return repo, ref
+
+
+class GitObjectReader():
+    '''Read trees and blobs from a local Git repository.'''
+
+    def __init__(self, repo_path):
+        if not os.path.isdir(repo_path):
+            raise RuntimeError("No Git repo found at %s" % repo_path)
+        self.repo_path = repo_path
+        self.process = None
+
+    def _git(self, *args):
+        try:
+            return subprocess.run(['git', '-C', self.repo_path] + list(args),
+                                  stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE, check=True).stdout
+        except FileNotFoundError:
+            raise RuntimeError("Git is needed to read from %s" %
+                               self.repo_path)
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError("git %s failed in %s: %s" % (
+                args[0], self.repo_path,
+                e.stderr.decode('utf8', 'replace').strip()))
+
+    def resolve(self, ref):
+        '''Return the SHA1 of the commit that 'ref' points to.'''
+        try:
+            output = self._git('rev-parse', '--verify', '--quiet',
+                               ref + '^{commit}')
+        except RuntimeError:
+            raise RuntimeError("Unknown ref %s in %s" % (ref, self.repo_path))
+        return output.decode('ascii').strip()
+
+    def list_tree(self, commit):
+        '''Return a TreeEntry for every file in 'commit', recursively.'''
+        output = self._git('ls-tree', '-r', '-z', '--full-tree', commit)
+        entries = []
+        for line in output.split(b'\0'):
+            if not line:
+                continue
+            info, path = line.split(b'\t', 1)
+            mode, object_type, object_id = info.decode('ascii').split(' ')
+            entries.append(TreeEntry(mode, object_type, object_id,
+                                     path.decode('utf8', 'surrogateescape')))
+        return entries
+
+    def _start(self):
+        if self.process is None:
+            try:
+                self.process = subprocess.Popen(
+                    ['git', '-C', self.repo_path, 'cat-file', '--batch'],
+                    stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            except FileNotFoundError:
+                raise RuntimeError("Git is needed to read from %s" %
+                                   self.repo_path)
+        return self.process
+
+    def read_blobs(self, object_ids):
+        '''Yield (object ID, data) for each of 'object_ids', in order.
+
+        The requests are written from a separate thread while the responses
+        are read, so neither side of the pipe can fill up and block.
+
+        '''
+        object_ids = list(object_ids)
+        process = self._start()
+
+        def write_requests():
+            try:
+                for object_id in object_ids:
+                    process.stdin.write(object_id.encode('ascii') + b'\n')
+                process.stdin.flush()
+            except OSError:
+                # The process was killed, see below.
+                pass
+
+        writer = threading.Thread(target=write_requests, daemon=True)
+        writer.start()
+        remaining = len(object_ids)
+        try:
+            for object_id in object_ids:
+                header = process.stdout.readline()
+                if not header:
+                    raise RuntimeError("git cat-file exited unexpectedly")
+                fields = header.split()
+                if len(fields) != 3:
+                    raise RuntimeError("Object %s not found in %s" %
+                                       (object_id, self.repo_path))
+                size = int(fields[2])
+                data = process.stdout.read(size)
+                process.stdout.read(1)
+                remaining -= 1
+                yield object_id, data
+        finally:
+            if remaining:
+                # Unread responses would be mistaken for the answers to the
+                # next request, so start again with a fresh process.
+                process.kill()
+                self.process = None
+            writer.join()
+
+    def read_file(self, entries, path):
+        '''Return the contents of 'path' from a tree listing, or None.'''
+        for entry in entries:
+            if entry.path == path and entry.type == 'blob':
+                for object_id, data in self.read_blobs([entry.object_id]):
+                    return data
+        return None
+
+    def close(self):
+        if self.process is not None:
+            self.process.stdin.close()
+            self.process.wait()
+            self.process = None
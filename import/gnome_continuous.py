@@ -15,16 +15,35 @@
 # with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-'''Parser for the GNOME Continuous input manifest format.'''
+'''Parser for the GNOME Continuous input manifest format.
+
+Given a directory of dated manifests (manifest.20151221.json and so on)
+instead of a single manifest, the history of the manifest is imported. Each
+snapshot contributes only the triples that changed since the one before, as
+two named graphs:
+
+    <base>/snapshots/20151221          triples added in this snapshot
+    <base>/snapshots/20151221/removed  triples removed in this snapshot
+
+The graph at any snapshot is the union of all the 'added' graphs up to it,
+minus the 'removed' ones, applied in date order. Each distinct version of a
+component (its 'src', 'branch', config and so on) gets its own
+BuildInstructions resource, named after a hash of the component, so
+snapshots that share a component share the resource.
+
+'''
 
 
 import rdflib
 
 import argparse
+import collections
+import gzip
+import hashlib
 import json
 import os
+import re
 import sys
-import urllib
 
 import helpers
 
@@ -34,24 +53,49 @@ DEFAULT_URL = 'https://git.gnome.org/browse/gnome-continuous/plain/manifest.json
 SOFTWARE = rdflib.namespace.Namespace(
     'http://www.baserock.org/software-integration-ontology#')
 
+# json.dumps() makes a new encoder each time it's called with sort_keys.
+_canonical_json = json.JSONEncoder(sort_keys=True,
+                                   separators=(',', ':')).encode
+
 
 def argument_parser():
     parser = argparse.ArgumentParser(
         description="Parse a GNOME Continuous input manifest")
     parser.add_argument('input_location', type=str,
-                        help="Location to read the manifest from")
+                        help="Location to read the manifest from, or a "
+                             "directory of dated manifests to import the "
+                             "history of (needs --output-format nquads)")
     parser.add_argument('output_location', type=str,
                         help="Location of the resulting resources (base URI)")
+    helpers.add_store_argument(parser)
+    helpers.add_output_arguments(parser)
+    helpers.add_stats_arguments(parser)
     return parser
 
 
 class GnomeContinuousImporter():
+    def __init__(self, store='default', stats=None):
+        self.store = store
+        # Instrumentation hooks; see helpers.ImportStats.
+        self.stats = stats or helpers.NULL_STATS
+
     def parse_manifest(self, manifest, base_uri):
-        namespace = helpers.SoftwareNamespace(base_uri)
-        graph = rdflib.Graph()
+        graph = rdflib.Graph(store=self.store)
 
         graph.bind('software', SOFTWARE)
 
+        helpers.write_batches(self.triple_batches(manifest, base_uri),
+                              helpers.GraphSink(graph))
+        return graph
+
+    def triple_batches(self, manifest, base_uri, batch_size=1000):
+        '''Import a manifest as a stream of helpers.TripleBatch.
+
+        Each batch holds the triples for up to 'batch_size' components.
+
+        '''
+        namespace = helpers.SoftwareNamespace(base_uri)
+
         # FIXME: write a json-schema for gnome-continuous; put it upstream
 
         # Keyed URIs are allowed in the 'src' field, with the keys defined
@@ -60,17 +104,20 @@ class GnomeContinuousImporter():
         for key, value in manifest['vcsconfig'].items():
             alias_namespace = rdflib.namespace.Namespace(value)
             # We perhaps shouldn't convert the key to lower case, but anyone
-            # relying on case sensitivity here must be crazy, and this means
-            # we can urllib.parse.urlsplit() to parse the URLs (it converts
-            # the 'scheme' field to lower case).
+            # relying on case sensitivity here must be crazy.
             #aliases.bind(key, value)
             aliases[key.lower()] = alias_namespace
 
-        for component in manifest['components']:
-            resource = self.resource_for_component(
-                namespace, graph, component, aliases)
-
-        return graph
+        triple_buffer = helpers.TripleBuffer()
+        components = manifest['components']
+        for start in range(0, len(components), batch_size):
+            with self.stats.phase('add_components'):
+                for component in components[start:start + batch_size]:
+                    self.resource_for_component(
+                        namespace, triple_buffer, component, aliases)
+                batch = triple_buffer.take()
+            yield batch
+        self.stats.count('components', len(components))
 
     def parse_src_field(self, src_field, aliases):
         def process_source_type_specifier(src_field):
@@ -88,24 +135,29 @@ class GnomeContinuousImporter():
         source_type, location = process_source_type_specifier(src_field)
 
         if source_type is None:
-            # Looks like a keyed URL.
+            # Looks like a keyed URL. We don't use urllib.parse.urlsplit()
+            # here because it rejects keys that start with a digit, such as
+            # '0pointer'.
+            key, _, path = src_field.partition(':')
 
-            parts = urllib.parse.urlsplit(src_field)
-
-            namespace = aliases[parts.scheme]
-            location = namespace[parts.path]
+            namespace = aliases[key.lower()]
+            location = namespace[path]
             source_type, location = \
                 process_source_type_specifier(location)
 
         return source_type, location
 
     def resource_for_component(self, namespace, graph, component, aliases):
+        '''Describe 'component' in 'graph'.
+
+        'graph' can be an rdflib.Graph or a helpers.TripleBuffer.
+
+        '''
         source_type, source_location = self.parse_src_field(component['src'], aliases)
 
         # There's no 'name' field, so we guess one based on the 'src' field.
         source_name = os.path.basename(source_location)
-        source = rdflib.resource.Resource(
-            graph, namespace.source(source_name))
+        source = graph.resource(namespace.source(source_name))
 
         source.set(rdflib.RDF.type, SOFTWARE.Source)
         source.set(rdflib.RDF.type, source_type)
@@ -113,18 +165,213 @@ class GnomeContinuousImporter():
 
         return component
 
+    def component_triples(self, namespace, component, aliases, fingerprint):
+        '''Return the triples that describe one version of a component.'''
+        graph = rdflib.Graph()
+        self.resource_for_component(namespace, graph, component, aliases)
+
+        source_type, source_location = self.parse_src_field(
+            component['src'], aliases)
+        source_name = os.path.basename(source_location)
+        instructions = graph.resource(namespace.build_instructions(
+            '%s/%s' % (source_name, fingerprint[:12])))
+        instructions.set(rdflib.RDF.type, SOFTWARE.BuildInstructions)
+        instructions.set(SOFTWARE.source, namespace.source(source_name))
+        # Like 'unpetrify-ref' in the Baserock importer, these are kept as
+        # notes; it's up to the tooling to interpret them.
+        for key, value in sorted(component.items()):
+            if key != 'src':
+                instructions.add(SOFTWARE.hasComment, rdflib.Literal(
+                    '%s:%s' % (key, json.dumps(value, sort_keys=True))))
+
+        return tuple(graph)
+
+    def parse_history(self, manifest_paths, base_uri, writer):
+        '''Import the history of a manifest, as deltas between snapshots.
+
+        'manifest_paths' is a list of (snapshot name, path) pairs, in order.
+        For each snapshot, the triples it adds and removes are passed to
+        writer.write(triple, graph_name). The work done for each snapshot
+        depends on the number of components that changed, apart from
+        reading the manifest and hashing each component.
+
+        '''
+        namespace = helpers.SoftwareNamespace(base_uri)
+
+        # Canonical JSON -> fingerprint, and fingerprint -> triples, for
+        # every version of a component seen.
+        fingerprints = {}
+        triples_for_fingerprint = {}
+        # Triple -> number of components in the current snapshot that
+        # produce it. A triple is added when this goes from 0 to 1, and
+        # removed when it goes back to 0.
+        refcounts = collections.Counter()
+        current = set()
+        previous_digest = None
+
+        for name, path in manifest_paths:
+            snapshot_graph = namespace.term('snapshots/' + name)
+            removed_graph = namespace.term('snapshots/%s/removed' % name)
+
+            with self.stats.phase('parse'):
+                with open(path, 'rb') as f:
+                    data = f.read()
+            digest = hashlib.sha1(data).hexdigest()
+            if digest == previous_digest:
+                self.stats.count('unchanged_snapshots')
+                continue
+            previous_digest = digest
+
+            with self.stats.phase('parse'):
+                manifest = json.loads(data.decode('utf8'))
+
+            with self.stats.phase('fingerprint'):
+                # Alias names are case insensitive, as in parse_src_field().
+                vcsconfig = dict(
+                    (key.lower(), value)
+                    for key, value in manifest.get('vcsconfig', {}).items())
+                aliases = dict((key, rdflib.namespace.Namespace(value))
+                               for key, value in vcsconfig.items())
+                components = {}
+                for component in manifest['components']:
+                    key = component['src'].partition(':')[0].lower()
+                    encoded = _canonical_json([component, vcsconfig.get(key)])
+                    fingerprint = fingerprints.get(encoded)
+                    if fingerprint is None:
+                        fingerprint = hashlib.sha1(
+                            encoded.encode('utf8')).hexdigest()
+                        fingerprints[encoded] = fingerprint
+                    components[fingerprint] = component
+                new = set(components)
+
+            with self.stats.phase('add_components'):
+                for fingerprint in sorted(new - current):
+                    triples = triples_for_fingerprint.get(fingerprint)
+                    if triples is None:
+                        triples = self.component_triples(
+                            namespace, components[fingerprint], aliases,
+                            fingerprint)
+                        triples_for_fingerprint[fingerprint] = triples
+                        self.stats.count('component_versions')
+                    self.stats.count('components_added')
+                    for triple in triples:
+                        refcounts[triple] += 1
+                        if refcounts[triple] == 1:
+                            writer.write(triple, snapshot_graph)
+
+                for fingerprint in sorted(current - new):
+                    self.stats.count('components_removed')
+                    for triple in triples_for_fingerprint[fingerprint]:
+                        refcounts[triple] -= 1
+                        if refcounts[triple] == 0:
+                            del refcounts[triple]
+                            writer.write(triple, removed_graph)
+
+            current = new
+            self.stats.count('snapshots')
+
+
+MANIFEST_FILENAME = re.compile(r'^manifest\.(.+)\.json$')
+
+
+def find_manifests(path):
+    '''Return (snapshot name, path) for each dated manifest in 'path'.'''
+    result = []
+    for filename in os.listdir(path):
+        match = MANIFEST_FILENAME.match(filename)
+        if match:
+            result.append((match.group(1), os.path.join(path, filename)))
+    if not result:
+        raise RuntimeError("No manifest.*.json files found in %s" % path)
+    return sorted(result)
+
+
+class NQuadsDeltaWriter():
+    '''Write triples into several named graphs, as N-Quads.
+
+    Quads are written in the order they are given, through one buffer, so
+    memory use doesn't grow with the number of snapshots.
+
+    '''
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.writer = helpers.NTriplesWriter(stream)
+
+    def write(self, triple, graph_name):
+        self.writer.write(triple, graph_name)
+
+    def flush(self):
+        self.writer.flush()
+        self.stream.flush()
+
+
+def import_history(args, stats):
+    if args.output_format != 'nquads':
+        raise RuntimeError("Importing a directory of manifests writes a "
+                           "named graph for each snapshot, so it needs "
+                           "--output-format nquads")
+    manifest_paths = find_manifests(args.input_location)
+
+    stream = sys.stdout.buffer
+    if args.gzip:
+        stream = gzip.GzipFile(fileobj=stream, mode='wb')
+    writer = NQuadsDeltaWriter(stream)
+
+    importer = GnomeContinuousImporter(store=args.store, stats=stats)
+    importer.parse_history(manifest_paths, args.output_location, writer)
+    writer.flush()
+    if args.gzip:
+        stream.close()
+
 
 def main():
     args = argument_parser().parse_args()
 
-    with open(args.input_location, 'r') as f:
-        manifest = json.load(f)
-
-    graph = GnomeContinuousImporter().parse_manifest(
-        manifest, args.output_location)
+    stats = helpers.stats_for_args(args)
+
+    if os.path.isdir(args.input_location):
+        helpers.run_with_profile(args, import_history, args, stats)
+        helpers.write_stats(args, stats)
+        return
+
+    def run():
+        with stats.phase('parse'):
+            with open(args.input_location, 'r') as f:
+                manifest = json.load(f)
+
+        importer = GnomeContinuousImporter(store=args.store, stats=stats)
+
+        if args.stream:
+            sink = helpers.CountingSink(
+                helpers.StreamSink(sys.stdout.buffer,
+                                   output_format=args.output_format,
+                                   graph_name=args.output_location,
+                                   compress=args.gzip),
+                by_type=stats.enabled)
+            with stats.phase('stream'):
+                helpers.write_batches(
+                    importer.triple_batches(manifest, args.output_location),
+                    sink)
+            stats.count('triples_written', sink.count)
+            return sink
+
+        graph = importer.parse_manifest(manifest, args.output_location)
+
+        with stats.phase('serialize'):
+            helpers.write_graph(graph, sys.stdout.buffer,
+                                output_format=args.output_format,
+                                graph_name=args.output_location,
+                                compress=args.gzip)
+        return graph
 
-    #sys.stdout.write(helpers.serialize_to_json_ld(graph).decode('utf8'))
-    sys.stdout.write(helpers.serialize_to_rdfxml(graph).decode('utf8'))
+    output = helpers.run_with_profile(args, run)
+    helpers.write_stats(args, stats, output)
 
 
-main()
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
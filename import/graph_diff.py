@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+# Copyright 2015 Sam Thursfield
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Show the triples that were added and removed between two imported graphs.
+
+    python3 import/graph_diff.py old.nt new.nt > changes.patch
+
+The output is a patch with a section for each subject that changed. Each
+line after the '-' or '+' is an N-Triples statement, so the added triples
+can be picked out with `grep '^+[<_]' | cut -c2-`.
+
+    --- old.nt
+    +++ new.nt
+    @@ <http://www.baserock.org/...#groups/strata/foo-runtime> @@
+    -<http://...> <http://...#contains> <http://...#foo-chunk-bins> .
+    +<http://...> <http://...#contains> <http://...#foo-chunk-libs> .
+
+Neither graph is loaded into memory. Each input is read as a stream of
+triples, written out as N-Triples lines in sorted runs of --chunk-size
+lines, and the runs are merged. The two sorted streams are then compared
+line by line. Sorting puts all the lines for one subject together.
+
+Blank nodes, such as the ones used for RDF collections, get a new name each
+time a graph is written or parsed, so they would otherwise show up as
+changed every time. They are renamed by hashing their surroundings: each
+blank node's label is computed from the triples it is in, with the labels
+of neighbouring blank nodes found in the same way, repeating until that
+stops telling any more of them apart. An unchanged list gets the same
+labels in both graphs, and a list that changed is shown as removed and
+added as a whole. The triples that contain blank nodes have to be kept
+in memory to do this, but those are a small part of the imported data.
+
+'''
+
+
+import rdflib
+
+import argparse
+import collections
+import hashlib
+import heapq
+import io
+import os
+import re
+import sys
+import tempfile
+
+import helpers
+import snapshot
+
+
+# Number of lines sorted in memory at once. Each one takes a few hundred
+# bytes, so this is about 100MB.
+DEFAULT_CHUNK_SIZE = 500000
+
+# Lines that can't be read directly are parsed in batches of this size.
+PARSE_BATCH_SIZE = 10000
+
+_IRI = r'<[^<>"{}|^`\\\s]*>'
+
+# An N-Triples or N-Quads statement without blank nodes, escapes, datatypes
+# or language tags, which is the same after parsing and writing it out again
+# with helpers.ntriples_term().
+_SIMPLE_LINE = re.compile(
+    r'(%s) (%s) (%s|"[^"\\\r\n]*")(?: %s)? \.\s*$' % (_IRI, _IRI, _IRI, _IRI))
+
+
+class ExternalSorter():
+    '''Sort lines of text, using temporary files rather than memory.
+
+    Lines are passed to add(). Every 'chunk_size' lines, they are sorted and
+    written to a file in 'work_dir'. sorted_lines() merges the files.
+
+    '''
+
+    def __init__(self, work_dir, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.work_dir = work_dir
+        self.chunk_size = chunk_size
+        self.lines = []
+        self.runs = []
+
+    def add(self, line):
+        self.lines.append(line)
+        if len(self.lines) >= self.chunk_size:
+            self._write_run()
+
+    def _write_run(self):
+        self.lines.sort()
+        with tempfile.NamedTemporaryFile('w', encoding='utf8',
+                                         dir=self.work_dir, suffix='.run',
+                                         delete=False) as f:
+            f.writelines(self.lines)
+            self.runs.append(f.name)
+        self.lines = []
+
+    def sorted_lines(self):
+        '''Yield every line that was added, in order, without duplicates.'''
+        if self.runs:
+            if self.lines:
+                self._write_run()
+            files = [open(path, encoding='utf8') for path in self.runs]
+            lines = heapq.merge(*files)
+        else:
+            self.lines.sort()
+            files = []
+            lines = self.lines
+        try:
+            previous = None
+            for line in lines:
+                if line != previous:
+                    yield line
+                previous = line
+        finally:
+            for f in files:
+                f.close()
+            for path in self.runs:
+                os.unlink(path)
+            self.runs = []
+            self.lines = []
+
+
+def _components(edges):
+    '''Group blank nodes that are linked to each other by some triple.'''
+    parent = {}
+
+    def find(node):
+        root = node
+        while parent.get(root, root) != root:
+            root = parent[root]
+        while node != root:
+            parent[node], node = root, parent.get(node, node)
+        return root
+
+    for node, node_edges in edges.items():
+        for edge, other in node_edges:
+            if isinstance(other, rdflib.BNode):
+                a, b = find(node), find(other)
+                if a != b:
+                    parent[a] = b
+
+    components = collections.defaultdict(list)
+    for node in edges:
+        components[find(node)].append(node)
+    return components.values()
+
+
+def canonical_labels(triples):
+    '''Return a dict of blank node -> label for the blank nodes in 'triples'.
+
+    The labels only depend on the shape of the graph around each blank node,
+    not on its original name, so the same data always gets the same labels.
+    Blank nodes that can't be told apart from their surroundings get the
+    same label, which only merges triples that say the same thing. Changing
+    any part of a group of linked blank nodes, such as one item of a list,
+    changes the labels of all of them.
+
+    '''
+    # Blank node -> [(direction and predicate, other term)]. If the other
+    # term isn't a blank node, it is already in its final form.
+    edges = collections.defaultdict(list)
+    for s, p, o in triples:
+        if isinstance(s, rdflib.BNode):
+            edges[s].append(('> ' + p.n3() + ' ',
+                             o if isinstance(o, rdflib.BNode)
+                             else helpers.ntriples_term(o)))
+        if isinstance(o, rdflib.BNode):
+            edges[o].append(('< ' + p.n3() + ' ', s if
+                             isinstance(s, rdflib.BNode) else s.n3()))
+
+    labels = {}
+    # Each group of connected blank nodes is labelled separately, so that a
+    # change to one list doesn't change the labels in another.
+    for component in _components(edges):
+        hashes = dict.fromkeys(component, '')
+        distinct = 1
+        while True:
+            new_hashes = {}
+            for node in component:
+                items = sorted(
+                    edge + (hashes[other] if isinstance(other, rdflib.BNode)
+                            else other)
+                    for edge, other in edges[node])
+                text = hashes[node] + '\n' + '\n'.join(items)
+                new_hashes[node] = hashlib.sha1(
+                    text.encode('utf8')).hexdigest()
+            hashes = new_hashes
+            new_distinct = len(set(hashes.values()))
+            if new_distinct <= distinct:
+                break
+            distinct = new_distinct
+        # The hashes only describe the surroundings up to a certain
+        # distance, which isn't enough to tell two lists with the same tail
+        # apart, so every label also includes a hash of the whole group.
+        component_hash = hashlib.sha1(
+            '\n'.join(sorted(hashes.values())).encode('ascii')).hexdigest()
+        for node, value in hashes.items():
+            labels[node] = '_:b' + hashlib.sha1(
+                (component_hash + value).encode('ascii')).hexdigest()
+    return labels
+
+
+def read_ntriples(path, line_callback, triple_callback,
+                  batch_size=PARSE_BATCH_SIZE):
+    '''Read an N-Triples or N-Quads file, parsing only the lines that need it.
+
+    Most lines in the importers' output are already in the form that
+    helpers.ntriples_term() gives, and are passed straight to
+    'line_callback' without the graph name. The others are parsed with
+    rdflib, in batches, and passed to 'triple_callback' as triples.
+
+    '''
+    bnode_context = {}
+    pending = []
+
+    def parse_pending():
+        dataset = rdflib.Dataset()
+        dataset.parse(data=''.join(pending), format='nquads',
+                      bnode_context=bnode_context)
+        for s, p, o, graph in dataset.quads():
+            triple_callback((s, p, o))
+        del pending[:]
+
+    with snapshot.open_rdf_file(path) as f:
+        for line in io.TextIOWrapper(f, encoding='utf8'):
+            match = _SIMPLE_LINE.match(line)
+            if match is not None:
+                line_callback('%s %s %s .\n' % match.groups())
+            else:
+                pending.append(line)
+                if len(pending) >= batch_size:
+                    parse_pending()
+    if pending:
+        parse_pending()
+
+
+def sorted_triples(paths, work_dir, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''Read a graph and yield its triples as sorted N-Triples lines.'''
+    sorter = ExternalSorter(work_dir, chunk_size)
+    blank_triples = []
+
+    def add(triple):
+        s, p, o = triple
+        if isinstance(s, rdflib.BNode) or isinstance(o, rdflib.BNode):
+            blank_triples.append(triple)
+        else:
+            sorter.add('%s %s %s .\n' % (
+                s.n3(), p.n3(), helpers.ntriples_term(o)))
+
+    if len(paths) == 1 and paths[0].endswith('.sqlite'):
+        snapshot.stream_triples(paths, add)
+    else:
+        for path in paths:
+            if snapshot.guess_format(path) in ('nt', 'nquads'):
+                read_ntriples(path, sorter.add, add)
+            else:
+                snapshot.stream_triples([path], add)
+
+    labels = canonical_labels(blank_triples)
+    for s, p, o in blank_triples:
+        sorter.add('%s %s %s .\n' % (
+            labels.get(s) or s.n3(), p.n3(),
+            labels.get(o) or helpers.ntriples_term(o)))
+    del blank_triples
+
+    return sorter.sorted_lines()
+
+
+def diff_lines(old_lines, new_lines):
+    '''Compare two sorted streams of lines.
+
+    Yields ('-', line) for each line only in 'old_lines' and ('+', line)
+    for each line only in 'new_lines', in order.
+
+    '''
+    old_lines = iter(old_lines)
+    new_lines = iter(new_lines)
+    old = next(old_lines, None)
+    new = next(new_lines, None)
+    while old is not None or new is not None:
+        if new is None or (old is not None and old < new):
+            yield '-', old
+            old = next(old_lines, None)
+        elif old is None or new < old:
+            yield '+', new
+            new = next(new_lines, None)
+        else:
+            old = next(old_lines, None)
+            new = next(new_lines, None)
+
+
+def write_patch(changes, stream, old_name, new_name):
+    '''Write the output of diff_lines() as a patch grouped by subject.
+
+    Returns the number of triples removed and added.
+
+    '''
+    counts = {'-': 0, '+': 0}
+    subject = None
+    buffer = []
+    for sign, line in changes:
+        if subject is None:
+            buffer.append('--- %s\n+++ %s\n' % (old_name, new_name))
+        line_subject = line.split(' ', 1)[0]
+        if line_subject != subject:
+            subject = line_subject
+            buffer.append('@@ %s @@\n' % subject)
+        buffer.append(sign + line)
+        counts[sign] += 1
+        if len(buffer) >= 10000:
+            stream.write(''.join(buffer).encode('utf8'))
+            buffer = []
+    stream.write(''.join(buffer).encode('utf8'))
+    stream.flush()
+    return counts['-'], counts['+']
+
+
+def diff(old_paths, new_paths, stream, work_dir=None,
+         chunk_size=DEFAULT_CHUNK_SIZE):
+    '''Write a patch from the graph in 'old_paths' to that in 'new_paths'.'''
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmpdir:
+        old_lines = sorted_triples(old_paths, tmpdir, chunk_size)
+        new_lines = sorted_triples(new_paths, tmpdir, chunk_size)
+        return write_patch(diff_lines(old_lines, new_lines), stream,
+                           ' '.join(old_paths), ' '.join(new_paths))
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Show the triples added and removed between two graphs")
+    parser.add_argument('old_location', type=str,
+                        help="Snapshot or RDF file written by the importers")
+    parser.add_argument('new_location', type=str,
+                        help="Snapshot or RDF file to compare it with")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="Number of triples to sort in memory at once "
+                             "(default: %(default)s)")
+    parser.add_argument('--work-dir', type=str,
+                        help="Directory for temporary files (default: the "
+                             "system temporary directory)")
+    return parser
+
+
+def main():
+    args = argument_parser().parse_args()
+    removed, added = diff([args.old_location], [args.new_location],
+                          sys.stdout.buffer, work_dir=args.work_dir,
+                          chunk_size=args.chunk_size)
+    sys.stderr.write("%i triples removed, %i added\n" % (removed, added))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
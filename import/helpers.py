@@ -18,6 +18,47 @@
 
 
 import rdflib
+import rdflib.plugin
+import rdflib.store
+
+import collections
+import contextlib
+import cProfile
+import gzip
+import json
+import os
+import re
+import resource
+import sys
+import time
+
+
+# The module is only imported when a graph actually uses this store.
+rdflib.plugin.register('Compact', rdflib.store.Store,
+                       'compact_store', 'CompactStore')
+
+STORES = ['default', 'Compact']
+
+DEFAULT_CONTEXT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               '..', 'context.jsonld')
+
+# The importers use this namespace, but the ontology and context.jsonld use
+# the one without 'www.'. Treat them as the same.
+NAMESPACE_ALIASES = {
+    'http://www.baserock.org/software-integration-ontology#':
+        'http://baserock.org/software-integration-ontology#',
+}
+
+
+def canonical_iri(iri, aliases=NAMESPACE_ALIASES):
+    '''Return 'iri' as a string, with any aliased namespace replaced.'''
+    iri = str(iri)
+    for alias, namespace in aliases.items():
+        if iri.startswith(alias):
+            return namespace + iri[len(alias):]
+    return iri
+
+_CANONICAL_INTEGER = re.compile(r'-?(0|[1-9][0-9]*)$')
 
 
 class SoftwareNamespace(rdflib.Namespace):
@@ -58,14 +99,747 @@ class SoftwareNamespace(rdflib.Namespace):
         raise KeyError("Not a known software resource type: %s" % attr)
 
 
-def serialize_to_json_ld(rdflib_graph):
-    context = {
-        "@vocab": SOFTWARE,
-        "@language": "en"
-    }
-    # requires rdflib-jsonld Python module.
-    return rdflib_graph.serialize(format='json-ld', indent=4, context=context)
+def encode_term(term):
+    '''Return a (kind, value, datatype, lang) tuple for an rdflib term.
+
+    This is a compact form that can be stored in a database, or passed
+    between processes, without pickling rdflib objects.
+
+    '''
+    if isinstance(term, rdflib.URIRef):
+        return ('U', str(term), '', '')
+    elif isinstance(term, rdflib.BNode):
+        return ('B', str(term), '', '')
+    elif isinstance(term, rdflib.Literal):
+        return ('L', str(term), str(term.datatype or ''), term.language or '')
+    else:
+        raise TypeError("Can't store term of type %s: %r" %
+                        (type(term).__name__, term))
+
+
+def decode_term(kind, value, datatype, lang):
+    if kind == 'U':
+        return rdflib.URIRef(value)
+    elif kind == 'B':
+        return rdflib.BNode(value)
+    else:
+        return rdflib.Literal(value, lang=lang or None,
+                              datatype=datatype or None)
+
+
+# A group of triples produced by an importer. 'replaced' is a collection of
+# (subject, predicate) pairs that had Resource.set() called on them: any
+# values that a sink already has for them should be removed before the new
+# triples are added.
+TripleBatch = collections.namedtuple('TripleBatch', ['triples', 'replaced'])
+
+
+class TripleBuffer():
+    '''Collect triples in memory and add them to a graph in bulk.
+
+    Adding triples to an rdflib.Graph one at a time is slow, and
+    rdflib.resource.Resource.set() is slower still because it removes the
+    existing values before adding the new one. This class keeps the same
+    semantics as Resource.set() and Resource.add(), but de-duplicates the
+    triples in memory and only touches the graph when flush() is called.
+
+    '''
+    def __init__(self, graph=None):
+        self.graph = graph
+        # (subject, predicate) -> {object: None}, which is an ordered set.
+        self.values = {}
+        # (subject, predicate) pairs whose existing values in the graph must
+        # be removed on the next flush, because set() was called for them.
+        self.replaced = set()
+
+    def add(self, s, p, o):
+        self.values.setdefault((s, p), {})[o] = None
+
+    def set(self, s, p, o):
+        self.values[(s, p)] = {o: None}
+        self.replaced.add((s, p))
+
+    def resource(self, identifier):
+        return BufferedResource(self, identifier)
+
+    def export(self):
+        '''Return the buffered changes in a compact, picklable form.
+
+        The result is a (terms, replaced, values) tuple. 'terms' is a list of
+        encoded terms, and the other two refer to terms by their index in
+        that list: 'replaced' is a list of (s, p) pairs that had set() called
+        on them, and 'values' is a list of (s, p, [o, ...]) tuples.
+
+        '''
+        term_ids = {}
+
+        def term_id(term):
+            if term not in term_ids:
+                term_ids[term] = len(term_ids)
+            return term_ids[term]
+
+        values = [(term_id(s), term_id(p), [term_id(o) for o in objects])
+                  for (s, p), objects in self.values.items()]
+        replaced = [(term_id(s), term_id(p)) for s, p in self.replaced]
+        terms = [encode_term(term) for term in term_ids]
+        return terms, replaced, values
+
+    def merge(self, exported):
+        '''Replay changes from another buffer's export() into this one.
+
+        The result is the same as if the set() and add() calls that were
+        made on the other buffer had been made on this one.
+
+        '''
+        terms, replaced, values = exported
+        terms = [decode_term(*term) for term in terms]
+        replaced = set(replaced)
+        for s, p, objects in values:
+            key = (terms[s], terms[p])
+            objects = dict.fromkeys(terms[o] for o in objects)
+            if (s, p) in replaced:
+                self.values[key] = objects
+                self.replaced.add(key)
+            else:
+                self.values.setdefault(key, {}).update(objects)
+
+    def __len__(self):
+        return sum(len(objects) for objects in self.values.values())
+
+    def take(self):
+        '''Return the buffered changes as a TripleBatch, and empty the buffer.'''
+        batch = TripleBatch(
+            [(s, p, o) for (s, p), objects in self.values.items()
+             for o in objects],
+            self.replaced)
+        self.values = {}
+        self.replaced = set()
+        return batch
+
+    def flush(self):
+        GraphSink(self.graph).write(self.take())
+
+
+class BufferedResource():
+    '''Stand-in for rdflib.resource.Resource that writes to a TripleBuffer.
+
+    Only the methods needed for writing data are provided; the buffered
+    triples can't be queried until they have been flushed.
+
+    '''
+    def __init__(self, triple_buffer, identifier):
+        self._buffer = triple_buffer
+        self.identifier = identifier
+
+    def add(self, p, o):
+        if isinstance(o, BufferedResource):
+            o = o.identifier
+        self._buffer.add(self.identifier, p, o)
+
+    def set(self, p, o):
+        if isinstance(o, BufferedResource):
+            o = o.identifier
+        self._buffer.set(self.identifier, p, o)
+
+
+def serialize_to_json_ld(rdflib_graph, context=None):
+    '''Return 'rdflib_graph' as a single compacted JSON-LD document.
+
+    This holds the whole document in memory. For large graphs, use the
+    'ndjson' output format, which writes one resource at a time.
+
+    '''
+    context = context or JSONLDContext.load()
+    nodes = [context.compact_node(subject,
+                                  rdflib_graph.predicate_objects(subject))
+             for subject in rdflib_graph.subjects(unique=True)]
+    return json.dumps({'@context': context.context, '@graph': nodes},
+                      indent=4, ensure_ascii=False)
 
 
 def serialize_to_rdfxml(rdflib_graph):
     return rdflib_graph.serialize(format='xml', indent=4)
+
+
+def _escape_literal(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n').replace('\r', '\\r')
+
+
+def ntriples_term(term):
+    '''Return 'term' in N-Triples syntax, always on one line.'''
+    if isinstance(term, rdflib.Literal):
+        text = '"%s"' % _escape_literal(str(term))
+        if term.language:
+            return text + '@' + term.language
+        if term.datatype is not None:
+            return text + '^^<%s>' % term.datatype
+        return text
+    return term.n3()
+
+
+OUTPUT_FORMATS = ['rdfxml', 'ntriples', 'nquads', 'ndjson']
+
+
+class NTriplesWriter():
+    '''Write triples to a binary file object as N-Triples or N-Quads.
+
+    Unlike rdflib's serializers, this doesn't need the whole graph up front:
+    triples can be passed to write() as they are produced. Output lines are
+    collected into chunks of 'buffer_size' triples before being written, so
+    memory use doesn't grow with the size of the output.
+
+    If 'graph_name' is given, every line gets it as the fourth element, which
+    makes the output N-Quads rather than N-Triples. A different graph name
+    can also be passed to write() for each triple.
+
+    '''
+    def __init__(self, stream, graph_name=None, buffer_size=10000):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.count = 0
+
+        self.line_end = self._line_end(graph_name)
+        # The line ending for the last graph name passed to write().
+        self._last_graph = (None, self.line_end)
+
+    @staticmethod
+    def _line_end(graph_name):
+        if graph_name is None:
+            return ' .\n'
+        return ' %s .\n' % rdflib.URIRef(graph_name).n3()
+
+    def write(self, triple, graph_name=None):
+        s, p, o = triple
+        line_end = self.line_end
+        if graph_name is not None:
+            if self._last_graph[0] != graph_name:
+                self._last_graph = (graph_name, self._line_end(graph_name))
+            line_end = self._last_graph[1]
+        self.buffer.append(
+            s.n3() + ' ' + p.n3() + ' ' + ntriples_term(o) + line_end)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def write_all(self, triples):
+        for triple in triples:
+            self.write(triple)
+
+    def flush(self):
+        if self.buffer:
+            self.stream.write(''.join(self.buffer).encode('utf8'))
+            self.count += len(self.buffer)
+            self.buffer = []
+
+
+class JSONLDContext():
+    '''Compact IRIs and values using the terms of a JSON-LD context.
+
+    Only what context.jsonld uses is understood: terms, namespace prefixes
+    such as 'sw', and terms with '@type': '@id', whose values are IRIs.
+
+    Properties, classes and datatypes are looked up after applying
+    NAMESPACE_ALIASES, so the 'www.' IRIs that the importers use compact to
+    the context's terms. The IRIs of resources, in '@id', are written in
+    full and never changed.
+
+    '''
+
+    def __init__(self, context, aliases=NAMESPACE_ALIASES):
+        self.context = context
+        self.aliases = aliases
+
+        def expand(value):
+            prefix, colon, suffix = value.partition(':')
+            if colon and not suffix.startswith('//') and prefix in context:
+                return expand(context[prefix]) + suffix
+            return value
+
+        # Full IRI -> term
+        self.terms = {}
+        # Terms whose values are IRIs
+        self.id_terms = set()
+        # (namespace, prefix), longest namespace first
+        self.prefixes = []
+        for term, definition in sorted(context.items()):
+            coerce = None
+            if isinstance(definition, dict):
+                coerce = definition.get('@type')
+                definition = definition.get('@id')
+            if not isinstance(definition, str) or term.startswith('@'):
+                continue
+            iri = expand(definition)
+            if iri.endswith(('#', '/')):
+                self.prefixes.append((iri, term))
+                continue
+            self.terms.setdefault(iri, term)
+            if coerce == '@id':
+                self.id_terms.add(term)
+        self.prefixes.sort(key=lambda item: len(item[0]), reverse=True)
+
+        self._compacted = {}
+
+    @classmethod
+    def load(cls, path=DEFAULT_CONTEXT):
+        try:
+            with open(path) as f:
+                context = json.load(f)['@context']
+        except (OSError, ValueError, KeyError) as e:
+            raise RuntimeError("Unable to read JSON-LD context from %s: %s" %
+                               (path, e))
+        return cls(context)
+
+    def term(self, iri):
+        '''Return the context's term for a property or class, or None.'''
+        return self.terms.get(canonical_iri(iri, self.aliases))
+
+    def compact_iri(self, iri):
+        '''Return the term or compact IRI for a property or class.'''
+        compacted = self._compacted.get(iri)
+        if compacted is None:
+            full_iri = canonical_iri(iri, self.aliases)
+            compacted = self.terms.get(full_iri)
+            if compacted is None:
+                compacted = full_iri
+                for namespace, prefix in self.prefixes:
+                    suffix = full_iri[len(namespace):]
+                    if full_iri.startswith(namespace) and suffix and \
+                            not suffix.startswith('//'):
+                        compacted = prefix + ':' + suffix
+                        break
+            self._compacted[iri] = compacted
+        return compacted
+
+    def compact_value(self, key, value):
+        '''Return the JSON form of 'value' as a value of property 'key'.'''
+        if isinstance(value, rdflib.Literal):
+            lexical = str(value)
+            if value.language:
+                return {'@value': lexical, '@language': value.language}
+            datatype = value.datatype
+            if datatype is None:
+                if key in self.id_terms:
+                    return {'@value': lexical}
+                return lexical
+            # JSON numbers and booleans are read back with these datatypes,
+            # as long as the lexical form is the canonical one.
+            if datatype == rdflib.XSD.integer and \
+                    _CANONICAL_INTEGER.match(lexical):
+                return int(lexical)
+            if datatype == rdflib.XSD.boolean and \
+                    lexical in ('true', 'false'):
+                return lexical == 'true'
+            return {'@value': lexical, '@type': self.compact_iri(datatype)}
+
+        if isinstance(value, rdflib.BNode):
+            iri = '_:' + value
+        else:
+            iri = str(value)
+        if key in self.id_terms:
+            return iri
+        return {'@id': iri}
+
+    def compact_node(self, subject, predicate_objects):
+        '''Return a node object for 'subject' with the given properties.'''
+        if isinstance(subject, rdflib.BNode):
+            node = {'@id': '_:' + subject}
+        else:
+            node = {'@id': str(subject)}
+        for p, o in predicate_objects:
+            if p == rdflib.RDF.type and isinstance(o, rdflib.URIRef):
+                key = '@type'
+                value = self.compact_iri(o)
+            else:
+                key = self.compact_iri(p)
+                value = self.compact_value(key, o)
+            existing = node.get(key)
+            if existing is None:
+                node[key] = value
+            elif isinstance(existing, list):
+                existing.append(value)
+            else:
+                node[key] = [existing, value]
+        return node
+
+
+class JSONLDWriter():
+    '''Write resources as compacted JSON-LD, one node object per line.
+
+    This is newline-delimited JSON: each line is a complete JSON object, so
+    consumers can split the output and read the parts in parallel, and
+    nothing needs the whole document in memory. The lines don't repeat the
+    '@context'; they are compacted against context.jsonld, and should be
+    read with that as the context.
+
+    Every write_node() call produces one line. Each line holds everything
+    passed for a subject at the time, but a subject can appear on more than
+    one line when writing a stream; JSON-LD merges node objects with the
+    same '@id'.
+
+    '''
+    def __init__(self, stream, context=None, buffer_size=1000):
+        self.stream = stream
+        self.context = context or JSONLDContext.load()
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.count = 0
+        self.nodes = 0
+        self._encode = json.JSONEncoder(ensure_ascii=False,
+                                        separators=(',', ':')).encode
+
+    def write_node(self, subject, predicate_objects):
+        predicate_objects = list(predicate_objects)
+        node = self.context.compact_node(subject, predicate_objects)
+        self.buffer.append(self._encode(node) + '\n')
+        self.count += len(predicate_objects)
+        self.nodes += 1
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def write_all(self, triples):
+        '''Group 'triples' by subject and write a line for each subject.'''
+        by_subject = collections.OrderedDict()
+        for s, p, o in dict.fromkeys(triples):
+            by_subject.setdefault(s, []).append((p, o))
+        for subject, predicate_objects in by_subject.items():
+            self.write_node(subject, predicate_objects)
+
+    def write_graph(self, graph):
+        '''Write a line for each subject in 'graph'.'''
+        for subject in graph.subjects(unique=True):
+            self.write_node(subject, graph.predicate_objects(subject))
+
+    def flush(self):
+        if self.buffer:
+            self.stream.write(''.join(self.buffer).encode('utf8'))
+            self.buffer = []
+
+
+class GraphSink():
+    '''Importer output sink that adds each TripleBatch to an rdflib.Graph.
+
+    This keeps the semantics of Resource.set() across batches, so the
+    result is the same as if the importer had written to the graph itself.
+
+    '''
+    def __init__(self, graph):
+        self.graph = graph
+
+    def write(self, batch):
+        for s, p in batch.replaced:
+            self.graph.remove((s, p, None))
+        self.graph.addN((s, p, o, self.graph) for s, p, o in batch.triples)
+
+    def close(self):
+        pass
+
+
+class StreamSink():
+    '''Importer output sink that writes each batch to a stream as it arrives.
+
+    Nothing is kept in memory, so there is no limit on the size of the
+    import. The price is that values replaced by Resource.set() in a later
+    batch can't be taken back: if two batches set different values for the
+    same subject and predicate, both are written. Triples that appear in
+    more than one batch are written more than once, which doesn't change
+    the meaning of the data.
+
+    '''
+    def __init__(self, stream, output_format='ntriples', graph_name=None,
+                 compress=False):
+        if output_format not in ('ntriples', 'nquads', 'ndjson'):
+            raise RuntimeError("Only ntriples, nquads and ndjson output can "
+                               "be streamed")
+        if output_format == 'nquads':
+            if graph_name is None:
+                raise RuntimeError("N-Quads output needs a graph name")
+        else:
+            graph_name = None
+
+        self.compress = compress
+        if compress:
+            stream = gzip.GzipFile(fileobj=stream, mode='wb')
+        self.stream = stream
+        if output_format == 'ndjson':
+            self.writer = JSONLDWriter(stream)
+        else:
+            self.writer = NTriplesWriter(stream, graph_name=graph_name)
+
+    @property
+    def count(self):
+        return self.writer.count
+
+    def write(self, batch):
+        self.writer.write_all(batch.triples)
+
+    def close(self):
+        self.writer.flush()
+        if self.compress:
+            self.stream.close()
+        else:
+            self.stream.flush()
+
+
+class CountingSink():
+    '''Importer output sink that counts triples.
+
+    If 'sink' is given, batches are passed on to it, so this counts what an
+    importer writes to any other sink. Otherwise the triples are dropped,
+    which is useful for benchmarking.
+
+    With 'by_type', each distinct triple is also counted by the rdf:type of
+    its subject, as triples_by_type() does for a graph. Streamed output can
+    repeat triples, so this keeps a hash of every triple, and a count and
+    the types of every subject. 'count' is the number of triples written,
+    including repeats, and 'distinct_count' the number without them.
+
+    '''
+    def __init__(self, sink=None, by_type=False):
+        self.sink = sink
+        self.by_type = by_type
+        self.count = 0
+        self.distinct_count = 0
+        self.batches = 0
+        self._seen = set()
+        self._subject_counts = collections.Counter()
+        self._subject_types = collections.defaultdict(set)
+
+    def write(self, batch):
+        self.count += len(batch.triples)
+        self.batches += 1
+        if self.by_type:
+            seen = self._seen
+            subject_counts = self._subject_counts
+            for s, p, o in batch.triples:
+                triple_hash = hash((s, p, o))
+                if triple_hash in seen:
+                    continue
+                seen.add(triple_hash)
+                self.distinct_count += 1
+                subject_counts[s] += 1
+                if p == rdflib.RDF.type:
+                    self._subject_types[s].add(str(o))
+        if self.sink is not None:
+            self.sink.write(batch)
+
+    def close(self):
+        if self.sink is not None:
+            self.sink.close()
+
+    def triples_by_type(self):
+        counts = collections.Counter()
+        for s, n in self._subject_counts.items():
+            for rdf_type in self._subject_types.get(s) or ['None']:
+                counts[rdf_type] += n
+        return dict(counts)
+
+
+def write_batches(batches, sink):
+    '''Pass every TripleBatch from an importer to 'sink', then close it.'''
+    for batch in batches:
+        sink.write(batch)
+    sink.close()
+    return sink
+
+
+def add_store_argument(parser):
+    '''Add an option to choose the rdflib store that holds the graph.'''
+    parser.add_argument('--store', choices=STORES, default='default',
+                        help="rdflib store used to hold the graph while it is "
+                             "built. 'Compact' uses much less memory. "
+                             "(default: %(default)s)")
+
+
+def add_output_arguments(parser):
+    '''Add the output options that are common to all the importers.'''
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS,
+                        default='rdfxml',
+                        help="Format of the data written to stdout "
+                             "(default: %(default)s)")
+    parser.add_argument('--gzip', action='store_true',
+                        help="Compress the output with gzip.")
+    parser.add_argument('--stream', action='store_true',
+                        help="Write triples as they are produced, rather "
+                             "than building the whole graph in memory first. "
+                             "Only for ntriples, nquads and ndjson output.")
+
+
+def write_graph(rdflib_graph, stream, output_format='rdfxml',
+                graph_name=None, compress=False):
+    '''Write 'rdflib_graph' to a binary file object such as stdout.
+
+    For 'nquads' output, 'graph_name' is the name of the graph that all the
+    triples are written into.
+
+    '''
+    if compress:
+        stream = gzip.GzipFile(fileobj=stream, mode='wb')
+
+    if output_format == 'rdfxml':
+        rdflib_graph.serialize(destination=stream, format='xml', indent=4)
+    elif output_format in ('ntriples', 'nquads'):
+        if output_format == 'nquads':
+            if graph_name is None:
+                raise RuntimeError("N-Quads output needs a graph name")
+        else:
+            graph_name = None
+        writer = NTriplesWriter(stream, graph_name=graph_name)
+        writer.write_all(rdflib_graph.triples((None, None, None)))
+        writer.flush()
+    elif output_format == 'ndjson':
+        writer = JSONLDWriter(stream)
+        writer.write_graph(rdflib_graph)
+        writer.flush()
+    else:
+        raise RuntimeError("Unknown output format: %s" % output_format)
+
+    if compress:
+        stream.close()
+    else:
+        stream.flush()
+
+
+class ImportStats():
+    '''Collect timings and counters from an import.
+
+    Importers call phase() around each step of the import and count() for
+    anything worth counting. Phases can be nested and entered many times;
+    the report gives the number of calls and total wall time for each.
+
+    '''
+    enabled = True
+
+    def __init__(self):
+        self.phases = collections.OrderedDict()
+        self.counters = collections.OrderedDict()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            calls, total = self.phases.get(name, (0, 0.0))
+            self.phases[name] = (calls + 1,
+                                 total + time.perf_counter() - start)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def export(self):
+        '''Return the phases and counters, to pass to merge() elsewhere.'''
+        return dict(self.phases), dict(self.counters)
+
+    def merge(self, exported):
+        '''Add in the phases and counters from another ImportStats.
+
+        This is used for work done in other processes, so the wall time of
+        a phase can add up to more than the wall time of the import.
+
+        '''
+        phases, counters = exported
+        for name, (calls, total) in phases.items():
+            own_calls, own_total = self.phases.get(name, (0, 0.0))
+            self.phases[name] = (own_calls + calls, own_total + total)
+        for name, n in counters.items():
+            self.count(name, n)
+
+    def report(self, output=None):
+        '''Return the statistics as a dict, ready to be dumped as JSON.
+
+        'output' is what the import produced: an rdflib.Graph, or a
+        CountingSink that counted the triples by type as they were written.
+        Either way, the report includes the number of triples by type.
+
+        '''
+        result = {
+            'phases': collections.OrderedDict(
+                (name, {'calls': calls, 'wall_time': total})
+                for name, (calls, total) in self.phases.items()),
+            'counters': self.counters,
+            'peak_rss_kb': resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss,
+        }
+        if isinstance(output, CountingSink):
+            result['triples'] = output.distinct_count
+            result['triples_by_type'] = output.triples_by_type()
+        elif output is not None:
+            result['triples'] = len(output)
+            result['triples_by_type'] = triples_by_type(output)
+        return result
+
+
+class NullStats():
+    '''Stand-in for ImportStats that does nothing, as cheaply as possible.'''
+    enabled = False
+
+    _null_context = contextlib.nullcontext()
+
+    def phase(self, name):
+        return self._null_context
+
+    def count(self, name, n=1):
+        pass
+
+
+NULL_STATS = NullStats()
+
+
+def triples_by_type(graph):
+    '''Count the triples in 'graph' by the rdf:type of their subject.
+
+    A subject with several types is counted once for each of them. Triples
+    whose subject has no type are counted under 'None'.
+
+    '''
+    types = collections.defaultdict(list)
+    for s, o in graph.subject_objects(rdflib.RDF.type):
+        types[s].append(str(o))
+
+    counts = collections.Counter()
+    for s in graph.subjects():
+        for rdf_type in types.get(s, ['None']):
+            counts[rdf_type] += 1
+    return dict(counts)
+
+
+def add_stats_arguments(parser):
+    '''Add the instrumentation options that are common to the importers.'''
+    parser.add_argument('--stats', type=str, metavar='FILE',
+                        help="Write timings and counts for each phase of the "
+                             "import as JSON to FILE ('-' for stderr).")
+    parser.add_argument('--profile', type=str, metavar='FILE',
+                        help="Run the import under cProfile and dump the "
+                             "profile data to FILE.")
+
+
+def stats_for_args(args):
+    '''Return an ImportStats if --stats was passed, or NULL_STATS.'''
+    if args.stats:
+        return ImportStats()
+    else:
+        return NULL_STATS
+
+
+def run_with_profile(args, function, *function_args):
+    '''Call 'function', under cProfile if --profile was passed.'''
+    if args.profile:
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(function, *function_args)
+        finally:
+            profile.dump_stats(args.profile)
+    else:
+        return function(*function_args)
+
+
+def write_stats(args, stats, output=None):
+    if stats.enabled:
+        report = stats.report(output)
+        if args.stats == '-':
+            json.dump(report, sys.stderr, indent=4)
+            sys.stderr.write('\n')
+        else:
+            with open(args.stats, 'w') as f:
+                json.dump(report, f, indent=4)
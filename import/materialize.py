@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+# Copyright 2015 Sam Thursfield
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Add the triples implied by the ontology's class and property hierarchy.
+
+A GitObject is also a FileTree, and a GitRepository is also a Repository and
+a doap:GitRepository. Rather than every query having to know that, using
+property paths such as 'a/rdfs:subClassOf*', the implied rdf:type triples
+(and likewise for rdfs:subPropertyOf) are worked out once and stored.
+
+The rules are those of RDFS for subClassOf and subPropertyOf, with
+owl:equivalentClass and owl:equivalentProperty treated as subclass or
+subproperty in both directions. They are applied by semi-naive forward
+chaining: each round only looks at the triples that the previous round
+produced, and stops when nothing new comes out.
+
+The inferred triples are kept apart from the asserted ones, so that they
+can be updated when the data changes. See Materialization.
+
+To write the triples implied by some imported data:
+
+    python3 import/materialize.py definitions.nt > inferred.nt
+
+The importers add them to their output when given --materialize.
+
+'''
+
+
+import rdflib
+
+import argparse
+import collections
+import os
+import sys
+
+import helpers
+import snapshot
+import validate
+
+
+RDF = rdflib.RDF
+RDFS = rdflib.RDFS
+OWL = rdflib.OWL
+
+
+class Schema():
+    '''The subclass and subproperty rules from an ontology.
+
+    The ontology's own namespace is renamed to the 'www.' form that the
+    importers use (see helpers.NAMESPACE_ALIASES), so that the inferred
+    triples use the same terms as the rest of the data.
+
+    '''
+
+    def __init__(self, graph, aliases=helpers.NAMESPACE_ALIASES):
+        self.superclasses = collections.defaultdict(set)
+        self.superproperties = collections.defaultdict(set)
+
+        renames = [(namespace, alias) for alias, namespace in aliases.items()]
+
+        def rename(term):
+            for namespace, alias in renames:
+                if term.startswith(namespace):
+                    return rdflib.URIRef(alias + term[len(namespace):])
+            return term
+
+        def pairs(predicate):
+            for a, b in graph.subject_objects(predicate):
+                if isinstance(a, rdflib.URIRef) and \
+                        isinstance(b, rdflib.URIRef):
+                    yield rename(a), rename(b)
+
+        def both_ways(table, predicate):
+            for a, b in pairs(predicate):
+                table[a].add(b)
+                table[b].add(a)
+
+        def one_way(table, predicate):
+            for a, b in pairs(predicate):
+                table[a].add(b)
+
+        one_way(self.superclasses, RDFS.subClassOf)
+        both_ways(self.superclasses, OWL.equivalentClass)
+        one_way(self.superproperties, RDFS.subPropertyOf)
+        both_ways(self.superproperties, OWL.equivalentProperty)
+
+        # The inverse tables, used to check if a triple can be rederived.
+        self.subclasses = self._inverse(self.superclasses)
+        self.subproperties = self._inverse(self.superproperties)
+
+    @classmethod
+    def load(cls, path=validate.DEFAULT_ONTOLOGY):
+        return cls(validate.parse_ontology(path))
+
+    def _inverse(self, table):
+        inverse = collections.defaultdict(set)
+        for key, values in table.items():
+            for value in values:
+                inverse[value].add(key)
+        return inverse
+
+    def infer(self, delta, known):
+        '''Return the triples implied by those in 'delta'.
+
+        'known' is a function that says whether a triple is already present.
+        Known triples aren't returned, and nothing more is inferred from
+        them, since anything they imply should be present too.
+
+        '''
+        superclasses = self.superclasses
+        superproperties = self.superproperties
+        produced = set()
+        result = []
+        while delta:
+            next_delta = []
+            for s, p, o in delta:
+                candidates = []
+                if p == RDF.type and o in superclasses:
+                    candidates.extend((s, RDF.type, cls)
+                                      for cls in superclasses[o])
+                if p in superproperties:
+                    candidates.extend((s, prop, o)
+                                      for prop in superproperties[p])
+                for triple in candidates:
+                    if triple not in produced and not known(triple):
+                        produced.add(triple)
+                        next_delta.append(triple)
+            result.extend(next_delta)
+            delta = next_delta
+        return result
+
+    def relevant(self, triple):
+        '''Return True if 'triple' can imply or be implied by anything.'''
+        s, p, o = triple
+        if p == RDF.type:
+            return o in self.superclasses or o in self.subclasses
+        return p in self.superproperties or p in self.subproperties
+
+    def inferable(self, triple):
+        '''Return True if any rule could produce 'triple'.'''
+        s, p, o = triple
+        return (p == RDF.type and o in self.subclasses) or \
+            p in self.subproperties
+
+    def supported(self, triple, known):
+        '''Return True if 'triple' follows directly from known triples.'''
+        s, p, o = triple
+        if p == RDF.type:
+            for cls in self.subclasses.get(o, ()):
+                if known((s, RDF.type, cls)):
+                    return True
+        for prop in self.subproperties.get(p, ()):
+            if known((s, prop, o)):
+                return True
+        return False
+
+    def matching_triples(self, graph):
+        '''Yield the triples in 'graph' that any rule applies to.
+
+        This uses the graph's indexes, so triples that can't imply anything
+        are never looked at.
+
+        '''
+        for cls in self.superclasses:
+            yield from graph.triples((None, RDF.type, cls))
+        for prop in self.superproperties:
+            yield from graph.triples((None, prop, None))
+
+
+class Materialization():
+    '''Keep the inferred triples for the graph 'base' in 'inferred'.
+
+    'inferred' only holds triples that aren't asserted in 'base'. After
+    changing 'base', call add() with the triples that were added and remove()
+    with those that were removed, and 'inferred' is updated to match.
+    Removal uses the 'delete and rederive' method: everything the removed
+    triples implied is deleted, then whatever still follows from the
+    remaining triples is put back.
+
+    '''
+
+    def __init__(self, schema, base, inferred):
+        self.schema = schema
+        self.base = base
+        self.inferred = inferred
+
+    def known(self, triple):
+        return triple in self.base or triple in self.inferred
+
+    def rebuild(self):
+        '''Infer everything from scratch.'''
+        self.inferred.remove((None, None, None))
+        return self._add_inferred(self.schema.infer(
+            self.schema.matching_triples(self.base), self.known))
+
+    def add(self, triples):
+        '''Update after 'triples' were added to 'base'.'''
+        triples = list(triples)
+        for triple in triples:
+            # Now asserted, so no longer only inferred.
+            if self.schema.inferable(triple):
+                self.inferred.remove(triple)
+        return self._add_inferred(self.schema.infer(triples, self.known))
+
+    def remove(self, triples):
+        '''Update after 'triples' were removed from 'base'.'''
+        triples = [triple for triple in triples
+                   if self.schema.relevant(triple) and triple not in self.base]
+        implied = self.schema.infer(triples, lambda triple: False)
+        overdeleted = [triple for triple in implied
+                       if triple in self.inferred]
+        for triple in overdeleted:
+            self.inferred.remove(triple)
+
+        # A removed triple can still be implied by others, in which case it
+        # becomes an inferred triple.
+        rederived = [triple for triple in triples + overdeleted
+                     if self.schema.inferable(triple) and
+                     triple not in self.base and
+                     self.schema.supported(triple, self.known)]
+        self._add_inferred(rederived)
+        self._add_inferred(self.schema.infer(rederived, self.known))
+        return overdeleted
+
+    def _add_inferred(self, triples):
+        self.inferred.addN((s, p, o, self.inferred) for s, p, o in triples)
+        return triples
+
+
+class MaterializedGraphSink():
+    '''Importer output sink that updates a Materialization for each batch.
+
+    The triples are added to the Materialization's 'base' graph, as with
+    helpers.GraphSink, and the inferred triples are kept up to date as
+    values are added and replaced.
+
+    '''
+    def __init__(self, materialization):
+        self.materialization = materialization
+
+    def write(self, batch):
+        graph = self.materialization.base
+        schema = self.materialization.schema
+        removed = []
+        for s, p in batch.replaced:
+            if p == RDF.type or p in schema.superproperties or \
+                    p in schema.subproperties:
+                removed.extend(graph.triples((s, p, None)))
+            graph.remove((s, p, None))
+        graph.addN((s, p, o, graph) for s, p, o in batch.triples)
+
+        self.materialization.remove(removed)
+        self.materialization.add(batch.triples)
+
+    def close(self):
+        pass
+
+
+class InferringSink():
+    '''Sink that adds the inferred triples to each batch for another sink.
+
+    This is for streaming, where there is no graph to look things up in.
+    Each inferred triple is only written once, but one that is also asserted
+    in a different batch may be written as well. Like helpers.StreamSink,
+    inferred triples aren't taken back when a later batch replaces the value
+    they were inferred from.
+
+    '''
+    def __init__(self, sink, schema):
+        self.sink = sink
+        self.schema = schema
+        self.written = set()
+
+    def write(self, batch):
+        asserted = set(batch.triples)
+
+        def known(triple):
+            return triple in asserted or triple in self.written
+
+        inferred = self.schema.infer(batch.triples, known)
+        self.written.update(inferred)
+        self.sink.write(helpers.TripleBatch(list(batch.triples) + inferred,
+                                            batch.replaced))
+
+    def close(self):
+        self.sink.close()
+
+    @property
+    def count(self):
+        return getattr(self.sink, 'count', None)
+
+
+def add_materialize_arguments(parser):
+    parser.add_argument('--materialize', nargs='?',
+                        const=validate.DEFAULT_ONTOLOGY, metavar='ONTOLOGY',
+                        help="Add the triples implied by the class and "
+                             "property hierarchy of the ontology (default "
+                             "ontology: %s)" %
+                             os.path.basename(validate.DEFAULT_ONTOLOGY))
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Write the triples implied by the ontology for some data")
+    parser.add_argument('input_locations', type=str, nargs='+',
+                        help="RDF files written by the importers, or a "
+                             "snapshot")
+    parser.add_argument('--ontology', type=str,
+                        default=validate.DEFAULT_ONTOLOGY,
+                        help="Ontology to take the rules from (default: "
+                             "%(default)s)")
+    parser.add_argument('--output-format', choices=['ntriples', 'nquads'],
+                        default='ntriples',
+                        help="Format to write (default: %(default)s)")
+    parser.add_argument('--graph-name', type=str,
+                        help="Name of the graph to put the inferred triples "
+                             "in, for N-Quads output")
+    parser.add_argument('--gzip', action='store_true',
+                        help="Compress the output with gzip")
+    return parser
+
+
+def main():
+    args = argument_parser().parse_args()
+
+    schema = Schema.load(args.ontology)
+    graph = snapshot.load_graph(args.input_locations)
+    materialization = Materialization(schema, graph, rdflib.Graph())
+    inferred = materialization.rebuild()
+
+    sink = helpers.StreamSink(sys.stdout.buffer,
+                              output_format=args.output_format,
+                              graph_name=args.graph_name,
+                              compress=args.gzip)
+    helpers.write_batches([helpers.TripleBatch(inferred, ())], sink)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
@@ -0,0 +1,223 @@
+# Copyright 2015 Sam Thursfield
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Persistent cache of parsed .morph files.
+
+Parsing YAML is the slowest part of importing a large definitions repo, but
+between two imports usually only a handful of files have changed. The cache
+stores the parsed contents of every file keyed by the SHA1 of its content.
+A second table maps each path to the mtime and size that it had when it was
+last hashed, so unchanged files don't even need to be read.
+
+There is one cache file per definitions tree, so entries for files that have
+disappeared from the tree can be safely evicted when the cache is saved.
+
+When importing straight from a Git repo, GitBlobCache is used instead. Git
+already names every blob by a hash of its content, so no hashing is needed,
+and nothing is evicted: a blob parsed for one ref is reused for every other
+ref that contains it.
+
+'''
+
+
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+
+# Increase this whenever the format of the cache, or of the parsed data that
+# it stores, changes.
+CACHE_FORMAT_VERSION = 1
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME',
+                          os.path.expanduser(os.path.join('~', '.cache')))
+    return os.path.join(base, 'software-integration-ontology')
+
+
+def hash_file(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class MorphologyCache():
+    '''On-disk cache of parsed .morph files for one definitions tree.'''
+
+    def __init__(self, cache_dir, toplevel_path):
+        self.toplevel_path = os.path.abspath(toplevel_path)
+
+        tree_id = hashlib.sha1(self.toplevel_path.encode('utf8')).hexdigest()
+        self.cache_file = os.path.join(cache_dir, 'morphologies-%s.pickle' %
+                                       tree_id)
+
+        # Relative path -> (mtime_ns, size, sha1)
+        self.files = {}
+        # SHA1 -> parsed contents
+        self.blobs = {}
+
+        self.seen = set()
+        self.hits = 0
+        self.misses = 0
+
+        self._load()
+
+    def _load(self):
+        data = _read_cache_file(self.cache_file)
+        if data is None:
+            return
+
+        self.files = data['files']
+        self.blobs = data['blobs']
+
+    def _key(self, path):
+        return os.path.relpath(path, self.toplevel_path)
+
+    def get(self, path):
+        '''Return the cached contents of 'path', or None if it has changed.'''
+        key = self._key(path)
+        self.seen.add(key)
+
+        st = os.stat(path)
+        entry = self.files.get(key)
+        if entry is not None:
+            mtime, size, sha1 = entry
+            if mtime == st.st_mtime_ns and size == st.st_size:
+                if sha1 in self.blobs:
+                    self.hits += 1
+                    return self.blobs[sha1]
+
+        # The file has been touched, or we don't know about it yet. It may
+        # still have identical contents to something we already parsed.
+        sha1 = hash_file(path)
+        if sha1 in self.blobs:
+            self.files[key] = (st.st_mtime_ns, st.st_size, sha1)
+            self.hits += 1
+            return self.blobs[sha1]
+
+        self.misses += 1
+        return None
+
+    def put(self, path, contents):
+        key = self._key(path)
+        self.seen.add(key)
+
+        st = os.stat(path)
+        sha1 = hash_file(path)
+        self.files[key] = (st.st_mtime_ns, st.st_size, sha1)
+        self.blobs[sha1] = contents
+
+    def evict_stale(self):
+        '''Drop entries for files that weren't looked at since loading.'''
+        self.files = {key: entry for key, entry in self.files.items()
+                      if key in self.seen}
+        live_blobs = set(sha1 for mtime, size, sha1 in self.files.values())
+        self.blobs = {sha1: contents for sha1, contents in self.blobs.items()
+                      if sha1 in live_blobs}
+
+    def save(self):
+        self.evict_stale()
+        _write_cache_file(self.cache_file, {
+            'version': CACHE_FORMAT_VERSION,
+            'toplevel_path': self.toplevel_path,
+            'files': self.files,
+            'blobs': self.blobs,
+        })
+        logging.info("Morphology cache: %i hits, %i misses, %i entries",
+                     self.hits, self.misses, len(self.files))
+
+
+class GitBlobCache():
+    '''On-disk cache of parsed .morph files for one Git repository.
+
+    Entries are keyed by Git blob ID.
+
+    '''
+
+    def __init__(self, cache_dir, repo_path):
+        self.repo_path = os.path.abspath(repo_path)
+
+        repo_id = hashlib.sha1(self.repo_path.encode('utf8')).hexdigest()
+        self.cache_file = os.path.join(cache_dir, 'git-blobs-%s.pickle' %
+                                       repo_id)
+
+        # Blob ID -> parsed contents
+        self.blobs = {}
+        self.dirty = False
+
+        self.hits = 0
+        self.misses = 0
+
+        data = _read_cache_file(self.cache_file)
+        if data is not None:
+            self.blobs = data['blobs']
+
+    def get(self, object_id):
+        contents = self.blobs.get(object_id)
+        if contents is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return contents
+
+    def put(self, object_id, contents):
+        self.blobs[object_id] = contents
+        self.dirty = True
+
+    def save(self):
+        if self.dirty:
+            _write_cache_file(self.cache_file, {
+                'version': CACHE_FORMAT_VERSION,
+                'repo_path': self.repo_path,
+                'blobs': self.blobs,
+            })
+            self.dirty = False
+        logging.info("Git blob cache: %i hits, %i misses, %i entries",
+                     self.hits, self.misses, len(self.blobs))
+
+
+def _read_cache_file(cache_file):
+    try:
+        with open(cache_file, 'rb') as f:
+            data = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning("Ignoring unreadable cache %s: %r", cache_file, e)
+        return None
+
+    if data.get('version') != CACHE_FORMAT_VERSION:
+        logging.info("Ignoring cache %s with old format version", cache_file)
+        return None
+    return data
+
+
+def _write_cache_file(cache_file, data):
+    cache_dir = os.path.dirname(cache_file)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # Write to a temporary file first so that an interrupted import never
+    # leaves a truncated cache behind.
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_file)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
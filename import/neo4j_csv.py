@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+# Copyright 2015 Sam Thursfield
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Export imported graphs as CSV files for `neo4j-admin import`.
+
+Loading nodes into Neo4j one by one is very slow. `neo4j-admin import`
+builds a new database directly from CSV files, much faster. This writes
+nodes.csv and relationships.csv in the format that it expects:
+
+  - every resource becomes a node, with its URI in a 'uri' property
+  - rdf:type becomes node labels
+  - statements whose object is a resource become relationships
+  - statements whose object is a literal become node properties
+
+Labels, relationship types and property names are taken from the terms in
+context.jsonld, so a node of type sw:Binary has the label 'Binary'. URIs
+that aren't in the context use their local name.
+
+The input is streamed. Node IDs, labels and properties are collected in a
+temporary SQLite database on disk, so memory use doesn't grow with the size
+of the graph.
+
+    python3 import/neo4j_csv.py export neo4j-csv/ definitions.rdfxml
+    python3 import/neo4j_csv.py validate neo4j-csv/
+    neo4j-admin import --nodes=neo4j-csv/nodes.csv \\
+        --relationships=neo4j-csv/relationships.csv \\
+        --array-delimiter=U+001F
+
+A property with more than one value is written as an array. neo4j-admin has
+no way to escape the array delimiter inside a value, and its default of ';'
+is common in literals such as build commands, so the ASCII unit separator
+is used instead. An array value that contains it is an error.
+
+Values that contain line breaks are quoted, which neo4j-admin only accepts
+with --multiline-fields=true. The 'export' command prints the neo4j-admin
+options that the files need.
+
+'''
+
+
+import rdflib
+
+import argparse
+import csv
+import functools
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+
+import helpers
+import snapshot
+
+
+NODES_FILE = 'nodes.csv'
+RELATIONSHIPS_FILE = 'relationships.csv'
+
+# The ASCII unit separator, and how to give it to neo4j-admin.
+ARRAY_DELIMITER = '\x1f'
+ARRAY_DELIMITER_OPTION = '--array-delimiter=U+001F'
+
+SCHEMA = '''
+CREATE TABLE nodes (
+    id INTEGER PRIMARY KEY,
+    term TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE labels (
+    node INTEGER NOT NULL,
+    label TEXT NOT NULL,
+    PRIMARY KEY (node, label)
+) WITHOUT ROWID;
+
+CREATE TABLE properties (
+    node INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (node, key, value)
+) WITHOUT ROWID;
+
+CREATE TABLE relationships (
+    start INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    end INTEGER NOT NULL,
+    PRIMARY KEY (start, type, end)
+) WITHOUT ROWID;
+'''
+
+# Rows are inserted into SQLite in batches of this size.
+BATCH_SIZE = 10000
+
+_UNSAFE_NAME_CHARS = re.compile(r'[^A-Za-z0-9_]')
+
+
+def local_name(uri):
+    '''Return the part of 'uri' after the last '#' or '/'.'''
+    uri = str(uri)
+    for separator in ('#', '/'):
+        if separator in uri.rstrip(separator):
+            return uri.rstrip(separator).rsplit(separator, 1)[1]
+    return uri
+
+
+def safe_name(name):
+    '''Make 'name' usable as a Cypher label or type without `quoting`.'''
+    name = _UNSAFE_NAME_CHARS.sub('_', name)
+    if not name or name[0].isdigit():
+        name = '_' + name
+    return name
+
+
+class Context():
+    '''Names for URIs, taken from a JSON-LD context.'''
+
+    def __init__(self, jsonld_context):
+        self.jsonld_context = jsonld_context
+        self.names = {}
+
+    @classmethod
+    def load(cls, path=helpers.DEFAULT_CONTEXT):
+        return cls(helpers.JSONLDContext.load(path))
+
+    def name(self, uri):
+        name = self.names.get(uri)
+        if name is None:
+            name = safe_name(self.jsonld_context.term(uri) or
+                             local_name(helpers.canonical_iri(uri)))
+            self.names[uri] = name
+        return name
+
+
+class Neo4jCSVExporter():
+    '''Collect triples, then write them out as neo4j-admin CSV files.'''
+
+    def __init__(self, context, work_dir=None):
+        self.context = context
+        self.db_file = tempfile.NamedTemporaryFile(
+            suffix='.sqlite', dir=work_dir)
+        self.db = sqlite3.connect(self.db_file.name)
+        self.db.execute('PRAGMA journal_mode = OFF')
+        self.db.execute('PRAGMA synchronous = OFF')
+        self.db.executescript(SCHEMA)
+        self.node_id = functools.lru_cache(maxsize=100000)(self._node_id)
+        self.pending = {'labels': [], 'properties': [], 'relationships': []}
+        # Set by write() if any value contains a line break.
+        self.multiline_fields = False
+
+    def close(self):
+        self.db.close()
+        self.db_file.close()
+
+    def _node_id(self, key):
+        row = self.db.execute('SELECT id FROM nodes WHERE term = ?',
+                              (key,)).fetchone()
+        if row is not None:
+            return row[0]
+        return self.db.execute('INSERT INTO nodes (term) VALUES (?)',
+                               (key,)).lastrowid
+
+    def node(self, term):
+        if isinstance(term, rdflib.BNode):
+            return self.node_id('_:' + str(term))
+        return self.node_id(str(term))
+
+    def _queue(self, table, row):
+        rows = self.pending[table]
+        rows.append(row)
+        if len(rows) >= BATCH_SIZE:
+            self._flush(table)
+
+    def _flush(self, table):
+        rows = self.pending[table]
+        if rows:
+            placeholders = ', '.join('?' * len(rows[0]))
+            self.db.executemany('INSERT OR IGNORE INTO %s VALUES (%s)' %
+                                (table, placeholders), rows)
+            del rows[:]
+
+    def add(self, triple):
+        s, p, o = triple
+        subject_id = self.node(s)
+        if isinstance(o, rdflib.Literal):
+            key = self.context.name(p)
+            if key == 'uri':
+                # Taken by the node's own URI.
+                key = 'uri_'
+            self._queue('properties', (subject_id, key, str(o)))
+        elif p == rdflib.RDF.type:
+            self._queue('labels', (subject_id, self.context.name(o)))
+        else:
+            self._queue('relationships', (subject_id, self.context.name(p),
+                                          self.node(o)))
+
+    def _grouped(self, query):
+        '''Yield (node ID, rows) from a query ordered by node ID.'''
+        rows = []
+        current = None
+        for row in self.db.execute(query):
+            if row[0] != current:
+                if rows:
+                    yield current, rows
+                current = row[0]
+                rows = []
+            rows.append(row[1:])
+        if rows:
+            yield current, rows
+
+    def _cell(self, term, key, values, is_array):
+        if is_array:
+            for value in values:
+                if ARRAY_DELIMITER in value:
+                    raise RuntimeError(
+                        "Value of %s on %s contains the array delimiter "
+                        "U+001F: %r" % (key, term, value))
+        cell = ARRAY_DELIMITER.join(values)
+        if '\n' in cell or '\r' in cell:
+            self.multiline_fields = True
+        return cell
+
+    def write(self, output_dir):
+        '''Write nodes.csv and relationships.csv into 'output_dir'.'''
+        for table in self.pending:
+            self._flush(table)
+        self.db.commit()
+
+        # Properties that have more than one value on any node are arrays.
+        property_keys = sorted(key for key, in self.db.execute(
+            'SELECT DISTINCT key FROM properties'))
+        array_keys = set(key for key, in self.db.execute(
+            'SELECT DISTINCT key FROM properties GROUP BY node, key '
+            'HAVING COUNT(*) > 1'))
+        header = [':ID', 'uri', ':LABEL']
+        for key in property_keys:
+            header.append(key + (':string[]' if key in array_keys else ''))
+
+        labels = self._grouped('SELECT node, label FROM labels '
+                               'ORDER BY node, label')
+        properties = self._grouped('SELECT node, key, value FROM properties '
+                                   'ORDER BY node, key, value')
+        next_labels = next(labels, None)
+        next_properties = next(properties, None)
+
+        with open(os.path.join(output_dir, NODES_FILE), 'w',
+                  newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for node_id, term in self.db.execute(
+                    'SELECT id, term FROM nodes ORDER BY id'):
+                node_labels = []
+                if next_labels is not None and next_labels[0] == node_id:
+                    node_labels = [label for label, in next_labels[1]]
+                    next_labels = next(labels, None)
+                values = {}
+                if next_properties is not None and \
+                        next_properties[0] == node_id:
+                    for key, value in next_properties[1]:
+                        values.setdefault(key, []).append(value)
+                    next_properties = next(properties, None)
+                row = [node_id, term, ARRAY_DELIMITER.join(node_labels)]
+                for key in property_keys:
+                    row.append(self._cell(term, key, values.get(key, []),
+                                          key in array_keys))
+                writer.writerow(row)
+
+        with open(os.path.join(output_dir, RELATIONSHIPS_FILE), 'w',
+                  newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow([':START_ID', ':END_ID', ':TYPE'])
+            writer.writerows(self.db.execute(
+                'SELECT start, end, type FROM relationships '
+                'ORDER BY start, type, end'))
+
+
+def import_command(output_dir, multiline_fields=False):
+    '''Return the neo4j-admin command that imports the files.'''
+    command = ['neo4j-admin', 'import',
+               '--nodes=' + os.path.join(output_dir, NODES_FILE),
+               '--relationships=' + os.path.join(output_dir,
+                                                 RELATIONSHIPS_FILE),
+               ARRAY_DELIMITER_OPTION]
+    if multiline_fields:
+        command.append('--multiline-fields=true')
+    return ' '.join(command)
+
+
+def export(input_paths, output_dir, context_path=helpers.DEFAULT_CONTEXT):
+    '''Export the graph, and return the neo4j-admin command to import it.'''
+    os.makedirs(output_dir, exist_ok=True)
+    exporter = Neo4jCSVExporter(Context.load(context_path),
+                                work_dir=output_dir)
+    try:
+        snapshot.stream_triples(input_paths, exporter.add)
+        exporter.write(output_dir)
+    finally:
+        exporter.close()
+    return import_command(output_dir, exporter.multiline_fields)
+
+
+def validate(output_dir):
+    '''Check CSV files written by export(). Returns a list of problems.
+
+    This checks what `neo4j-admin import` would reject: malformed headers,
+    rows with the wrong number of columns, duplicate or missing node IDs,
+    and labels or types that would need quoting in Cypher.
+
+    '''
+    problems = []
+    valid_name = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+    def check_name(kind, name, line):
+        if not valid_name.match(name):
+            problems.append("%s line %i: bad %s %r" %
+                            (NODES_FILE if kind == 'label'
+                             else RELATIONSHIPS_FILE, line, kind, name))
+
+    # Node IDs are small integers, so a bitmap is enough to check them.
+    seen = bytearray()
+
+    with open(os.path.join(output_dir, NODES_FILE), newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None or header[0] != ':ID' or ':LABEL' not in header:
+            return ["%s: header must start with :ID and have a :LABEL "
+                    "column" % NODES_FILE]
+        label_column = header.index(':LABEL')
+        for column in header[1:]:
+            name, colon, column_type = column.partition(':')
+            if column != ':LABEL' and column_type not in ('', 'string[]'):
+                problems.append("%s: unexpected column %r" %
+                                (NODES_FILE, column))
+        for line, row in enumerate(reader, 2):
+            if len(row) != len(header):
+                problems.append("%s line %i: expected %i columns, got %i" %
+                                (NODES_FILE, line, len(header), len(row)))
+                continue
+            try:
+                node_id = int(row[0])
+            except ValueError:
+                problems.append("%s line %i: bad ID %r" %
+                                (NODES_FILE, line, row[0]))
+                continue
+            if node_id >= len(seen):
+                seen.extend(bytes(max(node_id + 1 - len(seen), len(seen))))
+            if seen[node_id]:
+                problems.append("%s line %i: duplicate ID %i" %
+                                (NODES_FILE, line, node_id))
+            seen[node_id] = 1
+            if row[label_column]:
+                for label in row[label_column].split(ARRAY_DELIMITER):
+                    check_name('label', label, line)
+
+    with open(os.path.join(output_dir, RELATIONSHIPS_FILE),
+              newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header != [':START_ID', ':END_ID', ':TYPE']:
+            problems.append("%s: header must be :START_ID,:END_ID,:TYPE" %
+                            RELATIONSHIPS_FILE)
+            return problems
+        for line, row in enumerate(reader, 2):
+            if len(row) != 3:
+                problems.append("%s line %i: expected 3 columns, got %i" %
+                                (RELATIONSHIPS_FILE, line, len(row)))
+                continue
+            for node_id in row[:2]:
+                if not node_id.isdigit() or int(node_id) >= len(seen) or \
+                        not seen[int(node_id)]:
+                    problems.append("%s line %i: unknown node %r" %
+                                    (RELATIONSHIPS_FILE, line, node_id))
+            check_name('relationship type', row[2], line)
+
+    return problems
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Export graphs as CSV for neo4j-admin import")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    export_parser = subparsers.add_parser(
+        'export', help="Write node and relationship CSV files")
+    export_parser.add_argument('output_location', type=str,
+                               help="Directory to write the CSV files in")
+    export_parser.add_argument('input_locations', type=str, nargs='+',
+                               help="Snapshot or RDF files written by the "
+                                    "importers")
+    export_parser.add_argument('--context', type=str,
+                               default=helpers.DEFAULT_CONTEXT,
+                               help="JSON-LD context to take names from "
+                                    "(default: context.jsonld)")
+    export_parser.add_argument('--no-validate', action='store_true',
+                               help="Don't check the files after writing")
+
+    validate_parser = subparsers.add_parser(
+        'validate', help="Check CSV files written by 'export'")
+    validate_parser.add_argument('output_location', type=str)
+    return parser
+
+
+def main():
+    args = argument_parser().parse_args()
+
+    command = None
+    if args.command == 'export':
+        command = export(args.input_locations, args.output_location,
+                         args.context)
+
+    if args.command == 'validate' or not args.no_validate:
+        problems = validate(args.output_location)
+        if problems:
+            raise RuntimeError("Invalid CSV files in %s:\n  %s" % (
+                args.output_location, '\n  '.join(problems)))
+
+    if command is not None:
+        sys.stderr.write("Import the files with:\n  %s\n" % command)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
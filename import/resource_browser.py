@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+# Copyright 2015 Sam Thursfield
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''An indexed, paginated web browser for imported graphs.
+
+The rdflib-web browser gives each resource a page named after the last
+element of its URI. When lots of resources share that name, every page view
+has to search through all of them to work out which is which, and a page for
+a resource with thousands of values lists all of them at once. This has been
+working around that by choosing URIs with unique basenames.
+
+This browser addresses resources by their full URI instead:
+
+  - The subject URIs are kept in a sorted list, so resources can be listed
+    by prefix, and in a dict keyed by basename, so that all the resources
+    with a given name can be found directly.
+  - The values of a resource, and the links to it from other resources, are
+    shown a page at a time.
+  - Rendered pages are kept in an LRU cache, which is emptied when the graph
+    is reloaded.
+
+A resource page therefore costs the same however many resources share its
+basename, and once rendered it is served from the cache.
+
+To run it on its own:
+
+    python3 import/resource_browser.py graph.sqlite --port 8080
+
+browser.py uses it when run with --backend=indexed.
+
+'''
+
+
+import rdflib
+
+import argparse
+import bisect
+import collections
+import html
+import itertools
+import logging
+import re
+import sys
+import threading
+import urllib.parse
+
+import sparql_endpoint
+
+
+DEFAULT_PAGE_SIZE = 100
+
+# Bound in addition to the graph's own prefixes, for shorter labels.
+NAMESPACES = {
+    'sw': 'http://www.baserock.org/software-integration-ontology#',
+}
+
+# The first path element of a URI, which the home page groups resources by.
+_SECTION = re.compile(r'[^:/]+://[^/]*/[^/#]*[/#]?')
+
+
+def basename(uri):
+    '''Return the last element of 'uri', as rdflib-web names its pages.'''
+    uri = str(uri).rstrip('/#')
+    return uri[max(uri.rfind('/'), uri.rfind('#')) + 1:]
+
+
+class ResourceIndex():
+    '''The subject URIs of a graph, sorted and grouped by basename.'''
+
+    def __init__(self, graph, namespaces=NAMESPACES):
+        subjects = set()
+        for subject in graph.subjects(unique=True):
+            if isinstance(subject, rdflib.URIRef):
+                subjects.add(str(subject))
+        self.subjects = sorted(subjects)
+
+        self.by_basename = {}
+        self.sections = collections.Counter()
+        for uri in self.subjects:
+            self.by_basename.setdefault(basename(uri), []).append(uri)
+            match = _SECTION.match(uri)
+            if match:
+                self.sections[match.group(0)] += 1
+
+        bound = dict(namespaces)
+        for prefix, namespace in graph.namespaces():
+            if prefix:
+                bound.setdefault(prefix, str(namespace))
+        # Longest first, so the most specific prefix is used.
+        self.namespaces = sorted(
+            ((namespace, prefix) for prefix, namespace in bound.items()),
+            key=lambda item: len(item[0]), reverse=True)
+
+    def __contains__(self, uri):
+        i = bisect.bisect_left(self.subjects, uri)
+        return i < len(self.subjects) and self.subjects[i] == uri
+
+    def __len__(self):
+        return len(self.subjects)
+
+    def with_prefix(self, prefix, offset=0, limit=DEFAULT_PAGE_SIZE):
+        '''Return (total, URIs) for a page of the subjects under 'prefix'.'''
+        start = bisect.bisect_left(self.subjects, prefix)
+        end = bisect.bisect_left(self.subjects, prefix + '\U0010ffff')
+        return end - start, \
+            self.subjects[start + offset:min(start + offset + limit, end)]
+
+    def with_basename(self, name, offset=0, limit=DEFAULT_PAGE_SIZE):
+        '''Return (total, URIs) for a page of the subjects called 'name'.'''
+        uris = self.by_basename.get(name, [])
+        return len(uris), uris[offset:offset + limit]
+
+    def label(self, uri):
+        '''Return 'uri' in prefix:name form, if a prefix is bound for it.'''
+        for namespace, prefix in self.namespaces:
+            if uri.startswith(namespace):
+                return prefix + ':' + uri[len(namespace):]
+        return uri
+
+
+STYLE = '''
+body { font-family: sans-serif; margin: 1em 2em; }
+table { border-collapse: collapse; }
+td { padding: 0.2em 1em 0.2em 0; vertical-align: top; }
+.literal-type { color: #888; font-size: smaller; }
+.pages { margin: 0.5em 0; }
+'''
+
+
+class ResourceBrowser():
+    '''WSGI application that serves HTML pages about a graph's resources.
+
+    'source' is a sparql_endpoint.ReloadingGraph. The index is built the
+    first time it's needed after each reload.
+
+    '''
+
+    def __init__(self, source, page_size=DEFAULT_PAGE_SIZE, cache_size=1000):
+        self.source = source
+        self.page_size = page_size
+        self.pages = sparql_endpoint.LRUCache(cache_size)
+        # The sorted values of recently viewed resources, so that viewing
+        # the next page of a large resource doesn't sort them all again.
+        self.rows = sparql_endpoint.LRUCache(max(cache_size // 10, 10))
+        self.lock = threading.Lock()
+        self._index = None
+        self._index_generation = None
+        source.listeners.append(self.pages.clear)
+        source.listeners.append(self.rows.clear)
+
+    def index(self, generation):
+        with self.lock:
+            if self._index_generation != generation:
+                self._index = ResourceIndex(self.source.graph)
+                self._index_generation = generation
+                logging.info("Indexed %i resources", len(self._index))
+            return self._index
+
+    # Rendering
+
+    def _link(self, index, uri):
+        href = '/resource?' + urllib.parse.urlencode({'uri': uri})
+        return '<a href="%s" title="%s">%s</a>' % (
+            html.escape(href), html.escape(uri),
+            html.escape(index.label(uri)))
+
+    def _term(self, index, term):
+        if isinstance(term, rdflib.URIRef):
+            return self._link(index, str(term))
+        elif isinstance(term, rdflib.Literal):
+            text = '<pre>%s</pre>' % html.escape(term) if '\n' in term \
+                else html.escape(term)
+            if term.language:
+                text += ' <span class="literal-type">@%s</span>' % \
+                    html.escape(term.language)
+            elif term.datatype:
+                text += ' <span class="literal-type">%s</span>' % \
+                    html.escape(index.label(str(term.datatype)))
+            return text
+        return html.escape(term.n3())
+
+    def _pager(self, path, params, key, page, total):
+        pages = max((total + self.page_size - 1) // self.page_size, 1)
+        if pages == 1:
+            return ''
+
+        def link(number, text):
+            query = dict(params, **{key: number})
+            return '<a href="%s">%s</a>' % (
+                html.escape(path + '?' + urllib.parse.urlencode(query)), text)
+
+        parts = []
+        if page > 1:
+            parts.append(link(page - 1, '&larr; previous'))
+        parts.append('page %i of %i' % (page, pages))
+        if page < pages:
+            parts.append(link(page + 1, 'next &rarr;'))
+        return '<div class="pages">%s</div>' % ' | '.join(parts)
+
+    def _document(self, title, body):
+        return ('<!DOCTYPE html>\n<html><head><meta charset="utf-8">'
+                '<title>%s</title><style>%s</style></head><body>'
+                '<p><a href="/">Home</a></p><h1>%s</h1>%s</body></html>\n' %
+                (html.escape(title), STYLE, html.escape(title), body))
+
+    def _uri_list(self, index, uris):
+        return '<ul>%s</ul>' % ''.join(
+            '<li>%s</li>' % self._link(index, uri) for uri in uris)
+
+    def _sorted_rows(self, generation, key, triples):
+        rows = self.rows.get((generation, key))
+        if rows is None:
+            rows = sorted(triples)
+            self.rows.put((generation, key), rows)
+        return rows
+
+    def _table(self, index, rows, page):
+        start = (page - 1) * self.page_size
+        return '<table>%s</table>' % ''.join(
+            '<tr><td>%s</td><td>%s</td></tr>' % (
+                self._link(index, str(a)), self._term(index, b))
+            for a, b in itertools.islice(rows, start,
+                                         start + self.page_size))
+
+    def render_resource(self, generation, index, params):
+        uri = params.get('uri', '')
+        page = params.get('page', 1)
+        incoming_page = params.get('incoming', 1)
+        subject = rdflib.URIRef(uri)
+        graph = self.source.graph
+
+        values = self._sorted_rows(generation, ('out', uri),
+                                   graph.predicate_objects(subject))
+        # (subject, predicate) pairs, shown as predicate-of-subject.
+        references = self._sorted_rows(
+            generation, ('in', uri),
+            ((p, s) for s, p in graph.subject_predicates(subject)))
+
+        body = ['<p><a href="%s">%s</a></p>' % (html.escape(uri),
+                                               html.escape(uri))]
+        name = basename(uri)
+        others = len(index.by_basename.get(name, ())) - (uri in index)
+        if others > 0:
+            body.append('<p>%i other resources are called <a href="%s">%s</a>'
+                        '.</p>' % (others, html.escape(
+                            '/basename?' + urllib.parse.urlencode(
+                                {'name': name})), html.escape(name)))
+
+        body.append('<h2>Values (%i)</h2>' % len(values))
+        body.append(self._pager('/resource', params, 'page', page,
+                                len(values)))
+        body.append(self._table(index, values, page))
+
+        body.append('<h2>Referenced by (%i)</h2>' % len(references))
+        body.append(self._pager('/resource', params, 'incoming',
+                                incoming_page, len(references)))
+        body.append('<table>%s</table>' % ''.join(
+            '<tr><td>%s</td><td>of</td><td>%s</td></tr>' % (
+                self._link(index, str(p)), self._term(index, s))
+            for p, s in itertools.islice(
+                references, (incoming_page - 1) * self.page_size,
+                incoming_page * self.page_size)))
+
+        return self._document(index.label(uri), ''.join(body))
+
+    def render_prefix(self, generation, index, params):
+        prefix = params.get('prefix', '')
+        page = params.get('page', 1)
+        total, uris = index.with_prefix(
+            prefix, (page - 1) * self.page_size, self.page_size)
+        body = '<p>%i resources</p>%s%s' % (
+            total, self._pager('/prefix', params, 'page', page, total),
+            self._uri_list(index, uris))
+        return self._document('Resources starting with %s' % prefix, body)
+
+    def render_basename(self, generation, index, params):
+        name = params.get('name', '')
+        page = params.get('page', 1)
+        total, uris = index.with_basename(
+            name, (page - 1) * self.page_size, self.page_size)
+        body = '<p>%i resources</p>%s%s' % (
+            total, self._pager('/basename', params, 'page', page, total),
+            self._uri_list(index, uris))
+        return self._document('Resources called %s' % name, body)
+
+    def render_home(self, generation, index, params):
+        namespaces = sorted(index.namespaces, key=lambda item: item[1])
+        body = [
+            '<p>%i resources.</p>' % len(index),
+            '<form action="/basename"><input name="name" size="40"> '
+            '<input type="submit" value="Find by name"></form>',
+            '<form action="/prefix"><input name="prefix" size="60"> '
+            '<input type="submit" value="List by URI prefix"></form>',
+            '<h2>Sections</h2><ul>',
+        ]
+        for section, total in sorted(index.sections.items()):
+            body.append('<li><a href="%s">%s</a> (%i)</li>' % (
+                html.escape('/prefix?' + urllib.parse.urlencode(
+                    {'prefix': section})), html.escape(section), total))
+        body.append('</ul><h2>Namespaces</h2><ul>')
+        for namespace, prefix in namespaces:
+            total, _ = index.with_prefix(namespace, limit=0)
+            if total:
+                body.append('<li><a href="%s">%s:</a> %s (%i)</li>' % (
+                    html.escape('/prefix?' + urllib.parse.urlencode(
+                        {'prefix': namespace})),
+                    html.escape(prefix), html.escape(namespace), total))
+        body.append('</ul>')
+        return self._document('Resources', ''.join(body))
+
+    ROUTES = {
+        '/': render_home,
+        '/resource': render_resource,
+        '/prefix': render_prefix,
+        '/basename': render_basename,
+    }
+
+    PAGE_PARAMS = ('page', 'incoming')
+
+    def _read_params(self, environ):
+        params = {}
+        query = urllib.parse.parse_qs(environ.get('QUERY_STRING', ''))
+        for key, values in query.items():
+            value = values[0]
+            if key in self.PAGE_PARAMS:
+                try:
+                    value = max(int(value), 1)
+                except ValueError:
+                    value = 1
+            params[key] = value
+        return params
+
+    def page(self, path, params):
+        '''Return the HTML for 'path', or None if there is no such page.'''
+        render = self.ROUTES.get(path)
+        if render is None:
+            return None
+        self.source.check()
+
+        generation = self.source.generation
+        key = (generation, path, tuple(sorted(params.items())))
+        cached = self.pages.get(key)
+        if cached is not None:
+            return cached
+
+        index = self.index(generation)
+        body = render(self, generation, index, params).encode('utf8')
+        self.pages.put(key, body)
+        return body
+
+    def __call__(self, environ, start_response):
+        body = self.page(environ.get('PATH_INFO', '/') or '/',
+                         self._read_params(environ))
+        if body is None:
+            body = b'Not found\n'
+            start_response('404 Not Found',
+                           [('Content-Type', 'text/plain'),
+                            ('Content-Length', str(len(body)))])
+            return [body]
+
+        start_response('200 OK',
+                       [('Content-Type', 'text/html; charset=utf-8'),
+                        ('Content-Length', str(len(body)))])
+        return [body]
+
+
+def add_browser_arguments(parser):
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE,
+                        help="Number of values to show on each page "
+                             "(default: %(default)s)")
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Browse imported graphs in a web browser")
+    parser.add_argument('graph_locations', type=str, nargs='+',
+                        help="Snapshot or RDF files written by the importers")
+    add_browser_arguments(parser)
+    sparql_endpoint.add_server_arguments(parser)
+    return parser
+
+
+def main():
+    args = argument_parser().parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    source = sparql_endpoint.ReloadingGraph(args.graph_locations)
+    browser = ResourceBrowser(source, page_size=args.page_size,
+                              cache_size=args.cache_size)
+    endpoint = sparql_endpoint.SPARQLEndpoint(
+        source, cache_size=args.cache_size, time_limit=args.time_limit)
+    app = sparql_endpoint.dispatch([('/sparql', endpoint)], default=browser)
+
+    server = sparql_endpoint.make_server(app, args.host, args.port,
+                                         args.threads)
+    logging.info("Serving on http://%s:%i/", args.host, args.port)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
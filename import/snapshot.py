@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+# Copyright 2015 Sam Thursfield
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Precompiled, indexed graph snapshots stored in SQLite.
+
+Parsing the RDF/XML output of the importers takes minutes for a full
+dataset. A snapshot is compiled once from those files and can then be opened
+by browser.py in near-constant time. Triples are read from disk as they are
+queried, rather than all being loaded into memory up front.
+
+To compile a snapshot:
+
+    python3 import/snapshot.py compile graph.sqlite foo.rdfxml definitions.rdfxml
+
+To use one from Python:
+
+    graph = rdflib.Graph(store=snapshot.SQLiteStore())
+    graph.open('graph.sqlite')
+
+'''
+
+
+import rdflib
+import rdflib.store
+
+import argparse
+import functools
+import gzip
+import os
+import sqlite3
+import sys
+
+import helpers
+
+
+SCHEMA = '''
+CREATE TABLE terms (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL,
+    datatype TEXT NOT NULL,
+    lang TEXT NOT NULL,
+    UNIQUE (kind, value, datatype, lang)
+);
+
+CREATE TABLE triples (
+    s INTEGER NOT NULL,
+    p INTEGER NOT NULL,
+    o INTEGER NOT NULL,
+    PRIMARY KEY (s, p, o)
+) WITHOUT ROWID;
+
+CREATE INDEX triples_pos ON triples (p, o, s);
+CREATE INDEX triples_osp ON triples (o, s, p);
+
+CREATE TABLE namespaces (
+    prefix TEXT PRIMARY KEY,
+    uri TEXT NOT NULL
+);
+'''
+
+# Map the whole database file into memory, up to this size, so that reads
+# don't need a system call each.
+MMAP_SIZE = 1 << 30
+
+
+class SQLiteStore(rdflib.store.Store):
+    '''A read-mostly rdflib Store kept in an SQLite database.
+
+    Terms are interned in a 'terms' table and the triples are kept as
+    integer IDs, with indexes to answer any triple pattern. The store isn't
+    context aware: all triples are in the default graph.
+
+    '''
+    context_aware = False
+    formula_aware = False
+    transaction_aware = True
+    graph_aware = False
+
+    def __init__(self, configuration=None, identifier=None):
+        self.db = None
+        self._term_ids = {}
+        self._length = None
+        super(SQLiteStore, self).__init__(configuration, identifier)
+
+    def open(self, configuration, create=False):
+        exists = os.path.exists(configuration)
+        if not exists and not create:
+            return rdflib.store.NO_STORE
+
+        self.db = sqlite3.connect(configuration, check_same_thread=False)
+        self.db.execute('PRAGMA mmap_size = %i' % MMAP_SIZE)
+        if not exists:
+            self.db.executescript(SCHEMA)
+            self.db.commit()
+        self._decode_id = functools.lru_cache(maxsize=100000)(
+            self._lookup_id)
+        return rdflib.store.VALID_STORE
+
+    def close(self, commit_pending_transaction=False):
+        if self.db is not None:
+            if commit_pending_transaction:
+                self.db.commit()
+            self.db.close()
+            self.db = None
+
+    def commit(self):
+        self.db.commit()
+
+    def rollback(self):
+        # IDs of terms added in the transaction may be reused afterwards, so
+        # neither cache can be trusted any more.
+        self.db.rollback()
+        self._term_ids = {}
+        self._decode_id.cache_clear()
+        self._length = None
+
+    def destroy(self, configuration):
+        self.close()
+        if os.path.exists(configuration):
+            os.unlink(configuration)
+
+    def _lookup_id(self, term_id):
+        row = self.db.execute(
+            'SELECT kind, value, datatype, lang FROM terms WHERE id = ?',
+            (term_id,)).fetchone()
+        return helpers.decode_term(*row)
+
+    def _term_id(self, term, create=False):
+        term_id = self._term_ids.get(term)
+        if term_id is not None:
+            return term_id
+
+        row = helpers.encode_term(term)
+        result = self.db.execute(
+            'SELECT id FROM terms WHERE kind = ? AND value = ? AND '
+            'datatype = ? AND lang = ?', row).fetchone()
+        if result is not None:
+            term_id = result[0]
+        elif create:
+            term_id = self.db.execute(
+                'INSERT INTO terms (kind, value, datatype, lang) '
+                'VALUES (?, ?, ?, ?)', row).lastrowid
+        else:
+            return None
+
+        self._term_ids[term] = term_id
+        return term_id
+
+    def add(self, triple, context=None, quoted=False):
+        self.addN([(triple[0], triple[1], triple[2], context)])
+
+    def addN(self, quads):
+        rows = ((self._term_id(s, create=True), self._term_id(p, create=True),
+                 self._term_id(o, create=True)) for s, p, o, c in quads)
+        self.db.executemany(
+            'INSERT OR IGNORE INTO triples (s, p, o) VALUES (?, ?, ?)', rows)
+        self._length = None
+
+    def _pattern_ids(self, triple_pattern):
+        '''Return the term IDs for a pattern, or None if it can't match.'''
+        ids = []
+        for term in triple_pattern:
+            if term is None:
+                ids.append(None)
+            else:
+                term_id = self._term_id(term)
+                if term_id is None:
+                    return None
+                ids.append(term_id)
+        return ids
+
+    def remove(self, triple_pattern, context=None):
+        ids = self._pattern_ids(triple_pattern)
+        if ids is None:
+            return
+        where, params = self._where(ids)
+        self.db.execute('DELETE FROM triples' + where, params)
+        self._length = None
+
+    def _where(self, ids):
+        conditions = []
+        params = []
+        for column, term_id in zip(('s', 'p', 'o'), ids):
+            if term_id is not None:
+                conditions.append('%s = ?' % column)
+                params.append(term_id)
+        if conditions:
+            return ' WHERE ' + ' AND '.join(conditions), params
+        else:
+            return '', params
+
+    def triples(self, triple_pattern, context=None):
+        ids = self._pattern_ids(triple_pattern)
+        if ids is None:
+            return
+        where, params = self._where(ids)
+
+        # The cursor fetches rows from the database as they are consumed, so
+        # large results are never held in memory all at once.
+        cursor = self.db.execute('SELECT s, p, o FROM triples' + where, params)
+        decode = self._decode_id
+        for s, p, o in cursor:
+            yield (decode(s), decode(p), decode(o)), iter(())
+
+    def __len__(self, context=None):
+        if self._length is None:
+            self._length = self.db.execute(
+                'SELECT COUNT(*) FROM triples').fetchone()[0]
+        return self._length
+
+    def contexts(self, triple=None):
+        return iter(())
+
+    def bind(self, prefix, namespace, override=True):
+        if override:
+            self.db.execute('DELETE FROM namespaces WHERE uri = ?',
+                            (str(namespace),))
+            self.db.execute(
+                'INSERT OR REPLACE INTO namespaces (prefix, uri) '
+                'VALUES (?, ?)', (prefix, str(namespace)))
+        else:
+            self.db.execute(
+                'INSERT OR IGNORE INTO namespaces (prefix, uri) '
+                'VALUES (?, ?)', (prefix, str(namespace)))
+
+    def namespace(self, prefix):
+        row = self.db.execute('SELECT uri FROM namespaces WHERE prefix = ?',
+                              (prefix,)).fetchone()
+        return rdflib.URIRef(row[0]) if row else None
+
+    def prefix(self, namespace):
+        row = self.db.execute('SELECT prefix FROM namespaces WHERE uri = ?',
+                              (str(namespace),)).fetchone()
+        return row[0] if row else None
+
+    def namespaces(self):
+        for prefix, uri in self.db.execute(
+                'SELECT prefix, uri FROM namespaces').fetchall():
+            yield prefix, rdflib.URIRef(uri)
+
+
+def guess_format(filename):
+    '''Guess the rdflib parser to use for one of our output files.'''
+    name = filename[:-3] if filename.endswith('.gz') else filename
+    extension = os.path.splitext(name)[1]
+    return {
+        '.nq': 'nquads',
+        '.nt': 'nt',
+        '.ttl': 'turtle',
+        '.owl': 'turtle',
+    }.get(extension, 'xml')
+
+
+def open_snapshot(path, create=False):
+    '''Open a snapshot as an rdflib.Graph.'''
+    graph = rdflib.Graph(store=SQLiteStore())
+    if graph.open(path, create=create) != rdflib.store.VALID_STORE:
+        raise RuntimeError("No snapshot found at %s" % path)
+    return graph
+
+
+def open_rdf_file(path):
+    '''Open an RDF file for reading, decompressing it if needed.'''
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    else:
+        return open(path, 'rb')
+
+
+def load_graph(paths):
+    '''Open a snapshot, or load RDF files into a 'Compact' in-memory graph.'''
+    if len(paths) == 1 and paths[0].endswith('.sqlite'):
+        return open_snapshot(paths[0])
+    graph = rdflib.Graph(store='Compact')
+    for path in paths:
+        with open_rdf_file(path) as f:
+            input_format = guess_format(path)
+            if input_format == 'nquads':
+                dataset = rdflib.Dataset()
+                dataset.parse(file=f, format=input_format)
+                graph.addN((s, p, o, graph) for s, p, o, c in dataset.quads())
+            else:
+                graph.parse(file=f, format=input_format)
+    return graph
+
+
+class _CallbackStore(rdflib.store.Store):
+    '''Write-only store that passes each triple to a function.'''
+    context_aware = True
+    # Needed by the N-Quads parser, which always parses into a Dataset.
+    graph_aware = True
+
+    def __init__(self, callback):
+        super(_CallbackStore, self).__init__()
+        self.callback = callback
+
+    def add(self, triple, context, quoted=False):
+        self.callback(triple)
+
+    def addN(self, quads):
+        for s, p, o, c in quads:
+            self.callback((s, p, o))
+
+    def add_graph(self, graph):
+        pass
+
+    def remove_graph(self, graph):
+        pass
+
+
+def stream_triples(paths, callback):
+    '''Call 'callback' with each triple in a snapshot or some RDF files.
+
+    Unlike load_graph(), nothing is kept in memory. rdflib's parsers still
+    read some formats (Turtle, JSON-LD) into memory whole, but N-Triples,
+    N-Quads and RDF/XML are streamed.
+
+    '''
+    if len(paths) == 1 and paths[0].endswith('.sqlite'):
+        graph = open_snapshot(paths[0])
+        for triple in graph.triples((None, None, None)):
+            callback(triple)
+        graph.close()
+        return
+
+    for path in paths:
+        graph = rdflib.Graph(store=_CallbackStore(callback))
+        with open_rdf_file(path) as f:
+            graph.parse(file=f, format=guess_format(path))
+
+
+def compile_snapshot(output_path, input_paths):
+    '''Compile the given RDF files into a new snapshot at 'output_path'.'''
+    if os.path.exists(output_path):
+        os.unlink(output_path)
+
+    graph = open_snapshot(output_path, create=True)
+    for input_path in input_paths:
+        input_format = guess_format(input_path)
+        with open_rdf_file(input_path) as f:
+            if input_format == 'nquads':
+                # The store isn't context aware, so flatten the quads first.
+                dataset = rdflib.Dataset()
+                dataset.parse(file=f, format=input_format)
+                graph.addN((s, p, o, graph) for s, p, o, c in dataset.quads())
+            else:
+                graph.parse(file=f, format=input_format)
+    graph.commit()
+    graph.close()
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Manage precompiled graph snapshots")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    compile_parser = subparsers.add_parser(
+        'compile', help="Compile RDF files into a snapshot")
+    compile_parser.add_argument('output_location', type=str,
+                                help="Path of the snapshot to write")
+    compile_parser.add_argument('input_locations', type=str, nargs='+',
+                                help="RDF files written by the importers")
+    return parser
+
+
+def main():
+    args = argument_parser().parse_args()
+
+    if args.command == 'compile':
+        compile_snapshot(args.output_location, args.input_locations)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
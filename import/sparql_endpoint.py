@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+# Copyright 2015 Sam Thursfield
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''A cached, concurrent SPARQL endpoint for imported graphs.
+
+This is meant for serving the same dashboard queries over and over to many
+people, which the Flask debug server used by browser.py can't cope with.
+
+  - Requests are handled by a fixed pool of threads.
+  - Results are kept in an LRU cache keyed by the query text, with
+    insignificant whitespace and comments removed.
+  - The graph files are checked for changes every few seconds. If they have
+    changed the graph is reloaded and the cache is emptied.
+  - Each query has a time limit. rdflib's query engine can't be interrupted,
+    so the limit is checked each time the query reads triples from the graph.
+
+To run it on its own:
+
+    python3 import/sparql_endpoint.py graph.sqlite --port 8080
+
+Queries are sent as GET /sparql?query=... or as a POST, following the SPARQL
+1.1 protocol.
+
+'''
+
+
+import rdflib
+import rdflib.plugins.sparql
+
+import argparse
+import collections
+import concurrent.futures
+import logging
+import os
+import sys
+import threading
+import time
+import urllib.parse
+import wsgiref.simple_server
+
+import snapshot
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+def normalize_query(query):
+    '''Return 'query' with comments and insignificant whitespace removed.
+
+    Text inside string literals and IRIs is left alone, so two queries only
+    normalize to the same text if they mean the same thing.
+
+    '''
+    result = []
+    pending_space = False
+    i = 0
+    length = len(query)
+    while i < length:
+        char = query[i]
+        if char in '"\'':
+            end = i + 1
+            while end < length and query[end] != char:
+                if query[end] == '\\':
+                    end += 1
+                end += 1
+            token = query[i:end + 1]
+        elif char == '<':
+            # Could be an IRI or the less-than operator; IRIs can't contain
+            # whitespace, so stop at the first space.
+            end = i + 1
+            while end < length and query[end] not in '> \t\r\n':
+                end += 1
+            token = query[i:end + 1] if end < length and \
+                query[end] == '>' else char
+            end = i + len(token) - 1
+        elif char == '#':
+            while i < length and query[i] != '\n':
+                i += 1
+            pending_space = True
+            continue
+        elif char.isspace():
+            pending_space = True
+            i += 1
+            continue
+        else:
+            end = i
+            token = char
+
+        if pending_space and result:
+            result.append(' ')
+        pending_space = False
+        result.append(token)
+        i = end + 1
+    return ''.join(result)
+
+
+class LRUCache():
+    '''A thread-safe least-recently-used cache.'''
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+# The deadline for the query running in the current thread, if any.
+_deadline = threading.local()
+
+
+class DeadlineGraph(rdflib.Graph):
+    '''A view of a graph that enforces per-query time limits.
+
+    It shares the store of the graph that it wraps. Every time the query
+    engine reads triples, the deadline for the current thread is checked,
+    and QueryTimeout is raised if it has passed.
+
+    '''
+    CHECK_INTERVAL = 256
+
+    def triples(self, triple):
+        deadline = getattr(_deadline, 'value', None)
+        if deadline is None:
+            yield from super(DeadlineGraph, self).triples(triple)
+            return
+
+        if time.monotonic() > deadline:
+            raise QueryTimeout()
+        for i, result in enumerate(super(DeadlineGraph, self).triples(triple)):
+            if i % self.CHECK_INTERVAL == 0 and time.monotonic() > deadline:
+                raise QueryTimeout()
+            yield result
+
+
+class ReloadingGraph():
+    '''Load a graph from files, and reload it whenever the files change.'''
+
+    def __init__(self, paths, check_interval=5.0):
+        self.paths = paths
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.listeners = []
+        self.last_check = 0
+        self.generation = 0
+        self.mtimes = None
+        self.graph = None
+        self.reload()
+
+    def _current_mtimes(self):
+        return [os.stat(path).st_mtime_ns for path in self.paths]
+
+    def reload(self):
+        mtimes = self._current_mtimes()
+        graph = snapshot.load_graph(self.paths)
+        self.graph = DeadlineGraph(store=graph.store,
+                                   identifier=graph.identifier,
+                                   namespace_manager=graph.namespace_manager)
+        self.mtimes = mtimes
+        self.generation += 1
+        for listener in self.listeners:
+            listener()
+        logging.info("Loaded graph generation %i: %i triples",
+                     self.generation, len(self.graph))
+
+    def check(self):
+        '''Reload the graph if the files have changed since last time.'''
+        now = time.monotonic()
+        if now - self.last_check < self.check_interval:
+            return
+        with self.lock:
+            if now - self.last_check < self.check_interval:
+                return
+            self.last_check = now
+            try:
+                changed = self._current_mtimes() != self.mtimes
+            except OSError:
+                # Probably in the middle of being rewritten.
+                return
+            if changed:
+                self.reload()
+
+
+RESULT_FORMATS = {
+    # Query type -> (rdflib serializer, content type)
+    'SELECT': ('json', 'application/sparql-results+json'),
+    'ASK': ('json', 'application/sparql-results+json'),
+    'CONSTRUCT': ('nt', 'application/n-triples'),
+    'DESCRIBE': ('nt', 'application/n-triples'),
+}
+
+
+class SPARQLEndpoint():
+    '''WSGI application that answers SPARQL queries against a graph.'''
+
+    def __init__(self, source, cache_size=1000, time_limit=10.0):
+        self.source = source
+        self.cache = LRUCache(cache_size)
+        self.prepared = LRUCache(cache_size)
+        self.time_limit = time_limit
+        # rdflib's SPARQL parser (pyparsing) is not thread-safe.
+        self.parse_lock = threading.Lock()
+        source.listeners.append(self.cache.clear)
+
+    def prepare(self, normalized_query):
+        prepared = self.prepared.get(normalized_query)
+        if prepared is None:
+            with self.parse_lock:
+                prepared = rdflib.plugins.sparql.prepareQuery(
+                    normalized_query)
+            self.prepared.put(normalized_query, prepared)
+        return prepared
+
+    def execute(self, query):
+        '''Run 'query', returning (content type, body). Results are cached.'''
+        self.source.check()
+
+        generation = self.source.generation
+        normalized_query = normalize_query(query)
+        key = (generation, normalized_query)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        prepared = self.prepare(normalized_query)
+        graph = self.source.graph
+        _deadline.value = time.monotonic() + self.time_limit
+        try:
+            result = graph.query(prepared)
+            result_format, content_type = RESULT_FORMATS[result.type]
+            body = result.serialize(format=result_format)
+        finally:
+            _deadline.value = None
+        if isinstance(body, str):
+            body = body.encode('utf8')
+
+        self.cache.put(key, (content_type, body))
+        return content_type, body
+
+    def _read_query(self, environ):
+        method = environ['REQUEST_METHOD']
+        if method == 'GET':
+            params = urllib.parse.parse_qs(environ.get('QUERY_STRING', ''))
+            return params.get('query', [None])[0]
+        elif method == 'POST':
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+            body = environ['wsgi.input'].read(length).decode('utf8')
+            content_type = environ.get('CONTENT_TYPE', '')
+            if content_type.startswith('application/sparql-query'):
+                return body
+            return urllib.parse.parse_qs(body).get('query', [None])[0]
+        return None
+
+    def __call__(self, environ, start_response):
+        query = self._read_query(environ)
+        if not query:
+            return self._error(start_response, '400 Bad Request',
+                               "No 'query' parameter given")
+        try:
+            content_type, body = self.execute(query)
+        except QueryTimeout:
+            return self._error(start_response, '503 Service Unavailable',
+                               "Query exceeded the time limit of %.1fs" %
+                               self.time_limit)
+        except Exception as e:
+            return self._error(start_response, '400 Bad Request',
+                               "Query failed: %s" % e)
+
+        start_response('200 OK', [('Content-Type', content_type),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
+
+    def _error(self, start_response, status, message):
+        body = (message + '\n').encode('utf8')
+        start_response(status, [('Content-Type', 'text/plain'),
+                                ('Content-Length', str(len(body)))])
+        return [body]
+
+
+def dispatch(routes, default=None):
+    '''Return a WSGI app that picks an app based on the request path.'''
+    def app(environ, start_response):
+        path = environ.get('PATH_INFO', '/')
+        for prefix, route_app in routes:
+            if path == prefix or path.startswith(prefix + '/'):
+                return route_app(environ, start_response)
+        if default is not None:
+            return default(environ, start_response)
+        start_response('404 Not Found', [('Content-Type', 'text/plain')])
+        return [b'Not found\n']
+    return app
+
+
+class QuietRequestHandler(wsgiref.simple_server.WSGIRequestHandler):
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
+
+
+class ThreadPoolWSGIServer(wsgiref.simple_server.WSGIServer):
+    '''WSGI server that handles requests with a fixed pool of threads.'''
+
+    def __init__(self, server_address, threads=8):
+        super(ThreadPoolWSGIServer, self).__init__(
+            server_address, QuietRequestHandler)
+        self.executor = concurrent.futures.ThreadPoolExecutor(threads)
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process_request_in_thread, request,
+                             client_address)
+
+    def _process_request_in_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super(ThreadPoolWSGIServer, self).server_close()
+        self.executor.shutdown(wait=False)
+
+
+def make_server(app, host='0.0.0.0', port=8080, threads=8):
+    server = ThreadPoolWSGIServer((host, port), threads=threads)
+    server.set_app(app)
+    return server
+
+
+def add_server_arguments(parser):
+    parser.add_argument('--host', type=str, default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--threads', type=int, default=8,
+                        help="Number of request handler threads "
+                             "(default: %(default)s)")
+    parser.add_argument('--cache-size', type=int, default=1000,
+                        help="Number of query results to cache "
+                             "(default: %(default)s)")
+    parser.add_argument('--time-limit', type=float, default=10.0,
+                        help="Maximum time for one query, in seconds "
+                             "(default: %(default)s)")
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Serve a SPARQL endpoint for imported graphs")
+    parser.add_argument('graph_locations', type=str, nargs='+',
+                        help="Snapshot or RDF files written by the importers")
+    add_server_arguments(parser)
+    return parser
+
+
+def main():
+    args = argument_parser().parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    source = ReloadingGraph(args.graph_locations)
+    endpoint = SPARQLEndpoint(source, cache_size=args.cache_size,
+                              time_limit=args.time_limit)
+    app = dispatch([('/sparql', endpoint)])
+
+    server = make_server(app, args.host, args.port, args.threads)
+    logging.info("Serving SPARQL endpoint on http://%s:%i/sparql",
+                 args.host, args.port)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# Copyright 2015 Sam Thursfield
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Baserock splitting rules.
+
+The files that a chunk installs are split into several artifacts (-bins,
+-devel, -doc, ...) and the chunk artifacts are then split between the
+artifacts of the stratum (-runtime, -devel). The rules for doing so come
+from the 'split-rules' section of DEFAULTS, preceded by any rules given in
+the 'products' list of the chunk or stratum .morph file. Each item goes to
+the first artifact with a regular expression that matches all of it.
+
+All the rules for one chunk or stratum are compiled into a single regular
+expression, so putting a file in the right artifact takes one match rather
+than one for each rule.
+
+To split the file manifest of a chunk:
+
+    python3 import/splitting.py definitions/ \\
+        definitions/strata/core/glibc.morph < glibc-manifest.txt
+
+'''
+
+
+import yaml
+
+import argparse
+import collections
+import json
+import os
+import re
+import sys
+
+
+# Used if DEFAULTS has no 'split-rules'. These are the rules that Morph
+# had built in before they were moved to DEFAULTS.
+DEFAULT_CHUNK_RULES = [
+    ('-bins', [r'(usr/)?s?bin/.*']),
+    ('-debug', [r'(usr/)?lib/\.debug/.*']),
+    ('-devel', [r'(usr/)?include/.*',
+                r'(usr/)?lib(32|64)?/lib.*\.a',
+                r'(usr/)?lib(32|64)?/lib.*\.la',
+                r'(usr/)?(lib(32|64)?|share)/pkgconfig/.*\.pc']),
+    ('-doc', [r'(usr/)?share/doc/.*',
+              r'(usr/)?share/(info|man)/.*']),
+    ('-libs', [r'(usr/)?lib(32|64)?/lib[^/]*\.so(\.\d+)*',
+               r'(usr/)?libexec/.*']),
+    ('-locale', [r'(usr/)?share/locale/.*',
+                 r'(usr/)?share/i18n/.*',
+                 r'(usr/)?share/zoneinfo/.*']),
+    ('-misc', [r'.*']),
+]
+
+DEFAULT_STRATUM_RULES = [
+    ('-devel', [r'.*-devel', r'.*-debug', r'.*-doc']),
+    ('-runtime', [r'.*-bins', r'.*-libs', r'.*-locale', r'.*-misc', r'.*']),
+]
+
+
+class SplitRules():
+    '''An ordered list of artifacts, with patterns for what goes in each.
+
+    'rules' is a list of (artifact name, list of regular expressions). The
+    expressions must match the whole of an item.
+
+    '''
+
+    def __init__(self, rules, artifacts=None):
+        self.rules = rules
+        if artifacts is None:
+            artifacts = [name for name, patterns in rules]
+        self.artifacts = list(collections.OrderedDict.fromkeys(artifacts))
+
+        groups = []
+        self.group_artifacts = {}
+        for i, (name, patterns) in enumerate(rules):
+            if not patterns:
+                continue
+            for pattern in patterns:
+                try:
+                    re.compile(pattern)
+                except re.error as e:
+                    raise RuntimeError("Invalid split rule '%s' for %s: %s" %
+                                       (pattern, name, e))
+            group = 'rule%i' % i
+            # Python's alternation tries each branch in turn, so the first
+            # rule that matches wins. Each rule is one named group, and any
+            # groups in the patterns are nested inside it, so 'lastgroup'
+            # tells us which rule matched.
+            groups.append('(?P<%s>%s)' % (
+                group, '|'.join('(?:%s)' % pattern for pattern in patterns)))
+            self.group_artifacts[group] = name
+        self.regex = re.compile('|'.join(groups)) if groups else None
+
+    def match(self, item):
+        '''Return the artifact that 'item' belongs in, or None.'''
+        if self.regex is None:
+            return None
+        match = self.regex.fullmatch(item)
+        if match is None:
+            return None
+        return self.group_artifacts[match.lastgroup]
+
+    def partition(self, items):
+        '''Split 'items' between the artifacts.
+
+        Returns an OrderedDict of artifact name -> list of items, with an
+        entry for every artifact, and a list of the items that matched none.
+
+        '''
+        result = collections.OrderedDict((name, []) for name in self.artifacts)
+        unmatched = []
+        fullmatch = self.regex.fullmatch if self.regex else lambda item: None
+        group_artifacts = self.group_artifacts
+        for item in items:
+            match = fullmatch(item)
+            if match is None:
+                unmatched.append(item)
+            else:
+                result[group_artifacts[match.lastgroup]].append(item)
+        return result, unmatched
+
+
+def default_rules(defaults, kind):
+    '''Return the default rules for 'kind' (chunk or stratum) from DEFAULTS.
+
+    Artifact names are suffixes, such as '-bins', to be appended to the name
+    of the chunk or stratum.
+
+    '''
+    split_rules = (defaults or {}).get('split-rules')
+    if split_rules is None:
+        return DEFAULT_CHUNK_RULES if kind == 'chunk' else \
+            DEFAULT_STRATUM_RULES
+    return [(rule['artifact'], rule.get('include', []))
+            for rule in split_rules.get(kind, [])]
+
+
+def product_rules(contents, suffix_rules, name):
+    '''Combine the 'products' of a .morph file with the default rules.
+
+    Products that are listed without an 'include' list just declare that
+    the artifact exists. If one has the same name as a default artifact, the
+    default rule still applies, in its usual place.
+
+    '''
+    defaults = [(name + suffix, patterns) for suffix, patterns in suffix_rules]
+
+    rules = []
+    artifacts = []
+    for product in (contents or {}).get('products', []):
+        artifacts.append(product['artifact'])
+        if 'include' in product:
+            rules.append((product['artifact'], product['include']))
+    rules.extend(defaults)
+    artifacts.extend(artifact for artifact, patterns in defaults)
+    return SplitRules(rules, artifacts)
+
+
+def _value_key(value):
+    '''Return a hashable key for a value from a parsed .morph file.'''
+    if not value:
+        return None
+    return json.dumps(value, sort_keys=True)
+
+
+class Splitter():
+    '''The splitting rules for a definitions repo, with cached results.
+
+    The same chunk is usually built for many systems and architectures, but
+    the way it is split only depends on the chunk and the stratum it is in,
+    so that is only worked out once.
+
+    The caches are keyed on the names and the fields that the rules come
+    from ('products', and a stratum's 'artifacts' overrides), rather than
+    on the parsed .morph files themselves, so a Splitter stays correct when
+    the files are parsed again.
+
+    '''
+
+    def __init__(self, defaults):
+        self.defaults = defaults
+        self.chunk_defaults = default_rules(defaults, 'chunk')
+        self.stratum_defaults = default_rules(defaults, 'stratum')
+        self._chunk_rules = {}
+        self._stratum_rules = {}
+        self._chunk_splits = {}
+
+    def chunk_rules(self, chunk_name, contents=None):
+        '''Return the SplitRules for the files of a chunk.'''
+        key = (chunk_name, _value_key((contents or {}).get('products')))
+        if key not in self._chunk_rules:
+            self._chunk_rules[key] = product_rules(
+                contents, self.chunk_defaults, chunk_name)
+        return self._chunk_rules[key]
+
+    def stratum_rules(self, contents):
+        '''Return the SplitRules for the chunk artifacts of a stratum.'''
+        key = (contents['name'], _value_key(contents.get('products')))
+        if key not in self._stratum_rules:
+            self._stratum_rules[key] = product_rules(
+                contents, self.stratum_defaults, contents['name'])
+        return self._stratum_rules[key]
+
+    def split_chunk(self, stratum_contents, entry, chunk_name,
+                    chunk_contents=None):
+        '''Work out which stratum artifact each artifact of a chunk goes in.
+
+        'entry' is the chunk's entry in the stratum's 'chunks' list. Its
+        'artifacts' field, if there is one, overrides the rules.
+
+        Returns an OrderedDict of stratum artifact name -> list of chunk
+        artifact names. Chunk artifacts that no rule matches are left out.
+
+        '''
+        overrides = entry.get('artifacts') or {}
+        key = (stratum_contents['name'],
+               _value_key(stratum_contents.get('products')), chunk_name,
+               _value_key((chunk_contents or {}).get('products')),
+               _value_key(overrides))
+        if key in self._chunk_splits:
+            return self._chunk_splits[key]
+
+        stratum_rules = self.stratum_rules(stratum_contents)
+        chunk_artifacts = self.chunk_rules(chunk_name, chunk_contents).artifacts
+
+        result = collections.OrderedDict(
+            (name, []) for name in stratum_rules.artifacts)
+        for chunk_artifact in chunk_artifacts:
+            stratum_artifact = overrides.get(chunk_artifact)
+            if stratum_artifact not in result:
+                stratum_artifact = stratum_rules.match(chunk_artifact)
+            if stratum_artifact is not None:
+                result[stratum_artifact].append(chunk_artifact)
+        result = collections.OrderedDict(
+            (name, chunk_artifacts) for name, chunk_artifacts in result.items()
+            if chunk_artifacts)
+
+        self._chunk_splits[key] = result
+        return result
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Split a chunk's file manifest into artifacts")
+    parser.add_argument('definitions', type=str,
+                        help="Path to the root of the definitions repository")
+    parser.add_argument('chunk', type=str,
+                        help="Chunk .morph file, or the name of a chunk "
+                             "that doesn't have one")
+    parser.add_argument('manifest', type=str, nargs='?',
+                        help="File listing one path per line (default: "
+                             "stdin)")
+    parser.add_argument('--list', action='store_true',
+                        help="Print the artifact for each path, rather "
+                             "than a summary")
+    return parser
+
+
+def main():
+    args = argument_parser().parse_args()
+
+    defaults_file = os.path.join(args.definitions, 'DEFAULTS')
+    defaults = {}
+    if os.path.exists(defaults_file):
+        with open(defaults_file) as f:
+            defaults = yaml.safe_load(f)
+
+    if os.path.exists(args.chunk):
+        with open(args.chunk) as f:
+            contents = yaml.safe_load(f)
+        rules = Splitter(defaults).chunk_rules(contents['name'], contents)
+    else:
+        rules = Splitter(defaults).chunk_rules(args.chunk)
+
+    if args.manifest:
+        with open(args.manifest) as f:
+            paths = f.read().splitlines()
+    else:
+        paths = sys.stdin.read().splitlines()
+    # Manifests sometimes list paths with a leading './' or '/'.
+    paths = [path[2:] if path.startswith('./') else path.lstrip('/')
+             for path in paths if path]
+
+    if args.list:
+        for path in paths:
+            sys.stdout.write('%s\t%s\n' % (rules.match(path) or '-', path))
+        return
+
+    matches, unmatched = rules.partition(paths)
+    for name, artifact_paths in matches.items():
+        sys.stdout.write('%s\t%i\n' % (name, len(artifact_paths)))
+    if unmatched:
+        sys.stdout.write('(unmatched)\t%i\n' % len(unmatched))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
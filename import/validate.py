@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+# Copyright 2015 Sam Thursfield
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Check imported data against software-integration-ontology.owl.
+
+The ontology is compiled into lookup tables first: the declared classes with
+all of their superclasses, and for each property its kind, domain and range.
+Checking a triple is then a few dictionary lookups, so a graph is checked in
+one pass over its triples, and the importers can check their output as it
+is written (see ValidatingSink) without slowing down much.
+
+These things are reported:
+
+  - properties and classes in the ontology's namespace that it doesn't
+    declare
+  - literal values of object properties, and resources as values of
+    datatype properties
+  - more than one value for a functional property
+  - subjects and objects whose types don't fit a property's domain or range
+  - resources that are in two disjoint classes
+
+Domain and range checks need the types of every resource, which may come
+later in the input, so they are done at the end. Resources with no type at
+all aren't checked.
+
+To check some files, or a snapshot:
+
+    python3 import/validate.py definitions.nt
+
+To only check some resources of a snapshot, for example those changed by the
+last import:
+
+    python3 import/validate.py graph.sqlite --subject http://... --subject ...
+
+'''
+
+
+import rdflib
+import rdflib.collection
+
+import argparse
+import collections
+import os
+import sys
+
+import helpers
+import snapshot
+
+
+RDF = rdflib.RDF
+RDFS = rdflib.RDFS
+OWL = rdflib.OWL
+
+DEFAULT_ONTOLOGY = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'software-integration-ontology.owl')
+
+PROPERTY_TYPES = {
+    OWL.ObjectProperty: 'object',
+    OWL.DatatypeProperty: 'datatype',
+    OWL.FunctionalProperty: None,
+    OWL.InverseFunctionalProperty: None,
+    OWL.AnnotationProperty: None,
+    RDF.Property: None,
+}
+
+CLASS_TYPES = {OWL.Class, RDFS.Class}
+
+# How many example subjects to keep for each kind of violation.
+MAX_EXAMPLES = 3
+
+
+def parse_ontology(path=DEFAULT_ONTOLOGY):
+    '''Parse an ontology file into an rdflib.Graph.'''
+    graph = rdflib.Graph()
+    try:
+        graph.parse(path, format=snapshot.guess_format(path))
+    except Exception as e:
+        raise RuntimeError("Unable to parse ontology %s: %s" % (path, e))
+    return graph
+
+
+Property = collections.namedtuple(
+    'Property', ['kind', 'functional', 'domain', 'range'])
+
+
+class Ontology():
+    '''Lookup tables compiled from an OWL ontology.'''
+
+    def __init__(self, graph, aliases=helpers.NAMESPACE_ALIASES):
+        self.aliases = aliases
+        self.namespaces = set(aliases.values())
+
+        self.classes = set()
+        for class_type in CLASS_TYPES:
+            self.classes.update(s for s in graph.subjects(RDF.type, class_type)
+                                if isinstance(s, rdflib.URIRef))
+        for predicate in (RDFS.subClassOf, OWL.equivalentClass):
+            self.classes.update(s for s in graph.subjects(predicate, None)
+                                if isinstance(s, rdflib.URIRef))
+
+        self.superclasses = self._superclasses(graph)
+        self.disjoint = collections.defaultdict(set)
+        for a, b in graph.subject_objects(OWL.disjointWith):
+            self.disjoint[a].add(b)
+            self.disjoint[b].add(a)
+
+        self.properties = self._properties(graph)
+
+    @classmethod
+    def load(cls, path=DEFAULT_ONTOLOGY):
+        return cls(parse_ontology(path))
+
+    def _superclasses(self, graph):
+        # Each class, mapped to itself and every class it is a subclass of or
+        # equivalent to, directly or indirectly.
+        parents = collections.defaultdict(set)
+        for s, o in graph.subject_objects(RDFS.subClassOf):
+            parents[s].add(o)
+        for s, o in graph.subject_objects(OWL.equivalentClass):
+            parents[s].add(o)
+            parents[o].add(s)
+
+        result = {}
+        for cls in set(parents) | self.classes:
+            seen = {cls}
+            todo = [cls]
+            while todo:
+                for parent in parents.get(todo.pop(), ()):
+                    if parent not in seen:
+                        seen.add(parent)
+                        todo.append(parent)
+            result[cls] = frozenset(seen)
+        return result
+
+    def _class_set(self, graph, node):
+        '''Return the classes that 'node' stands for, following unionOf.'''
+        if node is None:
+            return None
+        union = graph.value(node, OWL.unionOf)
+        if union is not None:
+            return frozenset(rdflib.collection.Collection(graph, union))
+        if (node, RDF.type, RDFS.Datatype) in graph or \
+                str(node).startswith(str(rdflib.XSD)):
+            # Literal ranges are covered by the 'datatype' kind.
+            return None
+        return frozenset([node])
+
+    def _properties(self, graph):
+        declared = {}
+        for property_type, kind in PROPERTY_TYPES.items():
+            for s in graph.subjects(RDF.type, property_type):
+                declared.setdefault(s, set()).add(property_type)
+        for s in graph.subjects(RDFS.subPropertyOf, None):
+            declared.setdefault(s, set())
+
+        properties = {}
+        for prop, types in declared.items():
+            kinds = set(PROPERTY_TYPES[t] for t in types) - {None}
+            properties[prop] = Property(
+                kind=kinds.pop() if len(kinds) == 1 else None,
+                functional=OWL.FunctionalProperty in types,
+                domain=self._class_set(graph, graph.value(prop, RDFS.domain)),
+                range=self._class_set(graph, graph.value(prop, RDFS.range)))
+        return properties
+
+    def canonical(self, uri):
+        if isinstance(uri, rdflib.URIRef):
+            return rdflib.URIRef(helpers.canonical_iri(uri, self.aliases))
+        return uri
+
+    def in_namespace(self, uri):
+        return any(uri.startswith(namespace) for namespace in self.namespaces)
+
+
+class Validator():
+    '''Check a stream of triples against an Ontology.
+
+    Call check() with the triples, in as many batches as you like, then
+    finish() to do the checks that need every type to be known. The results
+    are in 'violations': (kind, term, detail) -> [count, example subjects].
+
+    The importers' streamed output repeats some triples, such as those of a
+    stratum that is in several systems. Each distinct triple is counted once
+    in 'triple_count', and each subject once per violation, so the figures
+    describe the graph rather than the stream. This means remembering a hash
+    of every triple checked.
+
+    '''
+
+    def __init__(self, ontology):
+        self.ontology = ontology
+        self.violations = collections.OrderedDict()
+        self.triple_count = 0
+        self._seen_triples = set()
+        self._seen_violations = set()
+
+        # Subject -> frozenset of (canonical) classes. The sets are interned,
+        # as there are only a few different combinations of types.
+        self.types = {}
+        self._type_sets = {}
+        # Resource -> set of properties whose domain or range it must fit.
+        self.pending_domain = collections.defaultdict(set)
+        self.pending_range = collections.defaultdict(set)
+        # (subject, property) -> value, for functional properties.
+        self.functional_values = {}
+
+        # Per-predicate and per-class lookups, filled in as they are seen.
+        self._predicates = {}
+        self._classes = {}
+        self._expanded = {}
+        self._disjoint = {}
+
+    def violation(self, kind, term, detail, subject):
+        key = (kind, term, detail)
+        if key + (subject,) in self._seen_violations:
+            return
+        self._seen_violations.add(key + (subject,))
+        entry = self.violations.get(key)
+        if entry is None:
+            entry = self.violations[key] = [0, []]
+        entry[0] += 1
+        if len(entry[1]) < MAX_EXAMPLES:
+            entry[1].append(subject)
+
+    def _predicate(self, predicate):
+        info = self._predicates.get(predicate)
+        if info is None:
+            ontology = self.ontology
+            canonical = ontology.canonical(predicate)
+            prop = ontology.properties.get(canonical)
+            undeclared = prop is None and ontology.in_namespace(canonical)
+            info = self._predicates[predicate] = (canonical, prop, undeclared)
+        return info
+
+    def _class(self, cls):
+        info = self._classes.get(cls)
+        if info is None:
+            ontology = self.ontology
+            canonical = ontology.canonical(cls)
+            undeclared = canonical not in ontology.classes and \
+                ontology.in_namespace(canonical)
+            info = self._classes[cls] = (canonical, undeclared)
+        return info
+
+    def _add_type(self, subject, cls):
+        types = self.types.get(subject, frozenset()) | {cls}
+        self.types[subject] = self._type_sets.setdefault(types, types)
+
+    def check(self, triples):
+        '''Check some triples. Returns the Validator.'''
+        seen_triples = self._seen_triples
+        for s, p, o in triples:
+            triple_hash = hash((s, p, o))
+            if triple_hash not in seen_triples:
+                seen_triples.add(triple_hash)
+                self.triple_count += 1
+            if p == RDF.type:
+                cls, undeclared = self._class(o)
+                if undeclared:
+                    self.violation('undeclared-class', cls, None, s)
+                self._add_type(s, cls)
+                continue
+
+            canonical, prop, undeclared = self._predicate(p)
+            if prop is None:
+                if undeclared:
+                    self.violation('undeclared-property', canonical, None, s)
+                continue
+
+            is_literal = isinstance(o, rdflib.Literal)
+            if prop.kind == 'object' and is_literal:
+                self.violation('literal-value', canonical, None, s)
+            elif prop.kind == 'datatype' and not is_literal:
+                self.violation('resource-value', canonical, None, s)
+
+            if prop.functional:
+                key = (s, canonical)
+                previous = self.functional_values.setdefault(key, o)
+                if previous != o:
+                    self.violation('functional', canonical, None, s)
+
+            if prop.domain is not None:
+                self.pending_domain[s].add(canonical)
+            if prop.range is not None and not is_literal:
+                self.pending_range[o].add(canonical)
+        return self
+
+    def forget(self, keys):
+        '''Forget values of (subject, predicate) pairs that were replaced.'''
+        for s, p in keys:
+            canonical, prop, undeclared = self._predicate(p)
+            if prop is not None and prop.functional:
+                self.functional_values.pop((s, canonical), None)
+
+    def _expand(self, types):
+        expanded = self._expanded.get(types)
+        if expanded is None:
+            superclasses = self.ontology.superclasses
+            expanded = frozenset().union(
+                *(superclasses.get(cls, (cls,)) for cls in types))
+            self._expanded[types] = expanded
+
+            disjoint = self.ontology.disjoint
+            self._disjoint[types] = set(
+                (cls, other) for cls in expanded
+                for other in disjoint.get(cls, ())
+                if other in expanded and str(cls) < str(other))
+        return expanded
+
+    def finish(self, type_lookup=None):
+        '''Run the checks that need the types of every resource.
+
+        If 'type_lookup' is given, it's called for resources with no known
+        types and should return their types. This allows checking just part
+        of a graph, as validate_subjects() does.
+
+        '''
+        def types_of(node):
+            types = self.types.get(node)
+            if types is None and type_lookup is not None:
+                for cls in type_lookup(node):
+                    self._add_type(node, self._class(cls)[0])
+                types = self.types.get(node)
+            return types
+
+        properties = self.ontology.properties
+        for pending, check, field in (
+                (self.pending_domain, 'domain', 'domain'),
+                (self.pending_range, 'range', 'range')):
+            for node, props in pending.items():
+                types = types_of(node)
+                if types is None:
+                    continue
+                expanded = self._expand(types)
+                for prop in props:
+                    allowed = getattr(properties[prop], field)
+                    if expanded.isdisjoint(allowed):
+                        self.violation(check, prop, types, node)
+            pending.clear()
+
+        for subject, types in self.types.items():
+            self._expand(types)
+            for a, b in self._disjoint[types]:
+                self.violation('disjoint', a, b, subject)
+        return self
+
+    def count(self):
+        return sum(count for count, examples in self.violations.values())
+
+
+MESSAGES = {
+    'undeclared-class': "Class %(term)s isn't declared by the ontology",
+    'undeclared-property': "Property %(term)s isn't declared by the ontology",
+    'literal-value': "Object property %(term)s has a literal value",
+    'resource-value': "Datatype property %(term)s has a resource as value",
+    'functional': "Functional property %(term)s has more than one value",
+    'domain': "Subject of %(term)s has types %(detail)s, outside its domain",
+    'range': "Value of %(term)s has types %(detail)s, outside its range",
+    'disjoint': "Resource is in disjoint classes %(term)s and %(detail)s",
+}
+
+
+def format_violations(validator, namespace_manager=None):
+    '''Return a readable report of the violations found, one per line.'''
+    def name(term):
+        if namespace_manager is not None and isinstance(term, rdflib.URIRef):
+            return term.n3(namespace_manager)
+        return '<%s>' % term
+
+    lines = []
+    for (kind, term, detail), (count, examples) in \
+            validator.violations.items():
+        if isinstance(detail, frozenset):
+            detail = ', '.join(sorted(name(cls) for cls in detail))
+        elif detail is not None:
+            detail = name(detail)
+        message = MESSAGES[kind] % {'term': name(term), 'detail': detail}
+        lines.append('%s: %i times, e.g. %s' % (
+            message, count, ', '.join(name(s) for s in examples)))
+    return lines
+
+
+def namespace_manager_for(ontology):
+    namespace_manager = rdflib.namespace.NamespaceManager(rdflib.Graph())
+    for namespace in ontology.namespaces:
+        namespace_manager.bind('software', namespace, override=True)
+    return namespace_manager
+
+
+def report(validator, stream=sys.stderr):
+    '''Write the violations to 'stream'. Returns how many there were.'''
+    namespace_manager = namespace_manager_for(validator.ontology)
+    for line in format_violations(validator, namespace_manager):
+        stream.write(line + '\n')
+    count = validator.count()
+    stream.write('%i triples checked, %i violations\n' %
+                 (validator.triple_count, count))
+    return count
+
+
+def validate_subjects(ontology, graph, subjects):
+    '''Check only the triples about 'subjects' in 'graph'.
+
+    This is for checking a large graph after a small change. The types of
+    resources that are referred to, but aren't in 'subjects', are looked up
+    in the graph.
+
+    '''
+    validator = Validator(ontology)
+    for subject in subjects:
+        validator.check(graph.triples((subject, None, None)))
+    validator.finish(lambda node: graph.objects(node, RDF.type))
+    return validator
+
+
+class ValidatingSink():
+    '''Sink that checks each batch before passing it to another sink.
+
+    Only the triples in each batch are looked at, so this adds one pass over
+    the new triples to an import. The report is written when the sink is
+    closed. See helpers.GraphSink for the sink interface.
+
+    '''
+    def __init__(self, sink, validator, stream=sys.stderr):
+        self.sink = sink
+        self.validator = validator
+        self.stream = stream
+
+    def write(self, batch):
+        self.validator.forget(batch.replaced)
+        self.validator.check(batch.triples)
+        self.sink.write(batch)
+
+    def close(self):
+        self.sink.close()
+        self.validator.finish()
+        report(self.validator, self.stream)
+
+    @property
+    def count(self):
+        return getattr(self.sink, 'count', None)
+
+
+def add_validate_arguments(parser):
+    parser.add_argument('--validate', nargs='?', const=DEFAULT_ONTOLOGY,
+                        metavar='ONTOLOGY',
+                        help="Check the output against the ontology, and "
+                             "report problems to stderr (default ontology: "
+                             "%s)" % os.path.basename(DEFAULT_ONTOLOGY))
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Check data against the software integration ontology")
+    parser.add_argument('input_locations', type=str, nargs='+',
+                        help="RDF files written by the importers, or a "
+                             "snapshot")
+    parser.add_argument('--ontology', type=str, default=DEFAULT_ONTOLOGY,
+                        help="Ontology to check against (default: "
+                             "%(default)s)")
+    parser.add_argument('--subject', type=str, action='append',
+                        help="Only check triples about this resource; may be "
+                             "given many times")
+    return parser
+
+
+def main():
+    args = argument_parser().parse_args()
+    ontology = Ontology.load(args.ontology)
+
+    if args.subject:
+        graph = snapshot.load_graph(args.input_locations)
+        validator = validate_subjects(
+            ontology, graph, [rdflib.URIRef(s) for s in args.subject])
+    else:
+        validator = Validator(ontology)
+        snapshot.stream_triples(args.input_locations,
+                                lambda triple: validator.check([triple]))
+        validator.finish()
+
+    if report(validator, sys.stdout) > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
@@ -0,0 +1,713 @@
+#!/usr/bin/env python3
+# Copyright 2015 Sam Thursfield
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Keep the graph of a definitions tree up to date while it is edited.
+
+    python3 import/watch_definitions.py definitions/ http://example.com/ \\
+        --output-file definitions.nt --socket definitions.sock
+
+The tree is imported once, as baserock_definitions.py would, and then
+watched for changes using inotify. Where inotify isn't available, or with
+--poll, the tree is scanned for changes every few seconds instead.
+
+When files change, only those files are parsed again, and only the parts of
+the graph built from them are rebuilt. The graph is made of units: one for
+each system, covering the system and the strata it contains, and one for
+each stratum and architecture, covering the stratum's chunks and artifacts.
+The .morph files that each unit reads while it is built are recorded, so
+the units that a change affects are known without having to understand
+the definitions format here. A count of how many units produced each triple
+is kept, so a triple is only removed when no unit produces it any more.
+
+Because the units are built separately, the graph is the union of their
+triples. As with helpers.StreamSink, a value that Resource.set() replaces
+in a full import, such as which commit a shared Git repo contains, can end
+up with all the values that different units gave it.
+
+The updated graph can be published in two ways:
+
+  - --output-file rewrites a file with the whole graph after each change.
+    The file is replaced atomically, so sparql_endpoint.py and browser.py
+    can serve it and will reload it when it changes.
+  - --socket listens on a Unix socket. Each client is sent the whole graph
+    as a patch in the format of graph_diff.py, then a patch with the
+    triples removed and added by each change. Each patch starts with a
+    '--- ' line.
+
+A .morph file that fails to parse is ignored until it is fixed. If a unit
+fails to build, for example because it refers to a file that doesn't exist
+yet, its previous triples are kept.
+
+'''
+
+
+import rdflib
+
+import argparse
+import collections
+import ctypes
+import ctypes.util
+import errno
+import io
+import logging
+import os
+import select
+import socket
+import stat
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+import baserock_definitions
+import git_objects
+import graph_diff
+import helpers
+import morph_cache
+
+
+class RecordingDict(dict):
+    '''A dict that records which keys are read while 'reads' is a set.'''
+
+    reads = None
+
+    def __getitem__(self, key):
+        if self.reads is not None:
+            self.reads.add(key)
+        return super(RecordingDict, self).__getitem__(key)
+
+
+def is_definitions_file(path):
+    return path.endswith('.morph') or \
+        os.path.basename(path) in ('DEFAULTS', 'VERSION')
+
+
+def scan_tree(path):
+    '''Return {path: (mtime, size)} for the definitions files in 'path'.'''
+    result = {}
+    for dirname, dirnames, filenames in os.walk(path):
+        if '.git' in dirnames:
+            dirnames.remove('.git')
+        for filename in filenames:
+            file_path = os.path.join(dirname, filename)
+            if is_definitions_file(file_path):
+                try:
+                    st = os.stat(file_path)
+                except OSError:
+                    continue
+                result[file_path] = (st.st_mtime_ns, st.st_size)
+    return result
+
+
+class PollingWatcher():
+    '''Find changes in a directory tree by scanning it at intervals.'''
+
+    def __init__(self, path, interval=2.0):
+        self.path = path
+        self.interval = interval
+        self.files = scan_tree(path)
+
+    def wait(self):
+        '''Block until some files have changed, and return their paths.'''
+        while True:
+            time.sleep(self.interval)
+            files = scan_tree(self.path)
+            changed = set(path for path in files.keys() | self.files.keys()
+                          if files.get(path) != self.files.get(path))
+            self.files = files
+            if changed:
+                return changed
+
+    def close(self):
+        pass
+
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class InotifyWatcher():
+    '''Find changes in a directory tree using Linux's inotify.
+
+    inotify watches are per directory, so one is added for every directory
+    in the tree, including ones created later. Events are collected until
+    none have arrived for 'settle_time' seconds, so that an editor that
+    writes a file in several steps causes one update rather than several.
+
+    '''
+
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | \
+        IN_DELETE | IN_DELETE_SELF
+
+    def __init__(self, path, settle_time=0.2):
+        self.path = path
+        self.settle_time = settle_time
+
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError("C library not found")
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError("inotify is not available")
+
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        # Watch descriptor -> directory path
+        self.watches = {}
+        self.add_tree(path)
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path),
+                                         self.MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                raise OSError(error, "Too many inotify watches; increase "
+                                     "fs.inotify.max_user_watches or use "
+                                     "--poll")
+            # The directory has probably been removed again already.
+            logging.debug("Unable to watch %s: %s", path,
+                          os.strerror(error))
+            return
+        self.watches[wd] = path
+
+    def add_tree(self, path):
+        for dirname, dirnames, filenames in os.walk(path):
+            if '.git' in dirnames:
+                dirnames.remove('.git')
+            self.add_watch(dirname)
+
+    def _read_events(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return None
+        data = os.read(self.fd, 65536)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _INOTIFY_EVENT.unpack_from(data, offset)
+            offset += _INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def wait(self):
+        '''Block until some files have changed, and return their paths.
+
+        The path of a directory is returned if it was created, moved or
+        removed as a whole, and the path of the whole tree if the kernel's
+        event queue overflowed.
+
+        '''
+        changed = set()
+        events = self._read_events(None)
+        while events:
+            for wd, mask, name in events:
+                if mask & IN_Q_OVERFLOW:
+                    changed.add(self.path)
+                    continue
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                dirname = self.watches.get(wd)
+                if dirname is None:
+                    continue
+                if mask & IN_DELETE_SELF:
+                    changed.add(dirname)
+                    continue
+                path = os.path.join(dirname, name)
+                if mask & IN_ISDIR:
+                    if name == '.git':
+                        continue
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        self.add_tree(path)
+                    changed.add(path)
+                elif is_definitions_file(path):
+                    changed.add(path)
+            events = self._read_events(self.settle_time)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def make_watcher(path, poll_interval=None):
+    '''Return an InotifyWatcher, or a PollingWatcher if that isn't possible.'''
+    if poll_interval is None:
+        try:
+            return InotifyWatcher(path)
+        except OSError as e:
+            logging.warning("Unable to use inotify (%s); polling instead", e)
+            poll_interval = 2.0
+    return PollingWatcher(path, poll_interval)
+
+
+Unit = collections.namedtuple('Unit', ['triples', 'reads', 'strata'])
+
+EMPTY_UNIT = Unit(frozenset(), frozenset(), frozenset())
+
+
+class DefinitionsGraph():
+    '''The graph for a definitions tree, updated one unit at a time.
+
+    A unit is identified by ('system', path) or ('stratum', path, arch).
+    Each function in 'listeners' is called as listener(removed, added)
+    after every update that changes the graph, with 'lock' held.
+
+    '''
+
+    def __init__(self, toplevel_path, base_uri, limit_architectures=None,
+                 store='default'):
+        location = git_objects.parse_location(toplevel_path)
+        if location is not None or not os.path.isdir(toplevel_path):
+            raise RuntimeError("Watching needs a definitions working tree, "
+                               "not %s" % toplevel_path)
+
+        self.toplevel_path = os.path.normpath(toplevel_path)
+        self.limit_architectures = limit_architectures
+
+        self.importer = baserock_definitions.BaserockDefinitionsImporter(
+            base_uri, batched=True, store=store)
+        self.parsed_files = RecordingDict()
+        self.importer.parsed_files = self.parsed_files
+        self.defaults = None
+
+        self.graph = rdflib.Graph(store=store)
+        self.graph.bind('software', baserock_definitions.SOFTWARE)
+
+        # Key -> Unit
+        self.units = {}
+        # Key of a stratum unit -> keys of the systems that contain it
+        self.stratum_users = collections.defaultdict(set)
+        # Path -> keys of the units that read it
+        self.dependents = collections.defaultdict(set)
+        # Triple -> number of units that produced it
+        self.counts = {}
+
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.listeners = []
+
+    def load(self, jobs=1, cache=None):
+        '''Import the whole tree.'''
+        defaults, systems = self.importer.load_definitions(
+            self.toplevel_path, jobs=jobs, cache=cache)
+        self.defaults = defaults
+        return self._rebuild([('system', path) for path in systems], [])
+
+    def _build(self, key):
+        '''Build one unit, returning a Unit.
+
+        If building it fails, the unit's previous triples are kept, but the
+        files read this time are added to its dependencies, so that it is
+        tried again when any of them change.
+
+        '''
+        importer = self.importer
+        importer.resource_cache = {}
+        self.parsed_files.reads = reads = set()
+        strata = set()
+        try:
+            if key[0] == 'system':
+                contents = self.parsed_files[key[1]]
+                arch = contents['arch']
+                if self.limit_architectures is None or \
+                        arch in self.limit_architectures:
+                    artifact = importer.add_system_artifact(contents)
+                    for entry in contents.get('strata', []):
+                        stratum_file = os.path.join(self.toplevel_path,
+                                                    entry['morph'])
+                        importer.add_system_stratum(
+                            self.toplevel_path, artifact, entry, arch,
+                            self.defaults)
+                        strata.add(('stratum', stratum_file, arch))
+            else:
+                kind, path, arch = key
+                importer.build_stratum(self.toplevel_path,
+                                       self.parsed_files[path], arch,
+                                       self.defaults)
+            return Unit(set(importer.take_batch().triples), reads, strata)
+        except Exception as e:
+            importer.take_batch()
+            logging.warning("Unable to build %s %s: %r", key[0],
+                            os.path.relpath(key[1], self.toplevel_path), e)
+            old = self.units.get(key, EMPTY_UNIT)
+            return Unit(old.triples, old.reads | reads, old.strata)
+        finally:
+            self.parsed_files.reads = None
+
+    def _rebuild(self, build, remove):
+        '''Rebuild the units in 'build' and remove those in 'remove'.
+
+        Strata are built or removed as the systems that contain them
+        change. Returns the triples removed from and added to the graph.
+
+        '''
+        before = {}
+
+        def count(triples, delta):
+            for triple in triples:
+                current = self.counts.get(triple, 0)
+                before.setdefault(triple, current)
+                if current + delta:
+                    self.counts[triple] = current + delta
+                else:
+                    del self.counts[triple]
+
+        def replace(key, unit):
+            # Most of a rebuilt unit's triples are usually unchanged, so
+            # only the differences are counted.
+            old = self.units.pop(key, EMPTY_UNIT)
+            count(old.triples - unit.triples, -1)
+            count(unit.triples - old.triples, 1)
+            for path in old.reads - unit.reads:
+                self.dependents[path].discard(key)
+            for path in unit.reads:
+                self.dependents[path].add(key)
+            for stratum_key in old.strata - unit.strata:
+                self.stratum_users[stratum_key].discard(key)
+            for stratum_key in unit.strata:
+                self.stratum_users[stratum_key].add(key)
+            if unit is not EMPTY_UNIT:
+                self.units[key] = unit
+            return old
+
+        systems = sorted(key for key in build if key[0] == 'system')
+        requested = set(key for key in build if key[0] == 'stratum')
+        # Strata that may have gained or lost users.
+        strata = set(requested)
+        built = 0
+
+        for key in remove:
+            strata.update(replace(key, EMPTY_UNIT).strata)
+
+        for key in systems:
+            unit = self._build(key)
+            built += 1
+            old = replace(key, unit)
+            strata.update(old.strata | unit.strata)
+
+        for key in sorted(strata):
+            if not self.stratum_users[key]:
+                del self.stratum_users[key]
+                replace(key, EMPTY_UNIT)
+            elif key in requested or key not in self.units:
+                replace(key, self._build(key))
+                built += 1
+
+        removed = [triple for triple, n in before.items()
+                   if n and triple not in self.counts]
+        added = [triple for triple, n in before.items()
+                 if not n and triple in self.counts]
+        for triple in removed:
+            self.graph.remove(triple)
+        self.graph.addN((s, p, o, self.graph) for s, p, o in added)
+        if removed or added:
+            self.generation += 1
+            for listener in self.listeners:
+                listener(removed, added)
+
+        logging.info("Rebuilt %i units: %i triples removed, %i added; graph "
+                     "has %i triples", built, len(removed), len(added),
+                     len(self.graph))
+        return removed, added
+
+    def _reparse(self, paths):
+        '''Parse any of 'paths' that have changed, returning those that did.'''
+        changed = set()
+        defaults_file = os.path.join(self.toplevel_path, 'DEFAULTS')
+        for path in sorted(paths):
+            if path == defaults_file:
+                try:
+                    defaults = self.importer.load_defaults(self.toplevel_path)
+                except Exception as e:
+                    logging.warning("Ignoring DEFAULTS: %r", e)
+                    continue
+                if defaults != self.defaults:
+                    self.defaults = defaults
+                    changed.add(path)
+            elif path.endswith('.morph'):
+                if os.path.isfile(path):
+                    try:
+                        contents = baserock_definitions.parse_morph_file(path)
+                    except Exception as e:
+                        logging.warning("Ignoring %s until it is fixed: %r",
+                                        os.path.relpath(path,
+                                                        self.toplevel_path), e)
+                        continue
+                    if contents != self.parsed_files.get(path):
+                        self.parsed_files[path] = contents
+                        changed.add(path)
+                elif path in self.parsed_files:
+                    del self.parsed_files[path]
+                    changed.add(path)
+        return changed
+
+    def update(self, paths):
+        '''Update the graph after the files or directories in 'paths' changed.
+
+        Returns the triples removed from and added to the graph.
+
+        '''
+        files = set()
+        for path in paths:
+            path = os.path.normpath(path)
+            if path == os.path.normpath(self.toplevel_path):
+                files.add(os.path.join(path, 'DEFAULTS'))
+            files.add(path)
+            # A directory that was created, moved or removed.
+            prefix = os.path.join(path, '')
+            files.update(known for known in self.parsed_files
+                         if known.startswith(prefix))
+            if os.path.isdir(path):
+                files.update(baserock_definitions.find_morph_files(path))
+
+        with self.lock:
+            changed = self._reparse(files)
+            if not changed:
+                return [], []
+
+            if os.path.join(self.toplevel_path, 'DEFAULTS') in changed:
+                build = set(self.units)
+            else:
+                build = set()
+                for path in changed:
+                    build.update(self.dependents.get(path, ()))
+
+            remove = set()
+            for path in changed:
+                key = ('system', path)
+                contents = self.parsed_files.get(path)
+                if contents is not None and contents.get('kind') == 'system':
+                    build.add(key)
+                elif key in self.units:
+                    build.discard(key)
+                    remove.add(key)
+
+            logging.info("%i files changed", len(changed))
+            return self._rebuild(build, remove)
+
+
+def ntriples_line(triple):
+    s, p, o = triple
+    return '%s %s %s .\n' % (s.n3(), p.n3(), helpers.ntriples_term(o))
+
+
+def format_patch(removed, added, old_name, new_name):
+    '''Return a patch in the format of graph_diff.py, as bytes.'''
+    changes = sorted([('-', ntriples_line(triple)) for triple in removed] +
+                     [('+', ntriples_line(triple)) for triple in added],
+                     key=lambda change: change[1])
+    stream = io.BytesIO()
+    graph_diff.write_patch(changes, stream, old_name, new_name)
+    return stream.getvalue()
+
+
+class PatchPublisher():
+    '''Send the changes to a DefinitionsGraph to clients of a Unix socket.'''
+
+    def __init__(self, definitions, socket_path, send_timeout=10.0):
+        self.definitions = definitions
+        self.socket_path = socket_path
+        self.send_timeout = send_timeout
+        self.clients = []
+
+        # Remove a socket left behind by an earlier run, but nothing else.
+        try:
+            if stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                os.unlink(socket_path)
+        except FileNotFoundError:
+            pass
+
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.server.bind(socket_path)
+        except OSError as e:
+            raise RuntimeError("Unable to listen on %s: %s" %
+                               (socket_path, e))
+        self.server.listen(5)
+
+        definitions.listeners.append(self.publish)
+        thread = threading.Thread(target=self._accept, daemon=True)
+        thread.start()
+
+    def _send(self, client, data):
+        try:
+            client.sendall(data)
+            return True
+        except OSError as e:
+            logging.info("Dropping client: %s", e)
+            client.close()
+            return False
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                # The socket was closed.
+                return
+            client.settimeout(self.send_timeout)
+            definitions = self.definitions
+            with definitions.lock:
+                data = format_patch([], definitions.graph, '/dev/null',
+                                    'generation %i' % definitions.generation)
+                if self._send(client, data):
+                    self.clients.append(client)
+
+    def publish(self, removed, added):
+        '''Send a patch to every client. Called with the graph's lock held.'''
+        generation = self.definitions.generation
+        data = format_patch(removed, added, 'generation %i' % (generation - 1),
+                            'generation %i' % generation)
+        self.clients = [client for client in self.clients
+                        if self._send(client, data)]
+
+    def close(self):
+        self.server.close()
+        for client in self.clients:
+            client.close()
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+
+
+def write_output_file(graph, path, output_format, graph_name=None,
+                      compress=False):
+    '''Write 'graph' to 'path', replacing the old file atomically.'''
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            helpers.write_graph(graph, f, output_format=output_format,
+                                graph_name=graph_name, compress=compress)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Keep the graph of a definitions tree up to date as it "
+                    "changes")
+    parser.add_argument('input_location', type=str,
+                        help="Path to the root of the definitions repository")
+    parser.add_argument('output_location', type=str,
+                        help="Location of the resulting resources (base URI)")
+    parser.add_argument('--architectures', '-a',
+                        action=baserock_definitions.AppendCommaSeparatedListAction,
+                        help="Only import definitions for the given "
+                             "architectures.")
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help="Number of worker processes to use for parsing "
+                             ".morph files on startup (default: %(default)s)")
+    parser.add_argument('--cache-dir', type=str,
+                        default=morph_cache.default_cache_dir(),
+                        help="Where to keep the cache of parsed .morph files "
+                             "(default: %(default)s)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Parse every .morph file on startup, ignoring "
+                             "and not updating the cache.")
+    parser.add_argument('--poll', nargs='?', type=float, const=2.0,
+                        metavar='SECONDS',
+                        help="Scan the tree for changes at intervals instead "
+                             "of using inotify (default interval: "
+                             "%(const)s)")
+    parser.add_argument('--output-file', type=str,
+                        help="File to write the whole graph to after each "
+                             "change")
+    parser.add_argument('--output-format', choices=helpers.OUTPUT_FORMATS,
+                        default='ntriples',
+                        help="Format of --output-file (default: %(default)s)")
+    parser.add_argument('--gzip', action='store_true',
+                        help="Compress --output-file with gzip.")
+    parser.add_argument('--socket', type=str,
+                        help="Unix socket to send the graph and each change "
+                             "to, as patches")
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help="Log each update to stderr.")
+    helpers.add_store_argument(parser)
+    return parser
+
+
+def main():
+    args = argument_parser().parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else
+                        logging.WARNING)
+
+    definitions = DefinitionsGraph(
+        args.input_location, args.output_location,
+        limit_architectures=args.architectures, store=args.store)
+
+    def write_output():
+        if args.output_file:
+            write_output_file(definitions.graph, args.output_file,
+                              args.output_format,
+                              graph_name=args.output_location,
+                              compress=args.gzip)
+
+    # Start watching first, so that nothing that changes during the import
+    # is missed.
+    watcher = make_watcher(args.input_location, args.poll)
+
+    cache = None
+    if not args.no_cache:
+        cache = morph_cache.MorphologyCache(args.cache_dir,
+                                            args.input_location)
+    with definitions.lock:
+        definitions.load(jobs=args.jobs, cache=cache)
+        write_output()
+
+    publisher = None
+    if args.socket:
+        publisher = PatchPublisher(definitions, args.socket)
+
+    try:
+        while True:
+            removed, added = definitions.update(watcher.wait())
+            if removed or added:
+                with definitions.lock:
+                    write_output()
+    finally:
+        watcher.close()
+        if publisher is not None:
+            publisher.close()
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)
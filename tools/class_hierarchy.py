@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# Copyright 2015 Sam Thursfield
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+'''Draw the class hierarchy of an ontology as a GraphViz graph.
+
+Only rdfs:subClassOf and owl:equivalentClass relationships are kept, so
+the input can be the ontology on its own or the ontology together with
+millions of instance triples. The input is streamed rather than loaded.
+N-Triples and N-Quads are filtered line by line without being fully
+parsed, and snapshots are queried through their predicate index.
+
+URIs are shortened using the prefixes declared in the input, plus a few
+well-known ones. The DOT output is cached, keyed by the SHA1 of the input,
+so running it again on the same data is instant.
+
+    python3 tools/class_hierarchy.py software-integration-ontology.owl \\
+        -o classes.png
+
+If the output filename ends with .png, .svg or .pdf then `dot` is run to
+render it, otherwise the DOT text is written.
+
+'''
+
+
+import rdflib
+
+import argparse
+import hashlib
+import os
+import re
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'import'))
+
+import morph_cache
+import snapshot
+
+
+# Increase this whenever the DOT output changes.
+CACHE_FORMAT_VERSION = 1
+
+HIERARCHY_PREDICATES = {
+    rdflib.RDFS.subClassOf: 'subClassOf',
+    rdflib.OWL.equivalentClass: 'equivalentClass',
+}
+
+WELL_KNOWN_PREFIXES = {
+    'rdf': str(rdflib.RDF),
+    'rdfs': str(rdflib.RDFS),
+    'owl': str(rdflib.OWL),
+    'xsd': str(rdflib.XSD),
+    'sio': 'http://baserock.org/software-integration-ontology#',
+    'software': 'http://www.baserock.org/software-integration-ontology#',
+}
+
+RENDERED_FORMATS = ['png', 'svg', 'pdf']
+
+_TERM = rb'(<[^>]*>|_:\S+)'
+_NTRIPLES_HIERARCHY_LINE = re.compile(
+    rb'^\s*' + _TERM + rb'\s+<(' +
+    b'|'.join(re.escape(str(p).encode('utf8'))
+              for p in HIERARCHY_PREDICATES) +
+    rb')>\s+' + _TERM)
+
+
+def _ntriples_term(text):
+    text = text.decode('utf8')
+    if text.startswith('_:'):
+        return rdflib.BNode(text[2:])
+    return rdflib.URIRef(text[1:-1])
+
+
+class HierarchyFilter(rdflib.Graph):
+    '''Graph that drops every triple except class hierarchy triples.
+
+    rdflib's parsers add each triple to the graph as they go, so parsing into
+    one of these never holds more than the hierarchy in memory.
+
+    '''
+    def add(self, triple):
+        if triple[1] in HIERARCHY_PREDICATES:
+            super(HierarchyFilter, self).add(triple)
+        return self
+
+
+def read_hierarchy(path):
+    '''Return (triples, prefixes) for the class hierarchy in 'path'.'''
+    if path.endswith('.sqlite'):
+        graph = snapshot.open_snapshot(path)
+        triples = [triple for predicate in HIERARCHY_PREDICATES
+                   for triple in graph.triples((None, predicate, None))]
+        return triples, dict(graph.namespaces())
+
+    input_format = snapshot.guess_format(path)
+    with snapshot.open_rdf_file(path) as f:
+        if input_format in ('nt', 'nquads'):
+            triples = []
+            for line in f:
+                match = _NTRIPLES_HIERARCHY_LINE.match(line)
+                if match:
+                    predicate = rdflib.URIRef(match.group(2).decode('utf8'))
+                    triples.append((_ntriples_term(match.group(1)),
+                                    predicate,
+                                    _ntriples_term(match.group(3))))
+            return triples, {}
+        else:
+            graph = HierarchyFilter()
+            try:
+                graph.parse(file=f, format=input_format)
+            except Exception as e:
+                raise RuntimeError("Unable to parse %s: %s" % (path, e))
+            return list(graph), dict(graph.namespaces())
+
+
+class PrefixCompactor():
+    '''Shorten URIs to prefix:name form, using the longest matching prefix.'''
+
+    def __init__(self, prefixes):
+        self.prefixes = sorted(((str(namespace), prefix)
+                                for prefix, namespace in prefixes.items()
+                                if prefix),
+                               key=lambda item: len(item[0]), reverse=True)
+        self.cache = {}
+
+    def compact(self, uri):
+        uri = str(uri)
+        if uri not in self.cache:
+            result = uri
+            for namespace, prefix in self.prefixes:
+                if uri.startswith(namespace) and len(uri) > len(namespace):
+                    result = '%s:%s' % (prefix, uri[len(namespace):])
+                    break
+            self.cache[uri] = result
+        return self.cache[uri]
+
+
+def dot_string(text):
+    return '"%s"' % text.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def hierarchy_to_dot(triples, prefixes, include_blank_nodes=False):
+    '''Return the class hierarchy as GraphViz DOT text.'''
+    all_prefixes = dict(WELL_KNOWN_PREFIXES)
+    all_prefixes.update(prefixes)
+    compactor = PrefixCompactor(all_prefixes)
+
+    def label(node):
+        if isinstance(node, rdflib.BNode):
+            return '_:%s' % node
+        return compactor.compact(node)
+
+    nodes = set()
+    edges = set()
+    for s, p, o in triples:
+        if not include_blank_nodes and (isinstance(s, rdflib.BNode) or
+                                        isinstance(o, rdflib.BNode)):
+            continue
+        nodes.add(label(s))
+        nodes.add(label(o))
+        edges.add((label(s), HIERARCHY_PREDICATES[p], label(o)))
+
+    lines = ['digraph classes {',
+             '  rankdir=BT;',
+             '  node [shape=box, fontname="sans"];']
+    for node in sorted(nodes):
+        lines.append('  %s;' % dot_string(node))
+    for s, relationship, o in sorted(edges):
+        if relationship == 'equivalentClass':
+            lines.append('  %s -> %s [style=dashed, dir=both, '
+                         'label="equivalentClass"];' %
+                         (dot_string(s), dot_string(o)))
+        else:
+            lines.append('  %s -> %s;' % (dot_string(s), dot_string(o)))
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def input_hash(path, include_blank_nodes):
+    sha1 = hashlib.sha1()
+    sha1.update(('%i %s\n' % (CACHE_FORMAT_VERSION,
+                              include_blank_nodes)).encode('utf8'))
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def class_hierarchy_dot(path, cache_dir=None, include_blank_nodes=False):
+    '''Return DOT text for the class hierarchy in 'path', using the cache.'''
+    if path.endswith('.sqlite'):
+        # Snapshots are queried through an index, so they're already quick,
+        # and hashing them wouldn't be.
+        cache_dir = None
+
+    cache_file = None
+    if cache_dir:
+        cache_file = os.path.join(cache_dir, 'class-hierarchy-%s.dot' %
+                                  input_hash(path, include_blank_nodes))
+        if os.path.exists(cache_file):
+            with open(cache_file) as f:
+                return f.read()
+
+    triples, prefixes = read_hierarchy(path)
+    dot = hierarchy_to_dot(triples, prefixes, include_blank_nodes)
+
+    if cache_file:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_file + '.tmp', 'w') as f:
+            f.write(dot)
+        os.replace(cache_file + '.tmp', cache_file)
+    return dot
+
+
+def write_output(dot, output):
+    extension = os.path.splitext(output)[1][1:] if output else ''
+    if extension in RENDERED_FORMATS:
+        try:
+            subprocess.run(['dot', '-T' + extension, '-o', output],
+                           input=dot.encode('utf8'), check=True)
+        except FileNotFoundError:
+            raise RuntimeError("GraphViz `dot` is needed to write .%s files"
+                               % extension)
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError("`dot` failed: %s" % e)
+    elif output:
+        with open(output, 'w') as f:
+            f.write(dot)
+    else:
+        sys.stdout.write(dot)
+
+
+def argument_parser():
+    parser = argparse.ArgumentParser(
+        description="Draw the class hierarchy of an ontology")
+    parser.add_argument('input_location', type=str,
+                        help="Ontology or data file, or snapshot")
+    parser.add_argument('--output', '-o', type=str,
+                        help="Output file; rendered by `dot` if it ends with "
+                             "%s (default: DOT on stdout)" %
+                             ', '.join('.' + f for f in RENDERED_FORMATS))
+    parser.add_argument('--blank-nodes', action='store_true',
+                        help="Include anonymous classes, such as OWL "
+                             "restrictions")
+    parser.add_argument('--cache-dir', type=str,
+                        default=morph_cache.default_cache_dir(),
+                        help="Where to cache results (default: %(default)s)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Don't use the cache")
+    return parser
+
+
+def main():
+    args = argument_parser().parse_args()
+    cache_dir = None if args.no_cache else args.cache_dir
+    dot = class_hierarchy_dot(args.input_location, cache_dir,
+                              include_blank_nodes=args.blank_nodes)
+    write_output(dot, args.output)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except RuntimeError as e:
+        sys.stderr.write('%s\n' % e)
+        sys.exit(1)